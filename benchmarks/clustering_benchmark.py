@@ -0,0 +1,183 @@
+# Benchmark of the clustering engine on synthetic match graphs.
+#
+# Usage: python benchmarks/clustering_benchmark.py [numberFaces ...]
+#
+# For every size, a synthetic graph is generated: people appear in a
+# contiguous segment of the video, each pair of faces of the same person
+# matches with a probability of 80%, in both directions since the similarity
+# is symmetric, except for 2% of the pairs that are close to the threshold
+# and match in one direction only. A few random false positives are added.
+# The dense graphs ('Graph': 'dense') have people of 500 to 2,000 faces, each
+# matching 256 random faces of its person, the most SearchFaces returns, so
+# the cost of each mutual-match check grows with the length of the rows.
+# Their matches do not depend on the distance between the frames, so the
+# search scheduler agrees on few of their clusters. The
+# recursive propagation previously used by second_function is run as a
+# reference on the sizes it can handle, and the results of both
+# implementations are compared.
+#
+# The search scheduler is also simulated: the faces are searched in frame
+# order, in waves of 100 faces like in second_function, and the matches of
+# the skipped faces are inferred. The benchmark
+# reports the share of SearchFaces calls saved and the share of faces whose
+# cluster is unchanged ('SchedulerAgreement').
+from __future__ import print_function
+
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+
+import clustering
+from search_scheduler import SearchScheduler
+
+
+LEGACY_MAX_FACES = 20000
+
+
+def synthetic_faces(numberFaces, seed=0):
+    rng = random.Random(seed)
+    faces = {}
+    people = []
+    while len(faces) < numberFaces:
+        size = min(rng.randint(5, 60), numberFaces - len(faces))
+        start = rng.randint(0, max(1, numberFaces // 10))
+        faceIds = []
+        for i in range(size):
+            faceId = 'face-{}'.format(len(faces))
+            faces[faceId] = {'FrameNumber': start + i}
+            faceIds.append(faceId)
+        people.append(faceIds)
+
+    allFaceIds = list(faces)
+    for faceId in allFaceIds:
+        faces[faceId]['MatchingFaces'] = []
+    for faceIds in people:
+        for i, faceId in enumerate(faceIds):
+            for otherId in faceIds[i + 1:]:
+                if rng.random() < 0.8:
+                    if rng.random() >= 0.02:
+                        faces[faceId]['MatchingFaces'].append(otherId)
+                        faces[otherId]['MatchingFaces'].append(faceId)
+                    else:
+                        a, b = (faceId, otherId) if rng.random() < 0.5 else (otherId, faceId)
+                        faces[a]['MatchingFaces'].append(b)
+
+    for faceId in allFaceIds:
+        matching = faces[faceId]['MatchingFaces']
+        if rng.random() < 0.05:
+            matching.append(rng.choice(allFaceIds))
+        faces[faceId]['MatchingFaces'] = [i for i in matching if i != faceId][:256]
+
+    return faces
+
+
+def dense_faces(numberFaces, seed=0):
+    rng = random.Random(seed)
+    faces = {}
+    while len(faces) < numberFaces:
+        size = min(rng.randint(500, 2000), numberFaces - len(faces))
+        start = rng.randint(0, max(1, numberFaces // 10))
+        faceIds = ['face-{}'.format(len(faces) + i) for i in range(size)]
+        for i, faceId in enumerate(faceIds):
+            faces[faceId] = {'FrameNumber': start + i}
+        for faceId in faceIds:
+            matching = rng.sample(faceIds, min(257, size))
+            faces[faceId]['MatchingFaces'] = [i for i in matching if i != faceId][:256]
+
+    return faces
+
+
+def sorted_face_ids(faces):
+    return [i[0] for i in sorted(((k, v['FrameNumber']) for k, v in faces.items()), key=lambda item: (item[1], item[0]))]
+
+
+def legacy_cluster_faces(faceIdsSorted, faces):
+    personIds = {}
+    sys.setrecursionlimit(max(10000, 2 * len(faces)))
+
+    def propagate_person_id(faceId):
+        for matchingId in faces[faceId]['MatchingFaces']:
+            if not matchingId in personIds:
+                numberMatchingLoops = 0
+                for matchingId2 in faces[matchingId]['MatchingFaces']:
+                    if faceId in faces[matchingId2]['MatchingFaces']:
+                        numberMatchingLoops = numberMatchingLoops + 1
+                if numberMatchingLoops >= 2:
+                    personIds[matchingId] = personIds[faceId]
+                    propagate_person_id(matchingId)
+
+    personId = 0
+    for faceId in faceIdsSorted:
+        if not faceId in personIds:
+            personId = personId + 1
+            personIds[faceId] = personId
+            propagate_person_id(faceId)
+
+    return personIds
+
+
+def scheduled_matching_faces(faceIdsSorted, faces):
+    scheduler = SearchScheduler(5, 100)
+    matchingFaces = {}
+    for wave in scheduler.waves(faceIdsSorted):
+        for faceId in wave:
+            matchingFaces[faceId] = faces[faceId]['MatchingFaces']
+            scheduler.record(faceId, matchingFaces[faceId])
+    for faceId in scheduler.skipped:
+        matchingFaces[faceId] = scheduler.inferred_matches(faceId)
+    return matchingFaces, len(scheduler.skipped)
+
+
+# Share of faces whose cluster contains exactly the same faces in both results
+def agreement(personIds, otherPersonIds):
+    def clusters(ids):
+        members = {}
+        for faceId, personId in ids.items():
+            members.setdefault(personId, set()).add(faceId)
+        return {faceId: frozenset(members[personId]) for faceId, personId in ids.items()}
+
+    a = clusters(personIds)
+    b = clusters(otherPersonIds)
+    return sum(1 for faceId in a if a[faceId] == b.get(faceId)) / float(len(a))
+
+
+def run(numberFaces, dense=False):
+    faces = dense_faces(numberFaces) if dense else synthetic_faces(numberFaces)
+    faceIdsSorted = sorted_face_ids(faces)
+    numberEdges = sum(len(face['MatchingFaces']) for face in faces.values())
+
+    startTime = time.time()
+    personIds = clustering.cluster_faces(faceIdsSorted, {k: v['MatchingFaces'] for k, v in faces.items()})
+    result = {
+        'Graph': 'dense' if dense else 'sparse',
+        'Faces': numberFaces,
+        'Edges': numberEdges,
+        'People': max(personIds.values()),
+        'Seconds': round(time.time() - startTime, 3)
+    }
+
+    matchingFaces, numberSkipped = scheduled_matching_faces(faceIdsSorted, faces)
+    scheduledPersonIds = clustering.cluster_faces(faceIdsSorted, matchingFaces)
+    result['SearchesSaved'] = round(numberSkipped / float(numberFaces), 3)
+    result['SchedulerAgreement'] = round(agreement(personIds, scheduledPersonIds), 4)
+
+    if numberFaces <= LEGACY_MAX_FACES:
+        startTime = time.time()
+        legacyPersonIds = legacy_cluster_faces(faceIdsSorted, faces)
+        result['LegacySeconds'] = round(time.time() - startTime, 3)
+        result['Identical'] = legacyPersonIds == personIds
+
+    return result
+
+
+if __name__ == '__main__':
+    sizes = [int(i) for i in sys.argv[1:]] or [1000, 10000, 100000]
+    for numberFaces in sizes:
+        print(json.dumps(run(numberFaces), sort_keys=True))
+    for numberFaces in sizes:
+        if numberFaces <= LEGACY_MAX_FACES:
+            print(json.dumps(run(numberFaces, dense=True), sort_keys=True))
@@ -0,0 +1,81 @@
+# Benchmark of the cold start of the handlers: time to import each handler
+# module and to decode the first PNG thumbnail, in fresh processes.
+#
+# Usage: python benchmarks/import_benchmark.py [numberRuns]
+#
+# 'Eager' imports PIL.Image and PIL.ImageDraw before the handler, as the
+# handlers did at module load before PIL was imported lazily. 'Lazy' imports
+# the handler alone. The first decode of a PNG is measured with every
+# format driver, then with PILPlugins=PngImagePlugin. Each measurement is the
+# median of 'numberRuns' processes (default 10) and is printed as one JSON
+# line, with the number of modules loaded.
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FUNCTIONS_DIRECTORY = os.path.join(ROOT_DIRECTORY, 'functions')
+THUMBNAIL = os.path.join(ROOT_DIRECTORY, 'TestVideo', '2017-08-14_21-47-24_thumbnail-00001.png')
+
+IMPORT_CODE = '''
+import sys, time
+start = time.time()
+{preamble}
+import {module}
+print('{{}} {{}}'.format((time.time() - start) * 1000, len(sys.modules)))
+'''
+
+DECODE_CODE = '''
+import sys, time
+from PIL import Image
+start = time.time()
+Image.open({thumbnail!r}).load()
+print('{{}} {{}}'.format((time.time() - start) * 1000, len(sys.modules)))
+'''
+
+
+def measure(code, numberRuns, environment=None):
+    times = []
+    for i in range(numberRuns):
+        output = subprocess.check_output(
+            [sys.executable, '-c', code],
+            cwd=FUNCTIONS_DIRECTORY,
+            env=dict(os.environ, **(environment or {}))
+        )
+        milliseconds, numberModules = output.split()
+        times.append(float(milliseconds))
+    return round(sorted(times)[len(times) // 2], 2), int(numberModules)
+
+
+def run(numberRuns):
+    results = []
+    for module in ('first_function', 'second_function', 'third_function'):
+        for mode, preamble in (('Eager', 'from PIL import Image, ImageDraw'), ('Lazy', '')):
+            milliseconds, numberModules = measure(IMPORT_CODE.format(preamble=preamble, module=module), numberRuns)
+            results.append({
+                'Measure': 'Import',
+                'Module': module,
+                'Mode': mode,
+                'Milliseconds': milliseconds,
+                'Modules': numberModules
+            })
+
+    for mode, environment in (('AllPlugins', {}), ('PngOnly', {'PILPlugins': 'PngImagePlugin'})):
+        milliseconds, numberModules = measure(DECODE_CODE.format(thumbnail=THUMBNAIL), numberRuns, environment)
+        results.append({
+            'Measure': 'FirstDecode',
+            'Mode': mode,
+            'Milliseconds': milliseconds,
+            'Modules': numberModules
+        })
+
+    return results
+
+
+if __name__ == '__main__':
+    numberRuns = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for result in run(numberRuns):
+        print(json.dumps(result, sort_keys=True))
@@ -0,0 +1,246 @@
+# End-to-end benchmark of the second_function and third_function handlers
+# against the in-process fake backend.
+#
+# Usage: python benchmarks/pipeline_benchmark.py [--functions second_function,third_function]
+#            [--latency 0.02] [--tps 1000] [--throttle-rate 0] [--error-rate 0]
+#            [numberFrames ...]
+#
+# For every size (1k, 10k and 100k frames by default), the TestVideo
+# thumbnails are replicated to that number of frames under the prefix of the
+# notification in logs/test_event.json, and each handler processes it in a
+# separate process so its peak RSS is not shared with the other runs. Every
+# fake API call takes '--latency' seconds, and '--tps' is the rate allowed by
+# the limiters of the Rekognition APIs.
+#
+# Each run is printed as one JSON line with the wall time of the handler and
+# of each stage, the number of calls and calls per second of each API, the
+# peak RSS and the peak number of threads, and the threads still alive when
+# the handler returns. The wall time of a stage runs from its first start to
+# its last end:
+#
+# * list: iteration of the thumbnail listing, which overlaps the next stage
+#   when the keys are streamed
+# * index, search: index_faces() and search_faces() of second_function, or
+#   the RecognizeCelebrities calls of third_function for 'index'
+# * cluster: cluster_table() and group_people()
+# * render: from the upload of the JSON result to the upload of the visual
+#   representation
+# * upload: uploads of the results
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+FUNCTIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+sys.path.insert(0, FUNCTIONS_DIRECTORY)
+
+BUCKET = 'benchmark'
+
+API_METHODS = {
+    'rekognition': ('create_collection', 'delete_collection', 'index_faces', 'search_faces', 'recognize_celebrities'),
+    's3': ('get_object', 'put_object', 'upload_file', 'delete_object')
+}
+
+
+# Records the intervals during which the wrapped functions run
+class Recorder(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.intervals = {}
+
+    def add(self, name, start, end):
+        with self.lock:
+            self.intervals.setdefault(name, []).append((start, end))
+
+    def wrap(self, owner, attributeName, name):
+        function = getattr(owner, attributeName)
+
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name(*args, **kwargs) if callable(name) else name, start, time.time())
+
+        setattr(owner, attributeName, wrapper)
+
+    # Generators are recorded from the first to the last item
+    def wrap_iterator(self, owner, attributeName, name):
+        function = getattr(owner, attributeName)
+
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                for item in function(*args, **kwargs):
+                    yield item
+            finally:
+                self.add(name, start, time.time())
+
+        setattr(owner, attributeName, wrapper)
+
+    def span(self, *names):
+        intervals = [interval for name in names for interval in self.intervals.get(name, [])]
+        if not intervals:
+            return None
+        return max(end for start, end in intervals) - min(start for start, end in intervals)
+
+    def count(self, name):
+        return len(self.intervals.get(name, []))
+
+
+# Samples the number of running threads
+class ThreadMonitor(object):
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample)
+        self.thread.daemon = True
+
+    def _sample(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(self.interval)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        # The monitor itself is not counted
+        return self.peak - 1
+
+
+def output_key(key):
+    return key.startswith('output/')
+
+
+# Run one handler on 'numberFrames' frames in the current process
+def run(functionName, numberFrames, latency, tps, throttleRate, errorRate):
+    os.environ.update({'Bucket': BUCKET, 'AWS_REGION': 'us-east-1', 'Backend': 'fake', 'MetricsSink': 'none'})
+    for apiName in ('IndexFaces', 'SearchFaces', 'RecognizeCelebrities'):
+        os.environ[apiName + 'TPS'] = str(tps)
+
+    import backend
+    import clustering
+    import fake_backend
+    from listing import ThumbnailListing
+
+    fake = fake_backend.FakeBackend(latency={'*': latency}, throttleRate=throttleRate, errorRate=errorRate)
+    backend.set_backend(fake)
+    event = fake_backend.load_test_event()
+    fake.add_video(event, BUCKET, numberFrames)
+
+    handler = __import__(functionName)
+    recorder = Recorder()
+    recorder.wrap_iterator(ThumbnailListing, '__iter__', 'list')
+    for serviceName, apiNames in API_METHODS.items():
+        for apiName in apiNames:
+            recorder.wrap(fake.client(serviceName), apiName, 'api:' + apiName)
+    recorder.wrap(fake.s3, 'put_object', lambda **kwargs: 'upload' if output_key(kwargs['Key']) else 'checkpoint')
+    recorder.wrap(fake.s3, 'upload_file', 'upload')
+    if functionName == 'second_function':
+        recorder.wrap(handler, 'index_faces', 'index')
+        recorder.wrap(handler, 'search_faces', 'search')
+        recorder.wrap(clustering, 'cluster_table', 'cluster')
+        recorder.wrap(clustering, 'group_people', 'cluster')
+
+    monitor = ThreadMonitor()
+    monitor.start()
+
+    # The output of the handler is discarded
+    sys.stdout.flush()
+    stdout = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    start = time.time()
+    try:
+        handler.lambda_handler(event, None)
+    finally:
+        wallTime = time.time() - start
+        sys.stdout.flush()
+        os.dup2(stdout, 1)
+        os.close(devnull)
+
+    peakThreads = monitor.stop()
+    threadsAfter = threading.active_count() - 1
+
+    stages = {
+        'list': recorder.span('list'),
+        'index': recorder.span('index') if functionName == 'second_function' else recorder.span('api:recognize_celebrities'),
+        'search': recorder.span('search'),
+        'cluster': recorder.span('cluster'),
+        'upload': sum(end - start for start, end in recorder.intervals.get('upload', []))
+    }
+    uploads = recorder.intervals.get('upload', [])
+    if len(uploads) >= 2:
+        stages['render'] = uploads[-1][0] - uploads[-2][1]
+
+    calls = dict((apiName, count) for apiName, count in fake.calls.items())
+    callsPerSecond = {}
+    for apiName in calls:
+        span = recorder.span('api:' + apiName)
+        if span:
+            callsPerSecond[apiName] = round(recorder.count('api:' + apiName) / span, 1)
+
+    return {
+        'Function': functionName,
+        'Frames': numberFrames,
+        'Latency': latency,
+        'TPS': tps,
+        'ThrottleRate': throttleRate,
+        'ErrorRate': errorRate,
+        'WallTime': round(wallTime, 3),
+        'Stages': dict((stage, round(seconds, 3)) for stage, seconds in stages.items() if seconds is not None),
+        'Calls': calls,
+        'CallsPerSecond': callsPerSecond,
+        'PeakRSSMegabytes': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        'PeakThreads': peakThreads,
+        'ThreadsAfter': threadsAfter
+    }
+
+
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the handlers against the fake backend')
+    parser.add_argument('frames', nargs='*', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--functions', default='second_function,third_function')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--tps', type=float, default=1000)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments(sys.argv[1:])
+
+    if arguments.child:
+        result = run(arguments.functions, arguments.frames[0], arguments.latency, arguments.tps, arguments.throttle_rate, arguments.error_rate)
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+        # Skip the shutdown of the daemon worker threads
+        os._exit(0)
+
+    for numberFrames in arguments.frames:
+        for functionName in arguments.functions.split(','):
+            output = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), '--child',
+                '--functions', functionName,
+                '--latency', str(arguments.latency),
+                '--tps', str(arguments.tps),
+                '--throttle-rate', str(arguments.throttle_rate),
+                '--error-rate', str(arguments.error_rate),
+                str(numberFrames)
+            ])
+            print(output.strip().splitlines()[-1].decode())
+            sys.stdout.flush()
@@ -337,6 +337,39 @@ def getmodebands(mode):
 
 _initialized = 0
 
+# Format drivers loaded by preinit(). When the allowlist is set, preinit()
+# and init() only load the drivers it names, which cuts the import time
+# when a single format is used (face_rekognition: the Lambda functions only
+# read and write PNG thumbnails).
+_preinit_plugins = ['BmpImagePlugin',
+                    'GifImagePlugin',
+                    'JpegImagePlugin',
+                    'PpmImagePlugin',
+                    'PngImagePlugin']
+
+_plugin_allowlist = None
+if os.environ.get('PILPlugins'):
+    _plugin_allowlist = [plugin.strip() for plugin in os.environ['PILPlugins'].split(',')]
+
+
+def set_plugin_allowlist(plugins):
+    """
+    Restricts the format drivers loaded by preinit() and init().
+
+    :param plugins: List of plugin module names, such as
+       ``['PngImagePlugin']``, or None to load every driver. The
+       ``PILPlugins`` environment variable sets the same list, comma
+       separated.
+    """
+    global _plugin_allowlist
+    _plugin_allowlist = list(plugins) if plugins is not None else None
+
+
+def _allowed(plugins):
+    if _plugin_allowlist is None:
+        return plugins
+    return [plugin for plugin in plugins if plugin in _plugin_allowlist]
+
 
 def preinit():
     "Explicitly load standard file format drivers."
@@ -345,26 +378,11 @@ def preinit():
     if _initialized >= 1:
         return
 
-    try:
-        from . import BmpImagePlugin
-    except ImportError:
-        pass
-    try:
-        from . import GifImagePlugin
-    except ImportError:
-        pass
-    try:
-        from . import JpegImagePlugin
-    except ImportError:
-        pass
-    try:
-        from . import PpmImagePlugin
-    except ImportError:
-        pass
-    try:
-        from . import PngImagePlugin
-    except ImportError:
-        pass
+    for plugin in _allowed(_preinit_plugins):
+        try:
+            __import__("PIL.%s" % plugin, globals(), locals(), [])
+        except ImportError:
+            pass
 #   try:
 #       import TiffImagePlugin
 #   except ImportError:
@@ -383,7 +401,7 @@ def init():
     if _initialized >= 2:
         return 0
 
-    for plugin in _plugins:
+    for plugin in _allowed(_plugins):
         try:
             logger.debug("Importing %s", plugin)
             __import__("PIL.%s" % plugin, globals(), locals(), [])
@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+
+import metrics
+
+
+# The AWS services used by the handlers are reached through a backend, so the
+# pipeline can run against the in-process fake of fake_backend.py instead of
+# AWS. The backend is chosen once per container: the one passed to
+# set_backend(), otherwise the fake when the 'Backend' environment variable
+# is 'fake', otherwise AWS.
+#
+# A process started with the 'FakeBackendAddress' and 'FakeBackendKey'
+# environment variables of a fake_backend.FakeBackendServer uses the fake
+# of the process that started it, such as the shard workers of
+# sharding.LocalInvoker.
+#
+# The clients are kept at module level, so warm invocations reuse their
+# endpoints and open connections. boto3 clients can be shared by threads but
+# creating them is not thread-safe, so they are created under a lock. A
+# process forked from one that created clients creates its own: the
+# connections of the parent must not be shared.
+
+_backend = None
+_backendLock = threading.Lock()
+_forkLock = threading.Lock()
+_clients = {}
+_pid = os.getpid()
+
+
+# Backend creating the boto3 clients. boto3 is imported on first use, so the
+# handlers can be imported where it is not installed.
+class AwsBackend(object):
+
+    def client(self, serviceName, config=None):
+        import boto3
+        from botocore.config import Config
+
+        return boto3.client(
+            serviceName,
+            region_name=os.environ.get('AWS_REGION'),
+            config=Config(**config) if config else None
+        )
+
+
+def _check_pid():
+    global _backendLock, _pid
+    if _pid != os.getpid():
+        with _forkLock:
+            if _pid != os.getpid():
+                _backendLock = threading.Lock()
+                _clients.clear()
+                _pid = os.getpid()
+
+
+def set_backend(backend):
+    global _backend
+    _check_pid()
+    with _backendLock:
+        _backend = backend
+        _clients.clear()
+
+
+# Must be called with the lock held
+def _get_backend():
+    global _backend
+    if _backend is None:
+        if os.environ.get('FakeBackendAddress'):
+            import fake_backend
+            _backend = fake_backend.RemoteFakeBackend(os.environ['FakeBackendAddress'], os.environ['FakeBackendKey'].decode('hex'))
+        elif os.environ.get('Backend') == 'fake':
+            import fake_backend
+            _backend = fake_backend.FakeBackend()
+        else:
+            _backend = AwsBackend()
+    return _backend
+
+
+def get_backend():
+    _check_pid()
+    with _backendLock:
+        return _get_backend()
+
+
+# Return the shared client of 'serviceName' ('rekognition', 's3', 'lambda'
+# or 'elastictranscoder'). The keyword arguments are botocore Config
+# options, ignored by the fake: the workers of a stage pass
+# 'max_pool_connections' so each of them gets an HTTP connection. The calls
+# are recorded in the metrics.
+def client(serviceName, **config):
+    key = (serviceName, json.dumps(config, sort_keys=True))
+    _check_pid()
+    with _backendLock:
+        if not key in _clients:
+            _clients[key] = metrics.instrument(_get_backend().client(serviceName, config))
+        return _clients[key]
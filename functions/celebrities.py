@@ -0,0 +1,108 @@
+import json
+import os
+
+import frame_dedup
+from geometry import iou
+
+
+# Add the celebrities of a RecognizeCelebrities response to 'celebs', a dict
+# mapping each celebrity ID to its name, URLs and faces by frame number.
+# The faces are recorded in each frame of 'frameNumbers': the frame sent to
+# Rekognition and its near-duplicates. Each worker thread records in its own
+# dict, the dicts are combined by merge_celebrities().
+def record_celebrities(celebs, response, frameNumbers):
+    frameNumber = frameNumbers[0]
+
+    for celeb in response['CelebrityFaces']:
+        celebId = celeb['Id']
+        print("celeb: " + celebId + " in frame: " + str(frameNumber) + " MatchConfidence: " + str(celeb['MatchConfidence']))
+        if celeb['MatchConfidence'] >= 0.65:
+            print("Celeb: " + json.dumps(celeb))
+            #Create the Celeb top level entry
+            if not(celebId in celebs):
+                print("New Celeb detected in frame " + str(frameNumber) + " with Confidence of " + str(celeb['MatchConfidence']))
+                celebs[celebId] = {
+                    'Name': celeb['Name'],
+                    'Urls': celeb['Urls'],
+                    'Faces': {}
+                }
+            #Transform the detected face object
+            celebFace = {
+                    'FrameNumber': frameNumber,
+                    'MatchConfidence': celeb['MatchConfidence'],
+                    'BoundingBox': celeb['Face']['BoundingBox'],
+                    'Confidence': celeb['Face']['Confidence']
+            }
+            #Add the detected face to the 'celebs' array, in each frame of
+            #the group of near-duplicates.
+            for groupFrameNumber in frameNumbers:
+                celebs[celebId]['Faces'][groupFrameNumber] = dict(celebFace, FrameNumber=groupFrameNumber)
+
+
+# Merge the celebrities recorded by several workers, or restored from a
+# checkpoint, into a new dict. Each frame is processed by a single worker,
+# so the faces of a celebrity never collide. The faces are keyed by their
+# frame number again, since the keys of a dict restored from JSON are
+# strings.
+def merge_celebrities(workerCelebs):
+    celebs = {}
+    for workerCeleb in workerCelebs:
+        for celebId, celeb in list(workerCeleb.items()):
+            if not celebId in celebs:
+                celebs[celebId] = {'Name': celeb['Name'], 'Urls': celeb['Urls'], 'Faces': {}}
+            for face in list(celeb['Faces'].values()):
+                celebs[celebId]['Faces'][face['FrameNumber']] = face
+    return celebs
+
+
+# Copy the celebrities found in the first frame of each group of
+# near-duplicate frames to the other frames of the group
+def expand_celebrities(celebs, groups):
+    for celeb in celebs.values():
+        for representative, duplicates in groups.items():
+            face = celeb['Faces'].get(frame_dedup.frame_number(representative))
+            if face is not None:
+                for key in duplicates:
+                    celeb['Faces'][frame_dedup.frame_number(key)] = dict(face, FrameNumber=frame_dedup.frame_number(key))
+
+
+# Label the people identified by clustering in the face table 'faces' with
+# the celebrities. In each frame, a face is matched with the celebrity face
+# whose bounding box overlaps it the most, if their intersection over union
+# is at least 'threshold' (environment variable 'CelebrityIoUThreshold', default 0.5).
+# Each person gets the celebrity matched in the largest number of frames,
+# the lowest celebrity ID winning a tie. Returns a dict mapping person IDs
+# to their celebrity.
+def label_people(faces, celebs, threshold=None):
+    if threshold is None:
+        threshold = float(os.environ.get('CelebrityIoUThreshold', 0.5))
+
+    celebFacesByFrame = {}
+    for celebId, celeb in celebs.items():
+        for face in celeb['Faces'].values():
+            celebFacesByFrame.setdefault(face['FrameNumber'], []).append((celebId, face['BoundingBox']))
+
+    votes = {}
+    for index in faces.sorted_indexes():
+        personId = faces.personIds[index]
+        if not personId:
+            continue
+        best = None
+        for celebId, boundingBox in celebFacesByFrame.get(faces.frameNumbers[index], ()):
+            overlap = iou(faces.box(index), boundingBox)
+            if overlap >= threshold and (best is None or overlap > best[0]):
+                best = (overlap, celebId)
+        if best is not None:
+            personVotes = votes.setdefault(personId, {})
+            personVotes[best[1]] = personVotes.get(best[1], 0) + 1
+
+    labels = {}
+    for personId, personVotes in votes.items():
+        celebId = sorted(personVotes.items(), key=lambda item: (-item[1], item[0]))[0][0]
+        labels[personId] = {
+            'Id': celebId,
+            'Name': celebs[celebId]['Name'],
+            'Urls': celebs[celebId]['Urls'],
+            'MatchedFrames': personVotes[celebId]
+        }
+    return labels
@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+import time
+from threading import Thread
+
+import backend
+import metrics
+from celebrities import merge_celebrities
+
+
+# Backend storing the checkpoints as JSON objects in the S3 bucket
+class S3CheckpointBackend(object):
+
+    def __init__(self, s3, bucket, prefix='checkpoints/'):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def load(self, token):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + token + '.json')
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def save(self, token, state):
+        self.s3.put_object(
+            Body=json.dumps(state).encode(),
+            Bucket=self.bucket,
+            Key=self.prefix + token + '.json'
+        )
+
+    def delete(self, token):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.prefix + token + '.json')
+
+
+# Backend storing the checkpoints in a local directory, used to run the
+# handlers outside of AWS
+class LocalCheckpointBackend(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, token):
+        return os.path.join(self.directory, token + '.json')
+
+    def load(self, token):
+        if not os.path.exists(self._path(token)):
+            return None
+        with open(self._path(token)) as f:
+            return json.load(f)
+
+    def save(self, token, state):
+        # Write to a temporary file first so a crash never leaves a
+        # truncated checkpoint behind
+        with open(self._path(token) + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.rename(self._path(token) + '.tmp', self._path(token))
+
+    def delete(self, token):
+        if os.path.exists(self._path(token)):
+            os.remove(self._path(token))
+
+
+def get_backend(s3):
+    if os.environ.get('CheckpointDirectory'):
+        return LocalCheckpointBackend(os.environ['CheckpointDirectory'])
+    return S3CheckpointBackend(s3, os.environ['Bucket'], os.environ.get('CheckpointPrefix', 'checkpoints/'))
+
+
+# Progress of one video across Lambda invocations. The state holds the
+# current stage, the thumbnail keys already processed, the face table and
+# the failures reported so far, and the celebrities found in the combined
+# pipeline mode. It is saved every 'interval' seconds while a
+# stage is running, and when the remaining execution time of the invocation
+# drops below 'marginMillis' the running stage is stopped so the handler can
+# save the state and re-invoke itself with the continuation token. Without a
+# backend nothing is saved, only the deadline is watched. 'stopTime', a
+# time.time() value, brings the deadline forward: the shard workers get the
+# deadline of their coordinator.
+class Checkpoint(object):
+
+    def __init__(self, backend, token, context, interval=None, marginMillis=None):
+        self.backend = backend
+        self.token = token
+        self.context = context
+        self.interval = float(interval or os.environ.get('CheckpointInterval', 30))
+        self.marginMillis = int(marginMillis or os.environ.get('CheckpointMargin', 60000))
+        self.stopped = threading.Event()
+        self.stopTime = None
+        self.faces = None
+        self.processedKeys = None
+        self.failures = None
+        self.celebrities = None
+        self.shards = []
+        self.shardKeys = False
+        self.lastSave = time.time()
+        self.state = {
+            'Stage': None,
+            'Invocation': 1,
+            'ProcessedKeys': [],
+            'Faces': {},
+            'Failures': []
+        }
+
+    def load(self):
+        state = self.backend.load(self.token) if self.backend else None
+        if state is None:
+            return False
+        self.state = state
+        self.state['Invocation'] += 1
+        print('Resuming {} at stage {} (invocation {})'.format(self.token, state['Stage'], state['Invocation']))
+        return True
+
+    # Register the live structures saved by save(). 'celebrities' is the
+    # list of the dicts filled by the workers in the combined pipeline mode.
+    def track(self, faces, processedKeys, failures, celebrities=None):
+        self.faces = faces
+        self.processedKeys = processedKeys
+        self.failures = failures
+        self.celebrities = celebrities
+
+    # Register the FaceShards of the running stage, whose results are saved
+    # with the face table. The items processed by the shards are thumbnail
+    # keys if 'keys' is set.
+    def track_shards(self, shards, keys=False):
+        self.shards = shards
+        self.shardKeys = keys
+
+    def save(self, stage):
+        if not self.backend:
+            return
+
+        # Copy the keys before the faces: the workers add a key only after
+        # its faces, so every key in the checkpoint has all of its faces.
+        shards = list(self.shards)
+        processedKeys = list(self.processedKeys)
+        if self.shardKeys:
+            for shard in shards:
+                processedKeys.extend(list(shard.processed))
+        processedFrames = set(int(key[:-4][-5:]) for key in processedKeys)
+
+        self.state['Stage'] = stage
+        self.state['ProcessedKeys'] = processedKeys
+        self.state['Faces'] = self.faces.to_json(processedFrames, shards)
+        self.state['Failures'] = self.failures.to_json()
+        if self.celebrities is not None:
+            self.state['Celebrities'] = merge_celebrities(self.celebrities)
+        self.backend.save(self.token, self.state)
+
+    # Save the checkpoint if the last one is older than 'interval' seconds.
+    # It is also called between the short stages, like the waves of
+    # SearchFaces, which can end before the first periodic save.
+    def save_periodically(self, stage):
+        if time.time() - self.lastSave >= self.interval:
+            self.save(stage)
+            self.lastSave = time.time()
+
+    def delete(self):
+        if self.backend:
+            self.backend.delete(self.token)
+
+    def deadline_reached(self):
+        if self.stopped.is_set():
+            return True
+        if self.context is not None and self.context.get_remaining_time_in_millis() < self.marginMillis:
+            self.stopped.set()
+        if self.stopTime is not None and time.time() >= self.stopTime:
+            self.stopped.set()
+        return self.stopped.is_set()
+
+    # Time after which the items of a stage are not started any more, None
+    # without a context or a stop time
+    def deadline(self):
+        deadlines = []
+        if self.context is not None:
+            deadlines.append(time.time() + (self.context.get_remaining_time_in_millis() - self.marginMillis) / 1000.0)
+        if self.stopTime is not None:
+            deadlines.append(self.stopTime)
+        return min(deadlines) if deadlines else None
+
+    # Submit the items to the stage from a producer thread and wait for all
+    # of them to be processed, saving a checkpoint periodically. 'items' can
+    # be an iterator that is still listing the items, the stage is closed
+    # only once it is exhausted. When the deadline is reached the items that
+    # have not started are cancelled. Returns False if the stage was stopped
+    # because of the deadline.
+    def wait(self, stage, stageName, items=()):
+        errors = []
+
+        def feed():
+            try:
+                for item in items:
+                    if self.stopped.is_set():
+                        break
+                    stage.submit(item)
+            except Exception as e:
+                errors.append(e)
+            stage.close()
+
+        feeder = Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+
+        while not stage.join(1):
+            metrics.gauge('QueueDepth', stage.pending(), Stage=stageName)
+            if self.deadline_reached():
+                stage.cancel()
+            self.save_periodically(stageName)
+        feeder.join()
+        self.save_periodically(stageName)
+        if stage.cancelled:
+            self.stopped.set()
+
+        errors.extend(stage.errors)
+        if errors:
+            raise errors[0]
+        return not self.stopped.is_set()
+
+    # Invoke the current function asynchronously with the continuation token
+    def reinvoke(self, event):
+        maxInvocations = int(os.environ.get('MaxInvocations', 20))
+        if self.state['Invocation'] >= maxInvocations:
+            raise Exception('Video {} not processed after {} invocations'.format(self.token, maxInvocations))
+
+        event = dict(event, ContinuationToken=self.token)
+        backend.client('lambda').invoke(
+            FunctionName=self.context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps(event).encode()
+        )
+        print('Function re-invoked with continuation token {}'.format(self.token))
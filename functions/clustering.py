@@ -0,0 +1,144 @@
+from array import array
+from collections import deque
+
+from face_table import FaceTable
+
+
+# Identify unique people from the faces matched by the SearchFaces operation.
+#
+# The faces are rows of a face table: 'order' lists their indexes in the
+# order of which they appear in the video, the matching faces of row i are
+# targets[offsets[i]:offsets[i + 1]], and 'matched' is a bytearray flagging
+# the rows that have been searched and kept. The match graph is traversed
+# breadth-first without recursion. The rows not assigned yet are kept in a
+# set, so each face only looks at its matching faces that are still
+# unassigned, and the matching faces of a row are turned into a set the
+# first time they are looked up, so whether a face matches another is a
+# constant-time lookup whatever the number of matches.
+#
+# To avoid false positives, the propagation from faceA to faceB happens only
+# if there are at least two faces matching faceB that also match faceA. The
+# faces reached from an unassigned face through such edges get the same
+# person ID. Returns an array of the person ID of each row, starting at 1,
+# with 0 for the rows that were not clustered.
+def cluster_indexes(order, offsets, targets, matched):
+    adjacency = [None] * (len(offsets) - 1)
+
+    def has_two_matching_loops(index, matchingIndex):
+        numberMatchingLoops = 0
+        for matchingIndex2 in targets[offsets[matchingIndex]:offsets[matchingIndex + 1]]:
+            if matched[matchingIndex2]:
+                matchingSet = adjacency[matchingIndex2]
+                if matchingSet is None:
+                    matchingSet = adjacency[matchingIndex2] = frozenset(targets[offsets[matchingIndex2]:offsets[matchingIndex2 + 1]])
+                if index in matchingSet:
+                    numberMatchingLoops = numberMatchingLoops + 1
+                    if numberMatchingLoops >= 2:
+                        return True
+        return False
+
+    personIds = array('l', [0]) * (len(offsets) - 1)
+    unassigned = set(index for index in range(len(offsets) - 1) if matched[index])
+    personId = 0
+    for seed in order:
+        if personIds[seed]:
+            continue
+
+        personId = personId + 1
+        personIds[seed] = personId
+        unassigned.discard(seed)
+        toVisit = deque([seed])
+
+        while toVisit:
+            index = toVisit.popleft()
+            for matchingIndex in unassigned.intersection(targets[offsets[index]:offsets[index + 1]]):
+                if has_two_matching_loops(index, matchingIndex):
+                    personIds[matchingIndex] = personId
+                    unassigned.remove(matchingIndex)
+                    toVisit.append(matchingIndex)
+
+    return personIds
+
+
+# Cluster the searched faces of a face table and store their person ID in
+# the table
+def cluster_table(faces):
+    offsets, targets = faces.compact_matches()
+    matched = faces.matched_flags()
+    order = [i for i in faces.sorted_indexes() if matched[i]]
+    personIds = cluster_indexes(order, offsets, targets, matched)
+    for index in order:
+        faces.personIds[index] = personIds[index]
+    return personIds
+
+
+# Same as cluster_indexes() for 'faceIdsSorted', the face IDs in the order
+# of which they appear in the video, and 'matchingFaces', a dict mapping each
+# face ID to the IDs of its matching faces. Returns a dict mapping each face
+# ID to its person ID.
+def cluster_faces(faceIdsSorted, matchingFaces):
+    faces = FaceTable.from_matches(faceIdsSorted, matchingFaces)
+    offsets, targets = faces.compact_matches()
+    order = range(len(faceIdsSorted))
+    personIds = cluster_indexes(order, offsets, targets, faces.matched_flags())
+    return dict((faceId, personIds[faces.indexes[faceId]]) for faceId in faceIdsSorted)
+
+
+# Position of a frame in the video, as H:MM:SS. Elastic Transcoder creates
+# one thumbnail per second.
+def time_position(frameNumber):
+    return '{}:{:02d}:{:02d}'.format(
+        frameNumber // 3600,
+        (frameNumber - frameNumber // 3600 * 3600) // 60,
+        frameNumber % 60
+    )
+
+
+# Group the faces of a clustered face table by person in a single pass over
+# its rows in the order of the video, and compute the longest run of
+# consecutive frames of each person on the way. Only the people that appear
+# in at least 'minConsecutiveFrames' consecutive frames are returned, in the
+# order of their person ID. The people found in 'labels', a dict mapping
+# person IDs to celebrities, get a 'Celebrity'.
+def group_people(faces, minConsecutiveFrames=2, labels=None):
+    runs = {}
+
+    for index in faces.sorted_indexes():
+        personId = faces.personIds[index]
+        if not personId:
+            continue
+        frameNumber = faces.frameNumbers[index]
+        frameTimePosition = time_position(frameNumber)
+
+        run = runs.get(personId)
+        if run is None:
+            run = runs[personId] = {
+                'Frames': [],
+                'PreviousFrameNumber': None,
+                'CurrentNumberConsecutiveFrames': 0,
+                'MaxNumberConsecutiveFrames': 0
+            }
+
+        run['Frames'].append({
+            'FrameNumber': frameNumber,
+            'FrameTimePosition': frameTimePosition,
+            'BoundingBox': faces.box(index),
+            'Quality': faces.qualities[index]
+        })
+
+        if run['PreviousFrameNumber'] == frameNumber - 1:
+            run['CurrentNumberConsecutiveFrames'] += 1
+            run['MaxNumberConsecutiveFrames'] = max(run['MaxNumberConsecutiveFrames'], run['CurrentNumberConsecutiveFrames'])
+        else:
+            run['CurrentNumberConsecutiveFrames'] = 1
+
+        run['PreviousFrameNumber'] = frameNumber
+
+    people = []
+    for personId in sorted(runs):
+        if runs[personId]['MaxNumberConsecutiveFrames'] >= minConsecutiveFrames:
+            person = {'Frames': runs[personId]['Frames']}
+            if labels and personId in labels:
+                person['Celebrity'] = labels[personId]
+            people.append(person)
+    return people
@@ -0,0 +1,274 @@
+import os
+import threading
+import time
+from Queue import Queue
+from threading import Thread
+
+import metrics
+
+
+# State of a Future
+PENDING = 0
+RUNNING = 1
+CANCELLED = 2
+FINISHED = 3
+
+_executors = {}
+_executorsLock = threading.Lock()
+_forkLock = threading.Lock()
+
+
+class CancelledError(Exception):
+    pass
+
+
+# Result of a call submitted to a StageExecutor. A future that has not
+# started yet can be cancelled, and it is cancelled by the worker that takes
+# it if its 'deadline' (a time.time() value) has passed: a call that started
+# is never interrupted.
+class Future(object):
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.condition = threading.Condition()
+        self.state = PENDING
+        self.value = None
+        self.error = None
+        self.callbacks = []
+
+    # The state changes only if it is 'expected', when it is set
+    def _set_state(self, state, value=None, error=None, expected=None):
+        with self.condition:
+            if expected is not None and self.state != expected:
+                return False
+            self.state = state
+            self.value = value
+            self.error = error
+            self.condition.notify_all()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+        return True
+
+    # Returns False if the future was cancelled before it could start
+    def _start(self):
+        with self.condition:
+            if self.state != PENDING:
+                return False
+            if self.deadline is None or time.time() < self.deadline:
+                self.state = RUNNING
+                return True
+        self._set_state(CANCELLED, expected=PENDING)
+        return False
+
+    def cancel(self):
+        return self._set_state(CANCELLED, expected=PENDING) or self.state == CANCELLED
+
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def done(self):
+        return self.state in (CANCELLED, FINISHED)
+
+    # 'callback' is called with the future once it is done, in the thread
+    # that completed or cancelled it
+    def add_done_callback(self, callback):
+        with self.condition:
+            if not self.done():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def exception(self, timeout=None):
+        with self.condition:
+            if not self.done():
+                self.condition.wait(timeout)
+            if self.state == CANCELLED:
+                raise CancelledError()
+            if not self.done():
+                raise Exception('Future not done after {} seconds'.format(timeout))
+            return self.error
+
+    def result(self, timeout=None):
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return self.value
+
+
+# Bounded pool of worker threads running the calls submitted to it. The
+# threads are started on the first submit() and wait for the next call
+# between the stages, so a warm container keeps using the same threads
+# instead of starting new ones on every invocation. Unless 'bounded' is
+# False, at most 4 calls per thread wait in the work queue: submit() blocks
+# when it is full, which paces a producer listing the items to the speed of
+# the workers.
+#
+# A process forked from one that used the executor inherits the executor but
+# not its threads, nor a usable work queue: the executor is reset in the
+# child on its next submit().
+class StageExecutor(object):
+
+    def __init__(self, threads, bounded=True):
+        self.threads = threads
+        self.bounded = bounded
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.workQueue = Queue(self.threads * 4 if self.bounded else 0)
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def _check_pid(self):
+        if self.pid != os.getpid():
+            with _forkLock:
+                if self.pid != os.getpid():
+                    self._reset()
+
+    def _start(self):
+        self._check_pid()
+        with self.lock:
+            while len(self.workers) < self.threads:
+                t = Thread(target=self._work)
+                t.daemon = True
+                t.start()
+                self.workers.append(t)
+
+    def _work(self):
+        while True:
+            call = self.workQueue.get()
+            if call is None:
+                return
+            future, function, args, invocationMetrics = call
+            metrics.activate(invocationMetrics)
+            if future._start():
+                try:
+                    future._set_state(FINISHED, function(*args))
+                except Exception as e:
+                    future._set_state(FINISHED, error=e)
+
+    # Submit 'function(*args)'. The keyword argument 'deadline' is the time
+    # after which the call is cancelled if it has not started. The call
+    # records its metrics into the current invocation of the caller.
+    def submit(self, function, *args, **kwargs):
+        future = Future(kwargs.get('deadline'))
+        self._put(future, function, args, metrics.current())
+        return future
+
+    def _put(self, future, function, args, invocationMetrics):
+        if len(self.workers) < self.threads or self.pid != os.getpid():
+            self._start()
+        self.workQueue.put((future, function, args, invocationMetrics))
+
+    def stage(self, function, deadline=None):
+        return Stage(self, function, deadline)
+
+    def resize(self, threads):
+        self._check_pid()
+        with self.lock:
+            self.threads = max(self.threads, threads)
+
+    # Stop the threads once the calls already submitted are done
+    def shutdown(self, wait=True):
+        self._check_pid()
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for t in workers:
+            self.workQueue.put(None)
+        if wait:
+            for t in workers:
+                t.join()
+
+
+# The calls of one stage: 'function' is applied to each item submitted, and
+# join() returns once the stage is closed and all its calls are done, the
+# moment the last one returns. cancel() cancels the calls that have not
+# started and the ones submitted after it. The exceptions raised by
+# 'function' are kept in 'errors'. The calls record their metrics into the
+# invocation that created the stage, whatever the thread submitting them.
+class Stage(object):
+
+    def __init__(self, executor, function, deadline=None):
+        self.executor = executor
+        self.function = function
+        self.deadline = deadline
+        self.metrics = metrics.current()
+        self.condition = threading.Condition()
+        self.futures = set()
+        self.closed = False
+        self.stopped = False
+        self.cancelled = 0
+        self.errors = []
+
+    def _done(self, future):
+        with self.condition:
+            self.futures.discard(future)
+            if future.cancelled():
+                self.cancelled += 1
+            elif future.error is not None:
+                self.errors.append(future.error)
+            self.condition.notify_all()
+
+    def submit(self, item):
+        future = Future(self.deadline)
+        future.add_done_callback(self._done)
+        with self.condition:
+            stopped = self.stopped
+            if not stopped:
+                self.futures.add(future)
+        if stopped:
+            future.cancel()
+        else:
+            self.executor._put(future, self.function, (item,), self.metrics)
+        return future
+
+    # Number of the calls submitted that are not done
+    def pending(self):
+        return len(self.futures)
+
+    # No item is submitted after close()
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def cancel(self):
+        with self.condition:
+            self.stopped = True
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+
+    # Returns True once the stage is closed and all its calls are done
+    def join(self, timeout=None):
+        end = time.time() + timeout if timeout is not None else None
+        with self.condition:
+            while not (self.closed and not self.futures):
+                if end is None:
+                    self.condition.wait()
+                elif time.time() < end:
+                    self.condition.wait(end - time.time())
+                else:
+                    return False
+            return True
+
+
+# Return the executor named 'name', started with 'threads' threads. The
+# executors are kept at module level so warm invocations reuse their
+# threads.
+def get_executor(name, threads, bounded=True):
+    with _executorsLock:
+        if not name in _executors:
+            _executors[name] = StageExecutor(threads, bounded)
+        executor = _executors[name]
+    executor.resize(threads)
+    return executor
+
+
+def shutdown_executors(wait=True):
+    with _executorsLock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait)
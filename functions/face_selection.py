@@ -0,0 +1,57 @@
+import os
+
+
+# Quality score of a face returned by IndexFaces, between 0 and 1: the
+# detection confidence times the sharpness of the face, both in percent. A
+# field missing from the response counts as 100%.
+def face_quality(faceRecord):
+    confidence = faceRecord['Face'].get('Confidence', 100.0)
+    sharpness = faceRecord.get('FaceDetail', {}).get('Quality', {}).get('Sharpness', 100.0)
+    return confidence / 100.0 * sharpness / 100.0
+
+
+# A large, sharp face makes a better thumbnail than a small or blurry one
+def frame_score(frame):
+    boundingBox = frame['BoundingBox']
+    return boundingBox['Width'] * boundingBox['Height'] * frame.get('Quality', 1.0)
+
+
+# Choose the frames whose faces are drawn for each person: at most 'count'
+# frames, fewer for the people who appear in fewer frames. The candidates of
+# a person are its 'candidates' best frames by frame_score() (environment
+# variable 'ThumbnailCandidates', default 12). Among them, each person
+# prefers the frames already chosen for a previous person, then the frames
+# that are candidates for the most people, then the best scores, so the
+# thumbnails downloaded are shared between the people as much as possible.
+# The ties are broken by frame number, and the frames of each person are
+# returned in the order of the video, so the selection is deterministic.
+def select_faces(people, count=4, candidates=None):
+    if candidates is None:
+        candidates = int(os.environ.get('ThumbnailCandidates', 12))
+    candidates = max(candidates, count)
+
+    pools = []
+    numberCandidates = {}
+    for person in people:
+        pool = {}
+        for frame in sorted(person['Frames'], key=lambda frame: (-frame_score(frame), frame['FrameNumber'])):
+            if len(pool) == candidates:
+                break
+            pool.setdefault(frame['FrameNumber'], frame)
+        pools.append(pool)
+        for frameNumber in pool:
+            numberCandidates[frameNumber] = numberCandidates.get(frameNumber, 0) + 1
+
+    selected = set()
+    samples = []
+    for pool in pools:
+        ranked = sorted(pool.values(), key=lambda frame: (
+            not frame['FrameNumber'] in selected,
+            -numberCandidates[frame['FrameNumber']],
+            -frame_score(frame),
+            frame['FrameNumber']
+        ))
+        sample = sorted(ranked[:count], key=lambda frame: frame['FrameNumber'])
+        selected.update(frame['FrameNumber'] for frame in sample)
+        samples.append(sample)
+    return samples
@@ -0,0 +1,342 @@
+import threading
+from array import array
+
+
+# State of a row of the table
+INDEXED = 0
+MATCHED = 1
+REMOVED = 2
+REFERENCED = 3
+
+
+# Columnar table of the faces of a video.
+#
+# Each face ID is stored once and mapped to the index of its row. The frame
+# numbers, the bounding boxes (4 floats per face: Left, Top, Width, Height),
+# the quality scores of the faces (see face_selection.face_quality(), 1.0
+# when unknown), the person IDs (0 before clustering) and the states are
+# held in arrays, and the matching faces returned by SearchFaces are kept as
+# arrays of row indexes. compact_matches() packs them in CSR form: the
+# matching faces of row i are
+# matchTargets[matchOffsets[i]:matchOffsets[i + 1]], sorted.
+#
+# A row is INDEXED when IndexFaces returned the face, MATCHED once
+# SearchFaces returned its matching faces, and REMOVED when it had none. A
+# matching face that was not returned by IndexFaces, such as the faces of
+# the other shards in a worker invocation, gets a REFERENCED row so its ID
+# is kept. Only the INDEXED and MATCHED rows are in the table.
+#
+# The workers of a stage do not write to the table: each one records its
+# results in its own FaceShard, and the shards are merged when the stage
+# completes. The merge adds the faces in the order of their frame number and
+# face ID, so the rows, and the person IDs given by the clustering, do not
+# depend on the scheduling of the threads. The JSON form, used by the
+# checkpoints and the shard results, is the dict of dicts keyed by face ID
+# used before.
+class FaceTable(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = []
+        self.indexes = {}
+        self.frameNumbers = array('l')
+        self.boxes = array('d')
+        self.qualities = array('d')
+        self.personIds = array('l')
+        self.states = array('b')
+        self.matches = {}
+        self.matchOffsets = None
+        self.matchTargets = None
+        self.size = 0
+
+    def _index(self, faceId):
+        index = self.indexes.get(faceId)
+        if index is None:
+            index = self.indexes[faceId] = len(self.ids)
+            self.ids.append(faceId)
+            self.frameNumbers.append(0)
+            self.boxes.extend((0.0, 0.0, 0.0, 0.0))
+            self.qualities.append(1.0)
+            self.personIds.append(0)
+            self.states.append(REFERENCED)
+        return index
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, faceId):
+        index = self.indexes.get(faceId)
+        return index is not None and self.states[index] in (INDEXED, MATCHED)
+
+    def present(self, index):
+        return self.states[index] in (INDEXED, MATCHED)
+
+    # Bytearray flagging the rows that SearchFaces returned matching faces for
+    def matched_flags(self):
+        with self.lock:
+            return bytearray(1 if state == MATCHED else 0 for state in self.states)
+
+    # True once SearchFaces returned the matching faces of the face
+    def searched(self, faceId):
+        return self.states[self.indexes[faceId]] == MATCHED
+
+    def add(self, faceId, frameNumber, boundingBox, personId=0, quality=1.0):
+        with self.lock:
+            return self._add(faceId, frameNumber, _box_values(boundingBox), personId, quality)
+
+    def _add(self, faceId, frameNumber, boxValues, personId=0, quality=1.0):
+        index = self._index(faceId)
+        if not self.states[index] in (INDEXED, MATCHED):
+            self.size += 1
+            self.states[index] = INDEXED
+        self.frameNumbers[index] = frameNumber
+        if boxValues is not None:
+            self.boxes[4 * index:4 * index + 4] = boxValues
+        self.qualities[index] = quality
+        self.personIds[index] = personId
+        return index
+
+    def set_matches(self, faceId, matchingFaceIds):
+        with self.lock:
+            index = self._index(faceId)
+            self.matches[index] = array('l', [self._index(i) for i in matchingFaceIds])
+            if self.states[index] == INDEXED:
+                self.states[index] = MATCHED
+
+    def remove(self, faceId):
+        with self.lock:
+            index = self.indexes.get(faceId)
+            if index is not None and self.states[index] in (INDEXED, MATCHED):
+                self.size -= 1
+                self.states[index] = REMOVED
+
+    def frame_number(self, faceId):
+        return self.frameNumbers[self.indexes[faceId]]
+
+    def bounding_box(self, faceId):
+        return self.box(self.indexes[faceId])
+
+    def box(self, index):
+        left, top, width, height = self.boxes[4 * index:4 * index + 4]
+        return {'Left': left, 'Top': top, 'Width': width, 'Height': height}
+
+    def person_id(self, faceId):
+        return self.personIds[self.indexes[faceId]]
+
+    def quality(self, faceId):
+        return self.qualities[self.indexes[faceId]]
+
+    # Row indexes of the matching faces of a row, None if it was not searched
+    def matching_indexes(self, index):
+        if index in self.matches:
+            return self.matches[index]
+        if self.matchOffsets is not None and index + 1 < len(self.matchOffsets) and self.states[index] == MATCHED:
+            return self.matchTargets[self.matchOffsets[index]:self.matchOffsets[index + 1]]
+        return None
+
+    def matching_faces(self, faceId):
+        index = self.indexes.get(faceId)
+        matchingIndexes = self.matching_indexes(index) if index is not None else None
+        if matchingIndexes is None:
+            return None
+        return [self.ids[i] for i in matchingIndexes]
+
+    # Pack the matching faces of all the rows in the CSR arrays, each row
+    # sorted. The arrays of the rows are released as they are copied, and
+    # the rows already packed, which are sorted, are copied as they are.
+    # Nothing is copied if all the rows are packed.
+    def compact_matches(self):
+        with self.lock:
+            if not self.matches and self.matchOffsets is not None and len(self.matchOffsets) == len(self.ids) + 1:
+                return self.matchOffsets, self.matchTargets
+
+            offsets = array('l', [0])
+            targets = array('l')
+            for index in range(len(self.ids)):
+                matchingIndexes = self.matches.pop(index, None)
+                if matchingIndexes is not None:
+                    targets.extend(sorted(matchingIndexes))
+                else:
+                    matchingIndexes = self.matching_indexes(index)
+                    if matchingIndexes is not None:
+                        targets.extend(matchingIndexes)
+                offsets.append(len(targets))
+            self.matchOffsets = offsets
+            self.matchTargets = targets
+            self.matches = {}
+            return offsets, targets
+
+    def face_ids(self):
+        with self.lock:
+            return [self.ids[i] for i in range(len(self.ids)) if self.present(i)]
+
+    def frame_numbers(self):
+        with self.lock:
+            return set(self.frameNumbers[i] for i in range(len(self.ids)) if self.present(i))
+
+    # Indexes of the rows in the table in the order of which the faces
+    # appear in the video
+    def sorted_indexes(self):
+        with self.lock:
+            return sorted((i for i in range(len(self.ids)) if self.present(i)), key=lambda i: (self.frameNumbers[i], i))
+
+    def sorted_face_ids(self):
+        return [self.ids[i] for i in self.sorted_indexes()]
+
+    def _face_json(self, index):
+        face = {'FrameNumber': self.frameNumbers[index], 'BoundingBox': self.box(index), 'Quality': self.qualities[index]}
+        matchingIndexes = self.matching_indexes(index)
+        if matchingIndexes is not None:
+            face['MatchingFaces'] = [self.ids[i] for i in matchingIndexes]
+        if self.personIds[index]:
+            face['PersonId'] = self.personIds[index]
+        return face
+
+    # Dict of dicts of the faces, restricted to the frames of 'frameNumbers'
+    # if it is set. The results recorded so far in the FaceShards of a
+    # running stage are included.
+    def to_json(self, frameNumbers=None, shards=()):
+        with self.lock:
+            faces = dict(
+                (self.ids[i], self._face_json(i))
+                for i in range(len(self.ids))
+                if self.present(i) and (frameNumbers is None or self.frameNumbers[i] in frameNumbers)
+            )
+
+        for shard in shards:
+            for position in range(len(shard.ids)):
+                if frameNumbers is None or shard.frameNumbers[position] in frameNumbers:
+                    faces[shard.ids[position]] = {
+                        'FrameNumber': shard.frameNumbers[position],
+                        'BoundingBox': dict(zip(('Left', 'Top', 'Width', 'Height'), shard.boxes[4 * position:4 * position + 4])),
+                        'Quality': shard.qualities[position]
+                    }
+        for shard in shards:
+            for faceId, matchingIndexes, unknownFaceIds in list(shard.matched):
+                if faceId in faces:
+                    faces[faceId]['MatchingFaces'] = [self.ids[i] for i in matchingIndexes] + unknownFaceIds
+            for faceId in list(shard.removed):
+                faces.pop(faceId, None)
+        return faces
+
+    # Merge the results recorded by the workers of a stage. The faces are
+    # added in the order of their frame number and face ID, whatever the
+    # worker that found them.
+    def merge(self, shards):
+        added = []
+        for shard in shards:
+            for position in range(len(shard.ids)):
+                added.append((shard.frameNumbers[position], shard.ids[position], shard, position))
+        added.sort(key=lambda item: item[:2])
+
+        with self.lock:
+            for frameNumber, faceId, shard, position in added:
+                self._add(faceId, frameNumber, shard.boxes[4 * position:4 * position + 4], quality=shard.qualities[position])
+
+            for shard in shards:
+                for faceId, matchingIndexes, unknownFaceIds in shard.matched:
+                    index = self._index(faceId)
+                    if unknownFaceIds:
+                        matchingIndexes = matchingIndexes + array('l', [self._index(i) for i in unknownFaceIds])
+                    self.matches[index] = matchingIndexes
+                    if self.states[index] == INDEXED:
+                        self.states[index] = MATCHED
+
+        for shard in shards:
+            for faceId in shard.removed:
+                self.remove(faceId)
+
+    def update_json(self, faces):
+        for faceId, face in sorted(faces.items(), key=lambda item: (item[1]['FrameNumber'], item[0])):
+            self.add(faceId, face['FrameNumber'], face['BoundingBox'], face.get('PersonId', 0), face.get('Quality', 1.0))
+            if 'MatchingFaces' in face:
+                self.set_matches(faceId, face['MatchingFaces'])
+
+    @classmethod
+    def from_json(cls, faces):
+        table = cls()
+        table.update_json(faces)
+        return table
+
+    # Table of the searched faces of 'faceIds', whose matching faces are
+    # given by 'matchingFaces', a dict mapping each face ID to the IDs of its
+    # matching faces. The table is built in bulk, without the lock and with
+    # its columns allocated at once, and its matches are packed directly.
+    @classmethod
+    def from_matches(cls, faceIds, matchingFaces):
+        table = cls()
+        table.ids = list(faceIds)
+        size = len(table.ids)
+        table.indexes = dict(zip(table.ids, range(size)))
+        table.frameNumbers = array('l', [0]) * size
+        table.boxes = array('d', [0.0]) * (4 * size)
+        table.qualities = array('d', [1.0]) * size
+        table.personIds = array('l', [0]) * size
+        table.states = array('b', [MATCHED]) * size
+        table.size = size
+
+        indexes = table.indexes
+        offsets = array('l', [0]) * (size + 1)
+        targets = array('l')
+        for index in range(size):
+            matchingFaceIds = matchingFaces[table.ids[index]]
+            try:
+                targets.extend(sorted(map(indexes.__getitem__, matchingFaceIds)))
+            except KeyError:
+                targets.extend(sorted(table._index(i) for i in matchingFaceIds))
+            offsets[index + 1] = len(targets)
+
+        # The faces that are only matching faces got rows without matches
+        offsets.extend(array('l', [len(targets)]) * (len(table.ids) - size))
+        table.matchOffsets = offsets
+        table.matchTargets = targets
+        return table
+
+
+def _box_values(boundingBox):
+    if boundingBox is None:
+        return None
+    return array('d', (boundingBox['Left'], boundingBox['Top'], boundingBox['Width'], boundingBox['Height']))
+
+
+# Results recorded by one worker thread during a stage: the faces returned
+# by IndexFaces, the matching faces returned by SearchFaces and the faces
+# removed for lack of matches, plus the items processed. Only the worker
+# writes to its shard, without a lock. The face ID of a new face is appended
+# after its frame number, bounding box and quality, so a reader that takes
+# the length of 'ids' first always sees complete faces. The matching faces are
+# stored as row indexes of the table, which is not modified while its
+# shards are being written, and the IDs unknown to the table are kept
+# aside.
+class FaceShard(object):
+
+    def __init__(self, table):
+        self.table = table
+        self.ids = []
+        self.frameNumbers = array('l')
+        self.boxes = array('d')
+        self.qualities = array('d')
+        self.matched = []
+        self.removed = []
+        self.processed = []
+
+    def add(self, faceId, frameNumber, boundingBox, quality=1.0):
+        self.boxes.extend(_box_values(boundingBox))
+        self.qualities.append(quality)
+        self.frameNumbers.append(frameNumber)
+        self.ids.append(faceId)
+
+    def set_matches(self, faceId, matchingFaceIds):
+        indexes = self.table.indexes
+        matchingIndexes = array('l')
+        unknownFaceIds = []
+        for matchingId in matchingFaceIds:
+            index = indexes.get(matchingId)
+            if index is None:
+                unknownFaceIds.append(matchingId)
+            else:
+                matchingIndexes.append(index)
+        self.matched.append((faceId, matchingIndexes, unknownFaceIds))
+
+    def remove(self, faceId):
+        self.removed.append(faceId)
@@ -0,0 +1,554 @@
+import bisect
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from multiprocessing.connection import Client, Listener
+from StringIO import StringIO
+
+
+# In-process stand-in for the AWS services used by the handlers, to run and
+# load test the pipeline without AWS. It serves the thumbnails of the
+# 'TestVideo' directory and builds the Rekognition responses from the canned
+# ones of the 'logs' directory. The fixtures are read from the repository
+# root, or from the directory set in the 'FakeFixtures' environment variable.
+#
+# The video has a deterministic cast: the celebrities of the canned
+# responses plus 'numberExtras' unknown people, each appearing in segments
+# of consecutive frames chosen from the seed. The faces of the same person
+# match each other in SearchFaces, with a similarity that decreases with the
+# distance between the frames.
+#
+# Every call can be slowed down and fail the way the real services do:
+# 'latency' maps an API name (or '*' for all of them) to seconds,
+# 'throttleRate' and 'errorRate' are the probabilities of a throttling error
+# and of an internal server error, and 'quotas' maps an API name to the TPS
+# above which the calls are throttled. The defaults come from the
+# 'FakeLatency', 'FakeThrottleRate', 'FakeErrorRate', 'FakeTPS' (applied to
+# the Rekognition APIs) and 'FakeSeed' environment variables.
+
+FIXTURES_DIRECTORY = os.environ.get('FakeFixtures', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+REKOGNITION_APIS = ('index_faces', 'search_faces', 'recognize_celebrities')
+
+# Number of consecutive frames in which a person is either present or absent
+SEGMENT_LENGTH = 12
+
+LIST_OBJECTS_PAGE_SIZE = 1000
+
+
+# Raised like botocore.exceptions.ClientError, with the same 'response'
+class FakeClientError(Exception):
+
+    def __init__(self, code, message, operationName, statusCode=400):
+        Exception.__init__(self, 'An error occurred ({}) when calling the {} operation: {}'.format(code, operationName, message))
+        self.response = {
+            'Error': {'Code': code, 'Message': message},
+            'ResponseMetadata': {'HTTPStatusCode': statusCode}
+        }
+        self.operation_name = operationName
+
+    # Sent back to the processes of a RemoteFakeBackend
+    def __reduce__(self):
+        error = self.response['Error']
+        return (FakeClientError, (error['Code'], error['Message'], self.operation_name, self.response['ResponseMetadata']['HTTPStatusCode']))
+
+
+def _operation_name(apiName):
+    return ''.join(word.capitalize() for word in apiName.split('_'))
+
+
+# Deterministic 32 bit hash of a few integers (FNV-1a)
+def _hash(*values):
+    h = 2166136261
+    for value in values:
+        h = ((h ^ (value & 0xffffffff)) * 16777619) & 0xffffffff
+    return h
+
+
+# Read a captured CLI response: the first line is the shell prompt
+def load_response(name):
+    with open(os.path.join(FIXTURES_DIRECTORY, 'logs', name)) as f:
+        return json.loads(f.read().split('\n', 1)[1])
+
+
+def load_test_event():
+    with open(os.path.join(FIXTURES_DIRECTORY, 'logs', 'test_event.json')) as f:
+        return json.load(f)
+
+
+# Paths of the TestVideo thumbnails, in the order of their frame numbers
+def test_video_thumbnails():
+    directory = os.path.join(FIXTURES_DIRECTORY, 'TestVideo')
+    paths = []
+    for subdirectory in (directory, os.path.join(directory, 'Exceptions')):
+        paths += [os.path.join(subdirectory, i) for i in os.listdir(subdirectory) if i.endswith('.png')]
+    return sorted(paths, key=lambda path: int(path[:-4][-5:]))
+
+
+# The people of the fake video and the frames in which they appear
+class Cast(object):
+
+    def __init__(self, seed, numberExtras=5):
+        self.seed = seed
+        self.people = []
+
+        for name in ('output_2celeb.json', 'example_ouput.json'):
+            for celeb in load_response(name)['CelebrityFaces']:
+                self.people.append({
+                    'Name': celeb['Name'],
+                    'Id': celeb['Id'],
+                    'Urls': celeb['Urls'],
+                    'MatchConfidence': celeb['MatchConfidence'],
+                    'Face': celeb['Face']
+                })
+
+        unrecognizedFaces = load_response('example_ouput.json')['UnrecognizedFaces']
+        for i in range(numberExtras):
+            self.people.append({'Face': unrecognizedFaces[i % len(unrecognizedFaces)]})
+
+    def present(self, personIndex, frameNumber):
+        return _hash(self.seed, personIndex, (frameNumber - 1) // SEGMENT_LENGTH) % 3 == 0
+
+    # Face details of the people present in a frame. The bounding box of
+    # each person is shifted so the people do not overlap, and moves a
+    # little from frame to frame.
+    def faces(self, frameNumber):
+        faces = []
+        for personIndex, person in enumerate(self.people):
+            if not self.present(personIndex, frameNumber):
+                continue
+
+            template = person['Face']['BoundingBox']
+            jitter = (_hash(self.seed, personIndex, frameNumber) % 200 - 100) / 10000.0
+            left = (template['Left'] + 0.11 * personIndex + jitter) % (1 - template['Width'])
+            detail = dict(person['Face'], BoundingBox=dict(template, Left=left, Top=min(max(template['Top'] + jitter, 0), 1 - template['Height'])))
+            faces.append((personIndex, detail))
+        return faces
+
+
+class FakeRekognition(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.collections = {}
+        self.numberFaces = 0
+        self.indexedFrames = {}
+
+    def create_collection(self, CollectionId):
+        self.backend._call('create_collection')
+        with self.backend.lock:
+            if CollectionId in self.collections:
+                raise FakeClientError('ResourceAlreadyExistsException', 'The collection already exists', 'CreateCollection')
+            self.collections[CollectionId] = {'Faces': {}, 'ByPerson': {}}
+        return {'StatusCode': 200, 'CollectionArn': 'aws:rekognition:fake:collection/' + CollectionId}
+
+    def delete_collection(self, CollectionId):
+        self.backend._call('delete_collection')
+        with self.backend.lock:
+            if self.collections.pop(CollectionId, None) is None:
+                raise FakeClientError('ResourceNotFoundException', 'The collection does not exist', 'DeleteCollection')
+        return {'StatusCode': 200}
+
+    def list_collections(self, **kwargs):
+        self.backend._call('list_collections')
+        with self.backend.lock:
+            return {'CollectionIds': sorted(self.collections)}
+
+    def _collection(self, collectionId, operationName):
+        if not collectionId in self.collections:
+            raise FakeClientError('ResourceNotFoundException', 'The collection does not exist', operationName)
+        return self.collections[collectionId]
+
+    def _frame_number(self, image, operationName):
+        try:
+            s3Object = image['S3Object']
+            return self.backend.s3._object(s3Object['Bucket'], s3Object['Name']).get('FrameNumber')
+        except (KeyError, TypeError, FakeClientError):
+            raise FakeClientError('InvalidS3ObjectException', 'Unable to get object metadata from S3', operationName)
+
+    def index_faces(self, CollectionId, Image, ExternalImageId=None, **kwargs):
+        self.backend._call('index_faces')
+        frameNumber = self._frame_number(Image, 'IndexFaces')
+        imageId = str(uuid.uuid4())
+        faceRecords = []
+
+        # The faces are numbered from their frame, their person and the
+        # number of times the frame was indexed in the collection, so the
+        # face IDs and the similarities do not depend on the order of the
+        # concurrent calls
+        with self.backend.lock:
+            collection = self._collection(CollectionId, 'IndexFaces')
+            occurrence = self.indexedFrames.get((CollectionId, frameNumber), 0)
+            self.indexedFrames[(CollectionId, frameNumber)] = occurrence + 1
+            for personIndex, detail in (self.backend.cast.faces(frameNumber) if frameNumber else []):
+                self.numberFaces += 1
+                number = ((occurrence * 1000000) + frameNumber) * len(self.backend.cast.people) + personIndex
+                faceId = '{:08x}-0000-4000-8000-{:012x}'.format(_hash(self.backend.seed), number)
+                collection['Faces'][faceId] = (personIndex, frameNumber, number)
+                bisect.insort(collection['ByPerson'].setdefault(personIndex, []), (frameNumber, number, faceId))
+
+                face = {
+                    'FaceId': faceId,
+                    'BoundingBox': detail['BoundingBox'],
+                    'ImageId': imageId,
+                    'Confidence': detail['Confidence']
+                }
+                if ExternalImageId is not None:
+                    face['ExternalImageId'] = ExternalImageId
+                faceRecords.append({'Face': face, 'FaceDetail': detail})
+
+        return {'FaceRecords': faceRecords, 'OrientationCorrection': 'ROTATE_0'}
+
+    # The faces of the same person closest in time are the most similar
+    def search_faces(self, CollectionId, FaceId, FaceMatchThreshold=80, MaxFaces=100):
+        self.backend._call('search_faces')
+
+        with self.backend.lock:
+            collection = self._collection(CollectionId, 'SearchFaces')
+            if not FaceId in collection['Faces']:
+                raise FakeClientError('InvalidParameterException', 'The face does not exist', 'SearchFaces')
+            personIndex, frameNumber, number = collection['Faces'][FaceId]
+            faces = collection['ByPerson'][personIndex]
+
+            position = bisect.bisect_left(faces, (frameNumber, number, FaceId))
+            before = faces[max(0, position - MaxFaces):position]
+            after = faces[position + 1:position + 1 + MaxFaces]
+
+            faceMatches = []
+            for otherFrameNumber, otherNumber, otherFaceId in before + after:
+                similarity = 100 - min(3.0, abs(frameNumber - otherFrameNumber) * 0.001) - _hash(min(number, otherNumber), max(number, otherNumber)) % 50 / 100.0
+                if similarity >= FaceMatchThreshold:
+                    faceMatches.append({
+                        'Similarity': similarity,
+                        'Face': {'FaceId': otherFaceId, 'Confidence': 99.9}
+                    })
+
+        faceMatches.sort(key=lambda match: -match['Similarity'])
+        return {'SearchedFaceId': FaceId, 'FaceMatches': faceMatches[:MaxFaces]}
+
+    def recognize_celebrities(self, Image):
+        self.backend._call('recognize_celebrities')
+        frameNumber = self._frame_number(Image, 'RecognizeCelebrities')
+
+        celebrityFaces = []
+        unrecognizedFaces = []
+        for personIndex, detail in (self.backend.cast.faces(frameNumber) if frameNumber else []):
+            person = self.backend.cast.people[personIndex]
+            if 'Id' in person:
+                celebrityFaces.append({
+                    'Name': person['Name'],
+                    'Id': person['Id'],
+                    'Urls': person['Urls'],
+                    'MatchConfidence': person['MatchConfidence'],
+                    'Face': detail
+                })
+            else:
+                unrecognizedFaces.append(detail)
+
+        return {
+            'CelebrityFaces': celebrityFaces,
+            'UnrecognizedFaces': unrecognizedFaces,
+            'OrientationCorrection': 'ROTATE_0'
+        }
+
+
+class FakePaginator(object):
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix=''):
+        keys = self.s3._keys(Bucket, Prefix)
+        start = 0
+        while True:
+            self.s3.backend._call('list_objects')
+            page = {'IsTruncated': start + LIST_OBJECTS_PAGE_SIZE < len(keys), 'Name': Bucket, 'Prefix': Prefix}
+            if keys[start:start + LIST_OBJECTS_PAGE_SIZE]:
+                page['Contents'] = [{'Key': key} for key in keys[start:start + LIST_OBJECTS_PAGE_SIZE]]
+            yield page
+
+            start += LIST_OBJECTS_PAGE_SIZE
+            if start >= len(keys):
+                return
+
+
+# Objects are either bytes or a reference to a fixture file, so millions of
+# thumbnails can be served from the few TestVideo files
+class FakeS3(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.objects = {}
+        self.sortedKeys = {}
+        self.files = {}
+
+    def _object(self, bucket, key):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise FakeClientError('NoSuchKey', 'The specified key does not exist.', 'GetObject', 404)
+
+    def _keys(self, bucket, prefix):
+        with self.backend.lock:
+            if not bucket in self.sortedKeys:
+                self.sortedKeys[bucket] = sorted(key for b, key in self.objects if b == bucket)
+            keys = self.sortedKeys[bucket]
+        start = end = bisect.bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return keys[start:end]
+
+    def _store(self, bucket, key, value):
+        with self.backend.lock:
+            self.objects[(bucket, key)] = value
+            self.sortedKeys.pop(bucket, None)
+
+    # The people of a replicated frame differ from the ones of the frame it
+    # was copied from, so the frame number is appended to the PNG after its
+    # IEND chunk, where decoders ignore it, to give each frame its own bytes
+    def _read(self, value):
+        if 'Body' in value:
+            return value['Body']
+        with self.backend.lock:
+            if not value['Path'] in self.files:
+                with open(value['Path'], 'rb') as f:
+                    self.files[value['Path']] = f.read()
+            return self.files[value['Path']] + 'frame-{:05d}'.format(value['FrameNumber'])
+
+    # Store 'numberFrames' thumbnails named '<prefix>00001.png'... cycling
+    # over the TestVideo thumbnails
+    def add_thumbnails(self, bucket, prefix, numberFrames):
+        paths = test_video_thumbnails()
+        with self.backend.lock:
+            for frameNumber in range(1, numberFrames + 1):
+                self.objects[(bucket, '{}{:05d}.png'.format(prefix, frameNumber))] = {
+                    'Path': paths[(frameNumber - 1) % len(paths)],
+                    'FrameNumber': frameNumber
+                }
+            self.sortedKeys.pop(bucket, None)
+
+    def get_paginator(self, operationName):
+        return FakePaginator(self)
+
+    def get_object(self, Bucket, Key):
+        self.backend._call('get_object')
+        body = self._read(self._object(Bucket, Key))
+        return {'Body': StringIO(body), 'ContentLength': len(body)}
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        self.backend._call('put_object')
+        self._store(Bucket, Key, {'Body': Body.read() if hasattr(Body, 'read') else Body})
+        return {}
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        self.backend._call('put_object')
+        with open(Filename, 'rb') as f:
+            self._store(Bucket, Key, {'Body': f.read()})
+
+    def delete_object(self, Bucket, Key):
+        self.backend._call('delete_object')
+        with self.backend.lock:
+            if self.objects.pop((Bucket, Key), None) is not None:
+                self.sortedKeys.pop(Bucket, None)
+        return {}
+
+
+class FakeElasticTranscoder(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.jobs = []
+
+    def create_job(self, **kwargs):
+        self.backend._call('create_job')
+        job = dict(kwargs, Id='{}-{}'.format(int(time.time() * 1000), uuid.uuid4().hex[:6]), Status='Submitted')
+        with self.backend.lock:
+            self.jobs.append(job)
+        return {'Job': job}
+
+
+# Records the invocations. The synchronous invocations of a function
+# registered with register() run its handler in the calling thread.
+class FakeLambda(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.handlers = {}
+        self.invocations = []
+
+    def register(self, functionName, handler):
+        self.handlers[functionName] = handler
+
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload='{}'):
+        self.backend._call('invoke')
+        with self.backend.lock:
+            self.invocations.append({'FunctionName': FunctionName, 'InvocationType': InvocationType, 'Payload': Payload})
+
+        # The asynchronous invocations, such as the re-invocations of the
+        # checkpoints, are only recorded. A synchronous invocation of a
+        # function without a handler fails like an unknown function.
+        if InvocationType != 'RequestResponse':
+            return {'StatusCode': 202 if InvocationType == 'Event' else 204}
+        if not FunctionName in self.handlers:
+            raise FakeClientError('ResourceNotFoundException', 'Function not found: {}'.format(FunctionName), 'Invoke', 404)
+
+        try:
+            result = self.handlers[FunctionName](json.loads(Payload), None)
+        except Exception as e:
+            return {'StatusCode': 200, 'FunctionError': 'Unhandled', 'Payload': StringIO(json.dumps({'errorMessage': str(e)}))}
+        return {'StatusCode': 200, 'Payload': StringIO(json.dumps(result))}
+
+
+class FakeBackend(object):
+
+    def __init__(self, latency=None, throttleRate=None, errorRate=None, quotas=None, seed=None, numberExtras=5):
+        if latency is None:
+            latency = {'*': float(os.environ.get('FakeLatency', 0))}
+        if quotas is None and os.environ.get('FakeTPS'):
+            quotas = dict((apiName, float(os.environ['FakeTPS'])) for apiName in REKOGNITION_APIS)
+
+        self.latency = latency
+        self.throttleRate = float(throttleRate if throttleRate is not None else os.environ.get('FakeThrottleRate', 0))
+        self.errorRate = float(errorRate if errorRate is not None else os.environ.get('FakeErrorRate', 0))
+        self.quotas = quotas or {}
+        self.seed = int(seed if seed is not None else os.environ.get('FakeSeed', 0))
+        self.random = random.Random(self.seed)
+        self.lock = threading.RLock()
+        self.windows = {}
+        self.calls = {}
+
+        self.cast = Cast(self.seed, numberExtras)
+        self.s3 = FakeS3(self)
+        self.rekognition = FakeRekognition(self)
+        self.clients = {
+            'rekognition': self.rekognition,
+            's3': self.s3,
+            'elastictranscoder': FakeElasticTranscoder(self),
+            'lambda': FakeLambda(self)
+        }
+
+    def client(self, serviceName, config=None):
+        return self.clients[serviceName]
+
+    # Store the thumbnails of the video of an Elastic Transcoder notification
+    def add_video(self, event, bucket, numberFrames):
+        message = json.loads(event['Records'][0]['Sns']['Message'])
+        prefix = message['outputKeyPrefix'] + message['outputs'][0]['thumbnailPattern'].replace('{count}', '')
+        self.s3.add_thumbnails(bucket, prefix, numberFrames)
+
+    # Count the call and apply the simulated latency and faults
+    def _call(self, apiName):
+        now = time.time()
+        with self.lock:
+            self.calls[apiName] = self.calls.get(apiName, 0) + 1
+
+            throttled = False
+            if apiName in self.quotas:
+                window = self.windows.setdefault(apiName, deque())
+                while window and now - window[0] >= 1:
+                    window.popleft()
+                if len(window) >= self.quotas[apiName]:
+                    throttled = 'Quota'
+                else:
+                    window.append(now)
+
+            throttled = throttled or self.random.random() < self.throttleRate
+            failed = self.random.random() < self.errorRate
+
+        latency = self.latency.get(apiName, self.latency.get('*', 0))
+        if latency:
+            time.sleep(latency)
+
+        if throttled == 'Quota':
+            raise FakeClientError('ProvisionedThroughputExceededException', 'Provisioned rate exceeded', _operation_name(apiName))
+        if throttled:
+            raise FakeClientError('ThrottlingException', 'Rate exceeded', _operation_name(apiName))
+        if failed:
+            raise FakeClientError('InternalServerError', 'Internal server error', _operation_name(apiName), 500)
+
+
+# Serves a fake backend to other processes, such as the shard workers run by
+# sharding.LocalInvoker, so they share its collections, objects and call
+# counts. Each connection is served by its own thread, which runs the calls
+# sent over it on the fake and sends back their result or exception. The
+# environment() variables let the backend module of a new process connect
+# to the server.
+class FakeBackendServer(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.authkey = os.urandom(16)
+        self.listener = Listener(authkey=self.authkey)
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def environment(self):
+        return {'FakeBackendAddress': self.listener.address, 'FakeBackendKey': self.authkey.encode('hex')}
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except Exception:
+                return
+            thread = threading.Thread(target=self._serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, connection):
+        while True:
+            try:
+                serviceName, methodName, args, kwargs = connection.recv()
+            except (EOFError, IOError):
+                connection.close()
+                return
+            try:
+                result = (True, getattr(self.backend.client(serviceName), methodName)(*args, **kwargs))
+            except Exception as e:
+                result = (False, e)
+            connection.send(result)
+
+    def close(self):
+        self.listener.close()
+
+
+# Backend of a process whose calls are run by the FakeBackendServer at
+# 'address'. Each thread has its own connection to the server.
+class RemoteFakeBackend(object):
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.connections = threading.local()
+
+    def call(self, serviceName, methodName, args, kwargs):
+        if not hasattr(self.connections, 'connection'):
+            self.connections.connection = Client(self.address, authkey=self.authkey)
+        self.connections.connection.send((serviceName, methodName, args, kwargs))
+        succeeded, result = self.connections.connection.recv()
+        if not succeeded:
+            raise result
+        return result
+
+    def client(self, serviceName, config=None):
+        return RemoteFakeClient(self, serviceName)
+
+
+class RemoteFakeClient(object):
+
+    def __init__(self, backend, serviceName):
+        self.backend = backend
+        self.serviceName = serviceName
+
+    def __getattr__(self, methodName):
+        if methodName.startswith('_'):
+            raise AttributeError(methodName)
+
+        def call(*args, **kwargs):
+            return self.backend.call(self.serviceName, methodName, args, kwargs)
+        return call
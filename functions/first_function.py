@@ -1,10 +1,21 @@
-import boto3
+import backend
+import metrics
 import json
 import urllib
 import os
 from datetime import datetime
+from retry import RetryPolicy
 
+# The metrics of the invocation are written when it returns
 def lambda_handler(event, context):
+    metrics.begin(getattr(context, 'function_name', 'first_function'))
+    try:
+        return create_job(event, context)
+    finally:
+        metrics.flush()
+
+
+def create_job(event, context):
 
     print("Received event")
     print(json.dumps(event))
@@ -19,8 +30,10 @@ def lambda_handler(event, context):
         # to the names of all files that the job creates
         timestamp = datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')
 
-        client = boto3.client('elastictranscoder')
-        response = client.create_job(
+        # Throttling and transient errors are retried with backoff
+        client = backend.client('elastictranscoder')
+        response = RetryPolicy().call(
+            client.create_job,
             PipelineId=os.environ['PipelineId'],
             Input={'Key': key},
             OutputKeyPrefix='elastictranscoder/{}/{}_'.format(filename, timestamp),
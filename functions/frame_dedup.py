@@ -0,0 +1,127 @@
+import os
+from StringIO import StringIO
+
+import executor
+
+
+HASH_SIZE = 8
+
+
+def frame_number(key):
+    return int(key[:-4][-5:])
+
+
+# Difference hash of an image: the image is reduced to a 9x8 grayscale
+# thumbnail and each bit tells whether a pixel is brighter than its right
+# neighbour. Near-identical frames have hashes with a small Hamming distance.
+def dhash(image, size=HASH_SIZE):
+    from PIL import Image
+    pixels = list(image.convert('L').resize((size + 1, size), Image.ANTIALIAS).getdata())
+    value = 0
+    for row in range(size):
+        for column in range(size):
+            left = pixels[row * (size + 1) + column]
+            right = pixels[row * (size + 1) + column + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+# Download the thumbnails with the threads of the 'thumbnails' stage
+# executor and apply 'function' to
+# each decoded image. A thumbnail that cannot be downloaded or decoded gets
+# no result. PIL is only imported by the handlers that decode thumbnails, to
+# keep the cold start of the others short.
+def map_thumbnails(s3, bucket, keys, function, threads=20):
+    from PIL import Image
+    results = {}
+
+    def process_thumbnail(key):
+        try:
+            response = s3.get_object(Bucket=bucket, Key=key)
+            results[key] = function(Image.open(StringIO(response['Body'].read())))
+        except Exception as e:
+            print('Failed to process the thumbnail {}'.format(key))
+            print(e)
+
+    stage = executor.get_executor('thumbnails', threads).stage(process_thumbnail)
+    for key in keys:
+        stage.submit(key)
+    stage.close()
+    stage.join()
+    return results
+
+
+# A thumbnail without a hash is never grouped with another one
+def compute_hashes(s3, bucket, keys):
+    return map_thumbnails(s3, bucket, keys, dhash)
+
+
+# Group the consecutive frames whose hash is within 'threshold' bits of the
+# first frame of the group. Comparing with the first frame instead of the
+# previous one prevents a slow pan from being merged into a single group.
+# Returns a dict mapping the key of the first frame of each group to the
+# keys of the other frames of the group.
+def group_frames(keys, hashes, threshold):
+    groups = {}
+    representative = None
+    previousFrameNumber = None
+
+    for key in sorted(keys, key=frame_number):
+        if (representative is not None and
+                frame_number(key) == previousFrameNumber + 1 and
+                key in hashes and representative in hashes and
+                hamming_distance(hashes[key], hashes[representative]) <= threshold):
+            groups[representative].append(key)
+        else:
+            representative = key
+            groups[representative] = []
+        previousFrameNumber = frame_number(key)
+
+    return groups
+
+
+# Plan the Rekognition calls for the thumbnails: only the first frame of each
+# group of near-duplicate frames is sent to the API. Returns None when the
+# deduplication is disabled, which is the case unless the 'DedupThreshold'
+# environment variable is set.
+def plan(s3, bucket, keys):
+    threshold = os.environ.get('DedupThreshold')
+    if threshold is None or not keys:
+        return None
+
+    groups = group_frames(keys, compute_hashes(s3, bucket, keys), int(threshold))
+    print('Deduplication: {} frames in {} groups, {} API calls saved'.format(len(keys), len(groups), len(keys) - len(groups)))
+    return groups
+
+
+def statistics(groups):
+    numberFrames = len(groups) + sum(len(duplicates) for duplicates in groups.values())
+    return {
+        'Frames': numberFrames,
+        'Groups': len(groups),
+        'SavedCalls': numberFrames - len(groups)
+    }
+
+
+# Copy the faces detected in the first frame of each group to the other
+# frames of the group. The copies get a face ID derived from the original
+# one and keep its person ID.
+def expand_faces(faces, groups):
+    facesByFrame = {}
+    for faceId in faces.face_ids():
+        facesByFrame.setdefault(faces.frame_number(faceId), []).append(faceId)
+
+    for representative, duplicates in groups.items():
+        for faceId in facesByFrame.get(frame_number(representative), []):
+            for key in duplicates:
+                faces.add(
+                    '{}-{:05d}'.format(faceId, frame_number(key)),
+                    frame_number(key),
+                    faces.bounding_box(faceId),
+                    faces.person_id(faceId),
+                    faces.quality(faceId)
+                )
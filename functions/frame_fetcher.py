@@ -0,0 +1,129 @@
+import os
+import threading
+from collections import deque
+
+import executor
+
+
+# Decoded video thumbnails keyed by frame number, downloaded once each by
+# the threads of the 'frames' stage executor before they are needed.
+#
+# 'load' is a function returning the decoded image of a frame number. The
+# frames passed to prefetch() are downloaded in that order by 'threads'
+# threads, and a frame listed several times is downloaded once. Each frame
+# is kept until its last use in the prefetch order, counted by get(), and
+# then released. At most 'capacity' frames are downloaded ahead or kept at
+# the same time, so the memory used stays bounded whatever the number of
+# frames: when they are all kept for later uses, get() downloads the next
+# frame itself. A frame that was not prefetched is loaded by get() in the
+# calling thread and not kept.
+class FrameFetcher(object):
+
+    def __init__(self, load, capacity=None, threads=None):
+        self.load = load
+        self.capacity = int(capacity or os.environ.get('FrameCacheSize', 32))
+        self.threads = int(threads or os.environ.get('FrameFetchThreads', 10))
+        self.cache = {}
+        self.uses = {}
+        self.pending = {}
+        self.prefetched = {}
+        self.backlog = deque()
+        self.backlogFrames = set()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.downloads = 0
+
+    def _fetch(self, frameNumber):
+        try:
+            result = self._load(frameNumber)
+        except Exception as e:
+            result = e
+
+        with self.lock:
+            self.prefetched[frameNumber] = result
+            self.pending[frameNumber].set()
+
+    def _load(self, frameNumber):
+        image = self.load(frameNumber)
+        image.load()
+        with self.lock:
+            self.downloads += 1
+        return image
+
+    # Must be called with the lock held. The frames taken from the backlog by
+    # get() are skipped.
+    def _schedule(self):
+        while self.backlog and len(self.pending) + len(self.cache) < self.capacity:
+            frameNumber = self.backlog.popleft()
+            if not frameNumber in self.backlogFrames:
+                continue
+            self.backlogFrames.remove(frameNumber)
+            self.pending[frameNumber] = threading.Event()
+            self.executor.submit(self._fetch, frameNumber)
+
+    # Must be called with the lock held: count a use of the frame and keep it
+    # only if it has uses left
+    def _use(self, frameNumber, image):
+        remaining = self.uses.get(frameNumber, 1) - 1
+        if remaining > 0:
+            self.uses[frameNumber] = remaining
+            self.cache[frameNumber] = image
+        else:
+            self.uses.pop(frameNumber, None)
+            self.cache.pop(frameNumber, None)
+
+    def prefetch(self, frameNumbers):
+        with self.lock:
+            if self.executor is None:
+                # The frames are submitted with the lock held, so submit()
+                # must never block
+                self.executor = executor.get_executor('frames', self.threads, bounded=False)
+            for frameNumber in frameNumbers:
+                self.uses[frameNumber] = self.uses.get(frameNumber, 0) + 1
+                if not (frameNumber in self.cache or frameNumber in self.pending or frameNumber in self.backlogFrames):
+                    self.backlog.append(frameNumber)
+                    self.backlogFrames.add(frameNumber)
+            self._schedule()
+
+    def get(self, frameNumber):
+        event = None
+        with self.lock:
+            if not frameNumber in self.cache:
+                event = self.pending.get(frameNumber)
+                self.backlogFrames.discard(frameNumber)
+        if event is not None:
+            event.wait()
+
+        with self.lock:
+            if frameNumber in self.prefetched:
+                del self.pending[frameNumber]
+                image = self.prefetched.pop(frameNumber)
+            else:
+                image = self.cache.get(frameNumber)
+            if image is not None and not isinstance(image, Exception):
+                self._use(frameNumber, image)
+            self._schedule()
+        if isinstance(image, Exception):
+            raise image
+
+        if image is None:
+            image = self._load(frameNumber)
+            with self.lock:
+                self._use(frameNumber, image)
+                self._schedule()
+        return image
+
+
+# Largest number of frames kept at the same time for a later use when the
+# frames are used in the order of 'frameNumbers'
+def kept_frames(frameNumbers):
+    lastUses = dict((frameNumber, position) for position, frameNumber in enumerate(frameNumbers))
+    kept = set()
+    peak = 0
+    for position, frameNumber in enumerate(frameNumbers):
+        if lastUses[frameNumber] > position:
+            kept.add(frameNumber)
+        else:
+            kept.discard(frameNumber)
+        peak = max(peak, len(kept))
+    return peak
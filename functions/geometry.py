@@ -0,0 +1,48 @@
+import math
+
+
+# Operations on the bounding boxes returned by Amazon Rekognition, whose
+# 'Left', 'Top', 'Width' and 'Height' are ratios of the image size.
+
+
+# Intersection over union of two bounding boxes, from 0 (disjoint) to 1
+# (identical)
+def iou(a, b):
+    width = min(a['Left'] + a['Width'], b['Left'] + b['Width']) - max(a['Left'], b['Left'])
+    height = min(a['Top'] + a['Height'], b['Top'] + b['Height']) - max(a['Top'], b['Top'])
+    if width <= 0 or height <= 0:
+        return 0.0
+
+    intersection = width * height
+    union = a['Width'] * a['Height'] + b['Width'] * b['Height'] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+# Spatial index of bounding boxes on a uniform grid of 'cellSize' ratios of
+# the image. Each box is registered in every cell it covers, so query()
+# returns the items whose boxes may overlap a box after looking at a few
+# cells instead of every item.
+class GridIndex(object):
+
+    def __init__(self, cellSize=0.1):
+        self.cellSize = cellSize
+        self.cells = {}
+
+    def _cells(self, box):
+        left = int(math.floor(box['Left'] / self.cellSize))
+        right = int(math.floor((box['Left'] + box['Width']) / self.cellSize))
+        top = int(math.floor(box['Top'] / self.cellSize))
+        bottom = int(math.floor((box['Top'] + box['Height']) / self.cellSize))
+        for x in range(left, right + 1):
+            for y in range(top, bottom + 1):
+                yield (x, y)
+
+    def insert(self, item, box):
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, []).append(item)
+
+    def query(self, box):
+        items = set()
+        for cell in self._cells(box):
+            items.update(self.cells.get(cell, ()))
+        return items
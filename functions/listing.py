@@ -0,0 +1,42 @@
+import metrics
+
+
+# Thumbnail keys created by Amazon Elastic Transcoder, listed page by page.
+#
+# Iterating over a ThumbnailListing yields the keys as soon as each page of
+# the 'list_objects' paginator is received, so the workers consuming them
+# start while the listing is still paginating. len() returns the number of
+# keys listed so far, which is the total once the iteration is over.
+class ThumbnailListing(object):
+
+    def __init__(self, s3, bucket, prefix):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.count = 0
+
+    def __iter__(self):
+        self.count = 0
+        timer = metrics.timer('List')
+        try:
+            paginator = self.s3.get_paginator('list_objects')
+            response_iterator = paginator.paginate(
+                Bucket=self.bucket,
+                Prefix=self.prefix
+            )
+            for page in response_iterator:
+                for i in page['Contents']:
+                    self.count += 1
+                    yield i['Key']
+
+        except Exception as e:
+            print('Failed to list the thumbnail objects')
+            print(e)
+            raise(e)
+
+        timer.stop()
+        metrics.count('Thumbnails', self.count)
+        print('Number of thumbnail objects found in the S3 bucket: {}'.format(self.count))
+
+    def __len__(self):
+        return self.count
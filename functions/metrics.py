@@ -0,0 +1,296 @@
+import json
+import os
+import threading
+import time
+from array import array
+
+from rate_limiter import is_throttling_error
+
+
+# Metrics of the current invocation, written as CloudWatch Embedded Metric
+# Format (EMF) JSON lines: CloudWatch Logs extracts the metrics from the
+# lines printed by the Lambda functions, without any API call.
+#
+# Counters are summed and timers and latencies are kept as histograms until
+# flush() writes them, with the 50th, 95th and 99th percentiles, the maximum
+# and the count of each histogram; a histogram of a single value, such as the
+# time of a stage, only gets its maximum and count. CloudWatch rejects the
+# documents of more than MAX_METRICS metrics, so flush() splits them. Gauges, such as the depth
+# of a queue, are written right away so they form a time series. The
+# documents go to the sink chosen by the 'MetricsSink' environment variable
+# when the invocation begins: 'stdout' (default) or 'none', which discards
+# them. Their namespace is the 'MetricsNamespace' environment variable.
+
+DEFAULT_NAMESPACE = 'FaceRekognition'
+
+PERCENTILES = (50, 95, 99)
+
+# Maximum number of metrics in an EMF document
+MAX_METRICS = 100
+
+
+class StdoutSink(object):
+
+    def emit(self, document):
+        print(json.dumps(document, sort_keys=True))
+
+
+class NullSink(object):
+
+    def emit(self, document):
+        pass
+
+
+# Keeps the documents in memory, to inspect them in benchmarks
+class ListSink(object):
+
+    def __init__(self):
+        self.documents = []
+
+    def emit(self, document):
+        self.documents.append(document)
+
+
+def get_sink():
+    if os.environ.get('MetricsSink', 'stdout') == 'none':
+        return NullSink()
+    return StdoutSink()
+
+
+def percentile(sortedValues, p):
+    index = int(round(p / 100.0 * (len(sortedValues) - 1)))
+    return sortedValues[index]
+
+
+# Times a block, as a context manager, or the code between its creation and
+# stop(). The duration is recorded in milliseconds under '<name>Time'.
+class Timer(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = time.time()
+
+    def stop(self):
+        self.metrics.observe(self.name + 'Time', (time.time() - self.start) * 1000)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.stop()
+
+
+class Metrics(object):
+
+    def __init__(self, sink=None):
+        self.configuredSink = sink
+        self.sink = sink or get_sink()
+        self.namespace = os.environ.get('MetricsNamespace', DEFAULT_NAMESPACE)
+        self.lock = threading.Lock()
+        self.dimensions = {}
+        self.counters = {}
+        self.histograms = {}
+        self.units = {}
+        self.start = time.time()
+        self.previous = None
+
+    # Start the metrics of a new invocation of 'functionName'. Unless a sink
+    # was given, the sink and the namespace are read from the environment
+    # again, so a warm container follows their changes.
+    def begin(self, functionName):
+        with self.lock:
+            self.sink = self.configuredSink or get_sink()
+            self.namespace = os.environ.get('MetricsNamespace', DEFAULT_NAMESPACE)
+            self.dimensions = {'FunctionName': functionName}
+            self.start = time.time()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, unit='Milliseconds'):
+        with self.lock:
+            if not name in self.histograms:
+                self.histograms[name] = array('d')
+                self.units[name] = unit
+            self.histograms[name].append(value)
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def gauge(self, name, value, unit='Count', **dimensions):
+        dimensions = dict(self.dimensions, **dimensions)
+        self.sink.emit(self._document(dimensions, {name: (value, unit)}))
+
+    def _document(self, dimensions, values):
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [sorted(dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (value, unit) in sorted(values.items())]
+                }]
+            }
+        }
+        document.update(dimensions)
+        for name, (value, unit) in values.items():
+            document[name] = value
+        return document
+
+    # Write the counters and histograms recorded since the previous flush
+    def flush(self):
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            histograms, self.histograms = self.histograms, {}
+            units = dict(self.units)
+            dimensions = dict(self.dimensions)
+
+        values = {'InvocationTime': ((time.time() - self.start) * 1000, 'Milliseconds')}
+        for name, value in counters.items():
+            values[name] = (value, 'Count')
+        for name, histogram in histograms.items():
+            sortedValues = sorted(histogram)
+            if len(sortedValues) > 1:
+                for p in PERCENTILES:
+                    values['{}P{}'.format(name, p)] = (percentile(sortedValues, p), units[name])
+            values[name + 'Max'] = (sortedValues[-1], units[name])
+            values[name + 'Count'] = (len(sortedValues), 'Count')
+
+        names = sorted(values)
+        for i in range(0, len(names), MAX_METRICS):
+            self.sink.emit(self._document(dimensions, dict((name, values[name]) for name in names[i:i + MAX_METRICS])))
+
+
+def _operation_name(apiName):
+    return ''.join(word.capitalize() for word in apiName.split('_'))
+
+
+# Records the calls of 'paginate' page by page, since the pages of a
+# listing are requested while it is iterated
+class InstrumentedPaginator(object):
+
+    def __init__(self, paginator, operationName):
+        self._paginator = paginator
+        self._operationName = operationName
+
+    def paginate(self, **kwargs):
+        pages = iter(self._paginator.paginate(**kwargs))
+        while True:
+            start = time.time()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            except Exception as e:
+                record_call(self._operationName, start, e)
+                raise
+            record_call(self._operationName, start)
+            yield page
+
+
+# Proxy of a boto3 client recording the number of calls, the latency, the
+# errors and the throttling errors of each operation
+class InstrumentedClient(object):
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name == 'get_paginator':
+            return lambda operationName: InstrumentedPaginator(attribute(operationName), _operation_name(operationName))
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        operationName = _operation_name(name)
+
+        def call(*args, **kwargs):
+            start = time.time()
+            try:
+                response = attribute(*args, **kwargs)
+            except Exception as e:
+                record_call(operationName, start, e)
+                raise
+            record_call(operationName, start)
+            return response
+
+        return call
+
+
+def record_call(operationName, start, e=None):
+    metrics = current()
+    metrics.observe(operationName + 'Latency', (time.time() - start) * 1000)
+    metrics.count(operationName + 'Calls')
+    if e is not None:
+        metrics.count(operationName + 'Errors')
+        if is_throttling_error(e):
+            metrics.count(operationName + 'Throttles')
+
+
+# Each invocation records into a Metrics object of its own, the current one
+# of the thread that called begin(). The stage executors make the Metrics of
+# the thread submitting a call current in the worker thread running it, so
+# the clients and the workers of every module record into the invocation
+# they work for, even when several invocations run in the same process, like
+# the shard workers invoked in-process by the fake backend. The metrics
+# recorded outside any invocation go to '_default'.
+_local = threading.local()
+_default = Metrics()
+_sink = None
+
+
+def current():
+    return getattr(_local, 'metrics', None) or _default
+
+
+# Make 'metrics' the current Metrics of the calling thread and return the
+# previous one
+def activate(metrics):
+    previous = getattr(_local, 'metrics', None)
+    _local.metrics = metrics
+    return previous
+
+
+# The sink of the invocations that begin after this call, instead of the one
+# chosen by 'MetricsSink'. None restores the environment variable.
+def set_sink(sink):
+    global _sink
+    _sink = sink
+
+
+def begin(functionName):
+    metrics = Metrics(_sink)
+    metrics.begin(functionName)
+    metrics.previous = activate(metrics)
+    return metrics
+
+
+def count(name, value=1):
+    current().count(name, value)
+
+
+def observe(name, value, unit='Milliseconds'):
+    current().observe(name, value, unit)
+
+
+def timer(name):
+    return current().timer(name)
+
+
+def gauge(name, value, unit='Count', **dimensions):
+    current().gauge(name, value, unit, **dimensions)
+
+
+# Write the metrics of the current invocation and end it: the Metrics that
+# was current before begin() is current again
+def flush():
+    metrics = current()
+    metrics.flush()
+    if metrics is not _default:
+        activate(metrics.previous)
+
+
+def instrument(client):
+    return InstrumentedClient(client)
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+
+# Error codes returned by Amazon Rekognition when we exceed the account quota
+THROTTLING_ERRORS = ('ThrottlingException', 'ProvisionedThroughputExceededException')
+
+# Default transactions per second for each API. They can be overridden with
+# the environment variables '<Api>TPS' (for example 'IndexFacesTPS') and
+# '<Api>MaxTPS', which is the ceiling the limiter can probe up to.
+DEFAULT_TPS = {
+    'index_faces': 50,
+    'search_faces': 50,
+    'recognize_celebrities': 50
+}
+
+_limiters = {}
+_limitersLock = threading.Lock()
+
+
+def burst_capacity(rate):
+    return max(1.0, rate * BURST_SECONDS)
+
+
+def is_throttling_error(e):
+    try:
+        return e.response['Error']['Code'] in THROTTLING_ERRORS
+    except (AttributeError, KeyError, TypeError):
+        return type(e).__name__ in THROTTLING_ERRORS
+
+
+# Seconds of traffic that the token buckets may send at once after an idle
+# period
+BURST_SECONDS = 0.1
+
+
+# A token bucket shared by all the threads calling the same API. Each call to
+# acquire() reserves the next free slot and sleeps until it is due, so waiting
+# threads are served in order instead of polling the bucket. The bucket
+# starts with one token and holds at most BURST_SECONDS of traffic, so a
+# stage does not begin with a burst above the quota.
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else burst_capacity(self.rate)
+        self.tokens = min(1.0, self.capacity)
+        self.timestamp = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+    def acquire(self):
+        with self.lock:
+            self._refill(time.time())
+            self.tokens -= 1
+            timeToWait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if timeToWait > 0:
+            time.sleep(timeToWait)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.time())
+            self.rate = float(rate)
+            self.capacity = burst_capacity(self.rate)
+            self.tokens = min(self.tokens, self.capacity)
+
+
+# Token bucket whose rate follows an AIMD policy: every successful call adds
+# 'increaseStep' TPS per second of traffic up to 'maxRate', and a throttling
+# error multiplies the rate by 'decreaseFactor' down to 'minRate'. Throttling
+# errors received within 'cooldown' seconds of the last decrease are counted
+# once, because the threads that were already in flight see the same burst.
+class AdaptiveRateLimiter(object):
+
+    def __init__(self, name, rate, minRate=1, maxRate=None, increaseStep=1.0, decreaseFactor=0.5, cooldown=1.0):
+        self.name = name
+        self.rate = float(rate)
+        self.minRate = float(minRate)
+        self.maxRate = float(maxRate) if maxRate else self.rate
+        self.increaseStep = increaseStep
+        self.decreaseFactor = decreaseFactor
+        self.cooldown = cooldown
+        self.bucket = TokenBucket(self.rate)
+        self.lock = threading.Lock()
+        self.lastDecrease = 0
+        self.throttleCount = 0
+        self.configuredRate = self.rate
+        self.configuredMinRate = self.minRate
+        self.configuredMaxRate = self.maxRate
+        self.share = 1.0
+
+    def acquire(self):
+        self.bucket.acquire()
+
+    def record_success(self):
+        with self.lock:
+            if self.rate < self.maxRate:
+                self.rate = min(self.maxRate, self.rate + self.increaseStep / self.rate)
+                self.bucket.set_rate(self.rate)
+
+    def record_throttle(self):
+        with self.lock:
+            self.throttleCount += 1
+            now = time.time()
+            if now - self.lastDecrease >= self.cooldown:
+                self.rate = max(self.minRate, self.rate * self.decreaseFactor)
+                self.bucket.set_rate(self.rate)
+                self.lastDecrease = now
+                print('Throttled by {}, rate reduced to {:.1f} TPS'.format(self.name, self.rate))
+
+    # Limit this limiter to a share of the configured rates, used when several
+    # invocations call the same API at the same time. The rates are always
+    # scaled from the configured ones, so a small share in one invocation
+    # does not lower the minimum rate of the next ones in the container.
+    def set_share(self, share):
+        with self.lock:
+            if share == self.share:
+                return
+            self.share = share
+            self.rate = self.configuredRate * share
+            self.maxRate = self.configuredMaxRate * share
+            self.minRate = min(self.configuredMinRate, self.rate)
+            self.bucket.set_rate(self.rate)
+
+    # Wait for a slot, call the API and feed the outcome back into the rate
+    def call(self, function, **kwargs):
+        self.acquire()
+        try:
+            response = function(**kwargs)
+        except Exception as e:
+            if is_throttling_error(e):
+                self.record_throttle()
+            raise
+        self.record_success()
+        return response
+
+
+def _env_name(apiName):
+    return ''.join(word.capitalize() for word in apiName.split('_'))
+
+
+# Return the limiter shared by every thread calling 'apiName'. Limiters are
+# kept at module level so warm invocations start from the rate learned by the
+# previous one. 'share' is the fraction of the configured rates this
+# invocation may use.
+def get_limiter(apiName, share=None):
+    with _limitersLock:
+        if apiName not in _limiters:
+            envName = _env_name(apiName)
+            rate = float(os.environ.get(envName + 'TPS', DEFAULT_TPS.get(apiName, 5)))
+            maxRate = float(os.environ.get(envName + 'MaxTPS', rate))
+            _limiters[apiName] = AdaptiveRateLimiter(apiName, rate, maxRate=maxRate)
+        limiter = _limiters[apiName]
+
+    if share is not None:
+        limiter.set_share(share)
+    return limiter
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from retry import RetryPolicy
+
+
+# Storage keeping the cached responses as JSON objects in the S3 bucket
+class S3CacheStorage(object):
+
+    def __init__(self, s3, bucket, prefix='cache/'):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key + '.json')
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def put(self, key, value):
+        self.s3.put_object(
+            Body=json.dumps(value).encode(),
+            Bucket=self.bucket,
+            Key=self.prefix + key + '.json'
+        )
+
+
+# Storage keeping the cached responses in a local directory
+class LocalCacheStorage(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace('/', '_') + '.json')
+
+    def get(self, key):
+        if not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key)) as f:
+            return json.load(f)
+
+    def put(self, key, value):
+        # Write to a temporary file first so a reader never sees a truncated
+        # response
+        path = self._path(key)
+        temporaryPath = '{}.{}.tmp'.format(path, threading.current_thread().ident)
+        with open(temporaryPath, 'w') as f:
+            json.dump(value, f)
+        os.rename(temporaryPath, path)
+
+
+# Storage keeping the last 'capacity' responses in memory
+class MemoryCacheStorage(object):
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.responses = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if not key in self.responses:
+                return None
+            value = self.responses.pop(key)
+            self.responses[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.responses.pop(key, None)
+            self.responses[key] = value
+            while len(self.responses) > self.capacity:
+                self.responses.popitem(last=False)
+
+
+# Cache of the Rekognition responses keyed by the content of the thumbnail.
+#
+# The key is the SHA-256 of the thumbnail bytes, the API name and the
+# parameters of the call that change the response, so a thumbnail uploaded
+# again with another video, or a duplicate frame, gets the cached response.
+# Looking up a thumbnail costs one S3 GET to hash its bytes. The cache never
+# fails a call: storage errors are logged and the API is called.
+#
+# IndexFaces adds the faces to the collection of the video, so only its
+# responses without faces can be reused in another collection: a thumbnail
+# known to have no faces is not sent to IndexFaces again.
+class ResponseCache(object):
+
+    def __init__(self, storage, s3):
+        self.storage = storage
+        self.s3 = s3
+        self.retryPolicy = RetryPolicy()
+
+    def cache_key(self, apiName, content, parameters):
+        contentHash = hashlib.sha256(content).hexdigest()
+        parametersHash = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:16]
+        return '{}/{}/{}'.format(apiName, contentHash, parametersHash)
+
+    # Return the cached response of 'apiName' for the thumbnail 'key', or the
+    # response of 'request', which is stored if 'cacheable' accepts it
+    def call(self, apiName, bucket, key, request, parameters=None, cacheable=None):
+        if self.storage is None:
+            return request()
+
+        operationName = ''.join(word.capitalize() for word in apiName.split('_'))
+        cacheKey = None
+        try:
+            content = self.retryPolicy.call(self.s3.get_object, Bucket=bucket, Key=key)['Body'].read()
+            cacheKey = self.cache_key(apiName, content, parameters or {})
+            response = self.storage.get(cacheKey)
+            if response is not None:
+                metrics.count(operationName + 'CacheHits')
+                return response
+        except Exception as e:
+            print('Failed to read the response cache for {}'.format(key))
+            print(e)
+
+        metrics.count(operationName + 'CacheMisses')
+        response = request()
+        if cacheKey is not None and (cacheable is None or cacheable(response)):
+            try:
+                self.storage.put(cacheKey, dict((k, v) for k, v in response.items() if k != 'ResponseMetadata'))
+            except Exception as e:
+                print('Failed to write the response cache for {}'.format(key))
+                print(e)
+        return response
+
+
+# The in-memory storage is kept at module level so warm invocations reuse it
+_memoryStorage = None
+_memoryStorageLock = threading.Lock()
+
+
+# The cache is disabled unless the 'ResponseCache' environment variable is
+# 's3' (objects under 'ResponseCachePrefix' in the bucket), 'local' (files in
+# 'ResponseCacheDirectory') or 'memory' (the last 'ResponseCacheSize'
+# responses of the container).
+def get_cache(s3):
+    global _memoryStorage
+    mode = os.environ.get('ResponseCache')
+
+    if mode == 's3':
+        storage = S3CacheStorage(s3, os.environ['Bucket'], os.environ.get('ResponseCachePrefix', 'cache/'))
+    elif mode == 'local':
+        storage = LocalCacheStorage(os.environ.get('ResponseCacheDirectory', '/tmp/response-cache'))
+    elif mode == 'memory':
+        with _memoryStorageLock:
+            if _memoryStorage is None:
+                _memoryStorage = MemoryCacheStorage(int(os.environ.get('ResponseCacheSize', 10000)))
+            storage = _memoryStorage
+    else:
+        storage = None
+
+    return ResponseCache(storage, s3)
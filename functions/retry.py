@@ -0,0 +1,112 @@
+import os
+import random
+import threading
+import time
+
+import metrics
+from rate_limiter import THROTTLING_ERRORS
+
+
+# Error codes worth retrying: throttling and transient server side errors.
+# Any other error returned by the service (invalid image, missing object,
+# access denied...) fails the same way on every attempt.
+RETRYABLE_ERRORS = THROTTLING_ERRORS + (
+    'InternalServerError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+    'RequestTimeout',
+    'RequestTimeoutException',
+    'SlowDown'
+)
+
+# Exceptions raised by botocore before a response is received
+RETRYABLE_EXCEPTIONS = (
+    'EndpointConnectionError',
+    'ConnectionClosedError',
+    'ConnectTimeoutError',
+    'ReadTimeoutError',
+    'timeout'
+)
+
+
+def error_code(e):
+    try:
+        return e.response['Error']['Code']
+    except (AttributeError, KeyError, TypeError):
+        return type(e).__name__
+
+
+def is_retryable(e):
+    try:
+        response = e.response
+    except AttributeError:
+        return type(e).__name__ in RETRYABLE_EXCEPTIONS
+
+    try:
+        if response['ResponseMetadata']['HTTPStatusCode'] >= 500:
+            return True
+    except (KeyError, TypeError):
+        pass
+    return error_code(e) in RETRYABLE_ERRORS
+
+
+# Calls a function until it succeeds, a fatal error is raised or
+# 'maxAttempts' calls have been made. The delay between two attempts grows
+# exponentially from 'baseDelay' up to 'maxDelay' and uses full jitter so the
+# worker threads that failed together do not retry together.
+class RetryPolicy(object):
+
+    def __init__(self, maxAttempts=None, baseDelay=None, maxDelay=None):
+        self.maxAttempts = int(maxAttempts or os.environ.get('RetryMaxAttempts', 5))
+        self.baseDelay = float(baseDelay or os.environ.get('RetryBaseDelay', 0.2))
+        self.maxDelay = float(maxDelay or os.environ.get('RetryMaxDelay', 10))
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** attempt))
+
+    def call(self, function, *args, **kwargs):
+        attempt = 1
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.maxAttempts or not is_retryable(e):
+                    e.attempts = attempt
+                    raise
+            metrics.count('Retries')
+            time.sleep(self.delay(attempt - 1))
+            attempt += 1
+
+
+# Thread-safe list of the items that could not be processed. It is reported
+# under 'Failures' in the JSON output.
+class FailureLog(object):
+
+    def __init__(self):
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def add(self, stage, item, e):
+        failure = {
+            'Stage': stage,
+            'Key': item,
+            'Error': error_code(e),
+            'Message': str(e),
+            'Attempts': getattr(e, 'attempts', 1)
+        }
+        print('{} failed for {} after {} attempt(s): {}'.format(stage, item, failure['Attempts'], e))
+        with self.lock:
+            self.failures.append(failure)
+
+    # Restore the failures reported by a previous invocation
+    def load(self, failures):
+        with self.lock:
+            self.failures.extend(failures)
+
+    def __len__(self):
+        return len(self.failures)
+
+    def to_json(self):
+        with self.lock:
+            return sorted(self.failures, key=lambda failure: (failure['Stage'], str(failure['Key'])))
@@ -0,0 +1,80 @@
+import os
+
+import frame_dedup
+from frame_dedup import frame_number
+
+
+HISTOGRAM_SIZE = 64
+
+
+# Normalized grayscale histogram of a downscaled image
+def histogram(image):
+    from PIL import Image
+    counts = image.convert('L').resize((HISTOGRAM_SIZE, HISTOGRAM_SIZE), Image.ANTIALIAS).histogram()
+    total = float(sum(counts))
+    return [count / total for count in counts]
+
+
+# Scene-change metric between two images: half of the L1 distance between
+# their histograms, from 0 (same histogram) to 1 (disjoint histograms)
+def histogram_difference(a, b):
+    return sum(abs(x - y) for x, y in zip(a, b)) / 2
+
+
+# Coarse-to-fine sampling plan of the thumbnails. The first pass processes
+# one frame every 'step' frames (and the last frame). The frames in between
+# two coarse frames are processed in a second pass only if faces were found
+# in one of the two coarse frames, or if a scene change was detected between
+# them. 'sceneChanges' lists the coarse keys followed by a scene change.
+class SamplingPlan(object):
+
+    def __init__(self, keys, step, sceneChanges):
+        self.keys = sorted(keys, key=frame_number)
+        self.step = step
+        self.coarseIndexes = list(range(0, len(self.keys), step))
+        if self.coarseIndexes[-1] != len(self.keys) - 1:
+            self.coarseIndexes.append(len(self.keys) - 1)
+        self.coarseKeys = [self.keys[i] for i in self.coarseIndexes]
+        self.sceneChanges = sceneChanges
+
+    def refine_keys(self, framesWithFaces):
+        sceneChanges = set(self.sceneChanges)
+        keys = []
+        for start, end in zip(self.coarseIndexes, self.coarseIndexes[1:]):
+            if (frame_number(self.keys[start]) in framesWithFaces or
+                    frame_number(self.keys[end]) in framesWithFaces or
+                    self.keys[start] in sceneChanges):
+                keys += self.keys[start + 1:end]
+        print('Sampling: {} coarse frames, {} frames refined, {} frames skipped'.format(
+            len(self.coarseKeys), len(keys), len(self.keys) - len(self.coarseKeys) - len(keys)))
+        return keys
+
+
+# Detect the scene changes between consecutive coarse frames by comparing the
+# histograms of the thumbnails. A pair of frames that cannot be compared is
+# handled as a scene change.
+def detect_scene_changes(s3, bucket, coarseKeys, threshold):
+    histograms = frame_dedup.map_thumbnails(s3, bucket, coarseKeys, histogram)
+    sceneChanges = []
+    for key, nextKey in zip(coarseKeys, coarseKeys[1:]):
+        if (not key in histograms or not nextKey in histograms or
+                histogram_difference(histograms[key], histograms[nextKey]) > threshold):
+            sceneChanges.append(key)
+    return sceneChanges
+
+
+# Build the sampling plan of the thumbnails. Returns None when the adaptive
+# sampling is disabled, which is the case unless the 'SamplingStep'
+# environment variable is greater than 1. The scene changes detected by a
+# previous invocation can be passed in 'sceneChanges'.
+def plan(s3, bucket, keys, sceneChanges=None):
+    step = int(os.environ.get('SamplingStep', 1))
+    if step <= 1 or not keys:
+        return None
+
+    samplingPlan = SamplingPlan(keys, step, [])
+    if sceneChanges is None:
+        threshold = float(os.environ.get('SceneChangeThreshold', 0.3))
+        sceneChanges = detect_scene_changes(s3, bucket, samplingPlan.coarseKeys, threshold)
+    samplingPlan.sceneChanges = sceneChanges
+    return samplingPlan
@@ -1,264 +1,507 @@
-import boto3
 import json
 import os
-import sys
-import time
-import random
 import math
-from datetime import datetime
-from Queue import Queue
-from threading import Thread
-from PIL import Image, ImageDraw
+import threading
 from StringIO import StringIO
+import backend
+import celebrities
+import executor
+import face_selection
+import metrics
+import rate_limiter
+import sharding
+import clustering
+import frame_dedup
+import sampling
+import response_cache
+import timeline
+import tracking
+from listing import ThumbnailListing
+from retry import RetryPolicy, FailureLog
+from checkpoint import Checkpoint, get_backend
+from face_table import FaceTable, FaceShard
+from frame_fetcher import FrameFetcher, kept_frames
+from search_scheduler import SearchScheduler
 
 
 CONCURRENT_THREADS = 50
 
 
-def lambda_handler(event, context):
-
-    print("Received event:")
-    print(json.dumps(event))
-    sns_msg = json.loads(event['Records'][0]['Sns']['Message'])
-
-    rekognition = boto3.client('rekognition', region_name=os.environ['AWS_REGION'])
-    s3 = boto3.client('s3', region_name=os.environ['AWS_REGION'])
-
-    faces = {}
-
-
-    # Create a new collection in Amazon Rekognition. I use the ID of the Elastic
-    # Transcoder job for the name of the collection.
-    try:
-        collectionId = sns_msg['jobId']
+# Call the IndexFaces operation for each thumbnail key. I use the 50 threads
+# of the 'rekognition' stage executor, which share one rate limiter, so the
+# calls run at the account quota for IndexFaces, and one client with a
+# connection for each thread. Each thread records the faces detected and the
+# keys processed in its own FaceShard, and the shards are merged into the
+# face table 'faces' and 'processedKeys' when the stage completes.
+# Transient errors are retried with backoff, and the keys that still fail
+# are reported in 'failures' instead of being re-queued. When the deadline
+# approaches the remaining keys are cancelled, and they are processed by the
+# next invocation. Returns False in that case. 'keys' can be a
+# ThumbnailListing that is still paginating: the work queue of the executor
+# is bounded, so the keys are listed at the pace of the workers.
+#
+# In the combined pipeline mode, 'celebrityResults' is a list: each worker
+# also calls RecognizeCelebrities on the keys it indexes and appends the dict
+# in which it records the celebrities found.
+def index_faces(collectionId, keys, faces, processedKeys, failures, checkpoint, celebrityResults=None):
+    retryPolicy = RetryPolicy()
+    indexFacesLimiter = rate_limiter.get_limiter('index_faces')
+    findCelebsLimiter = rate_limiter.get_limiter('recognize_celebrities')
+    rekognition = backend.client('rekognition', max_pool_connections=CONCURRENT_THREADS)
+    responseCache = response_cache.get_cache(backend.client('s3', max_pool_connections=CONCURRENT_THREADS))
+
+    shards = []
+    workerState = threading.local()
+
+    # The shard and the celebrities of the current thread, created by its
+    # first call of the stage
+    def worker_shard():
+        if not hasattr(workerState, 'shard'):
+            workerState.shard = FaceShard(faces)
+            shards.append(workerState.shard)
+            if celebrityResults is not None:
+                workerState.celebs = {}
+                celebrityResults.append(workerState.celebs)
+        return workerState.shard
+
+    def index_face(key):
+        shard = worker_shard()
         try:
-            rekognition.delete_collection(CollectionId=collectionId)
-        except:
-            pass
-        rekognition.create_collection(CollectionId=collectionId)
-        print('Collection {} created in Amazon Rekognition'.format(collectionId))
-
-    except Exception as e:
-        print('Failed to create the collection in Amazon Rekognition')
-        print(e)
-        raise(e)
-
-
-    # Retrieve the list of thumbnail objects in the S3 bucket that were created
-    # by Amazon Elastic Transcoder. The list of keys is stored in the local
-    # variable 'thumbnailKeys'.
-    try:
-        thumbnailKeys = []
-        prefix = sns_msg['outputKeyPrefix']
-        prefix += sns_msg['outputs'][0]['thumbnailPattern'].replace('{count}', '')
-
-        paginator = s3.get_paginator('list_objects')
-        response_iterator = paginator.paginate(
-            Bucket=os.environ['Bucket'],
-            Prefix=prefix
-        )
-        for page in response_iterator:
-            thumbnailKeys += [i['Key'] for i in page['Contents']]
-
-        print('Number of thumbnail objects found in the S3 bucket: {}'.format(len(thumbnailKeys)))
-
-    except Exception as e:
-        print('Failed to list the thumbnail objects')
-        print(e)
-        raise(e)
-
-
-    # Call the IndexFaces operation for each thumbnail. I use 50 concurrent
-    # threads. Each iteration of a thread lasts at least one second. Faces
-    # detected are stored in a local variable 'faces'.
-    indexFacesQueue = Queue()
-
-    def index_faces_worker():
-        rekognition = boto3.client('rekognition', region_name=os.environ['AWS_REGION'])
-
-        while True:
-            key = indexFacesQueue.get()
-            try:
-                startTime = datetime.now()
-                frameNumber = int(key[:-4][-5:])
-
-                response = rekognition.index_faces(
+            frameNumber = int(key[:-4][-5:])
+
+            # A thumbnail the response cache knows to have no faces is
+            # not indexed again
+            response = responseCache.call(
+                'index_faces',
+                os.environ['Bucket'],
+                key,
+                lambda: retryPolicy.call(
+                    indexFacesLimiter.call,
+                    rekognition.index_faces,
                     CollectionId=collectionId,
                     Image={'S3Object': {
                         'Bucket': os.environ['Bucket'],
                         'Name': key
                     }},
                     ExternalImageId=str(frameNumber)
-                )
-
-                for face in response['FaceRecords']:
-                    faceId = face['Face']['FaceId']
-                    faces[faceId] = {
-                        'FrameNumber': frameNumber,
-                        'BoundingBox': face['Face']['BoundingBox']
-                    }
-
-                endTime = datetime.now()
-                delta = int((endTime - startTime).total_seconds() * 1000)
-                if delta < 1000:
-                    timeToWait = float(1000 - delta)/1000
-                    time.sleep(timeToWait)
-
-            # I put the key back in the queue if the IndexFaces operation
-            # failed
-            except:
-                indexFacesQueue.put(key)
-
-            indexFacesQueue.task_done()
+                ),
+                cacheable=lambda response: not response['FaceRecords']
+            )
 
-    for i in range(CONCURRENT_THREADS):
-        t = Thread(target=index_faces_worker)
-        t.daemon = True
-        t.start()
+            for face in response['FaceRecords']:
+                shard.add(face['Face']['FaceId'], frameNumber, face['Face']['BoundingBox'], face_selection.face_quality(face))
 
-    for key in thumbnailKeys:
-        indexFacesQueue.put(key)
+        except Exception as e:
+            failures.add('IndexFaces', key, e)
 
-    indexFacesQueue.join()
-    time.sleep(2)
-    print('IndexFaces operation completed')
+        if celebrityResults is not None:
+            try:
+                response = responseCache.call(
+                    'recognize_celebrities',
+                    os.environ['Bucket'],
+                    key,
+                    lambda: retryPolicy.call(
+                        findCelebsLimiter.call,
+                        rekognition.recognize_celebrities,
+                        Image={'S3Object': {
+                            'Bucket': os.environ['Bucket'],
+                            'Name': key
+                        }}
+                    )
+                )
+                celebrities.record_celebrities(workerState.celebs, response, [frameNumber])
+
+            except Exception as e:
+                failures.add('RecognizeCelebrities', key, e)
+
+        shard.processed.append(key)
+
+    stage = executor.get_executor('rekognition', CONCURRENT_THREADS).stage(index_face, checkpoint.deadline())
+    checkpoint.track_shards(shards, keys=True)
+    with metrics.timer('IndexFaces'):
+        completed = checkpoint.wait(stage, 'IndexFaces', keys)
+
+    faces.merge(shards)
+    for shard in shards:
+        processedKeys.update(shard.processed)
+    checkpoint.track_shards([])
+    return completed
+
+
+# Search for faces that are similar to each face in 'faceIds' with a
+# confidence in matches that is higher than 97%. Like in index_faces(), each
+# thread records its results in its own FaceShard. The matches are merged
+# into 'faces' and the face IDs searched into 'searchedFaces'. 'faceIds' should be
+# in the order of which the faces appear in the video: they are searched in
+# waves, and the search scheduler skips the faces already placed in a cluster
+# by the responses of the previous waves and infers their matches. Returns
+# False if the deadline stopped the search.
+def search_faces(collectionId, faceIds, faces, searchedFaces, failures, checkpoint):
+    retryPolicy = RetryPolicy()
+    searchFacesLimiter = rate_limiter.get_limiter('search_faces')
+    rekognition = backend.client('rekognition', max_pool_connections=CONCURRENT_THREADS)
+
+    scheduler = SearchScheduler()
+    for faceId in faces.face_ids():
+        if faces.searched(faceId):
+            scheduler.record(faceId, faces.matching_faces(faceId))
+
+    shards = []
+    workerState = threading.local()
+
+    def search_face(faceId):
+        if not hasattr(workerState, 'shard'):
+            workerState.shard = FaceShard(faces)
+            shards.append(workerState.shard)
+        shard = workerState.shard
 
+        try:
+            response = retryPolicy.call(
+                searchFacesLimiter.call,
+                rekognition.search_faces,
+                CollectionId=collectionId,
+                FaceId=faceId,
+                FaceMatchThreshold=97,
+                MaxFaces=256
+            )
+            matchingFaces = [i['Face']['FaceId'] for i in response['FaceMatches']]
+            scheduler.record(faceId, matchingFaces)
+
+            # The face is removed from the face table if it has no
+            # matching faces
+            if len(matchingFaces) > 0:
+                shard.set_matches(faceId, matchingFaces)
+            else:
+                shard.remove(faceId)
+
+        # A face that cannot be searched is handled like a face without
+        # matching faces
+        except Exception as e:
+            failures.add('SearchFaces', faceId, e)
+            shard.remove(faceId)
+
+        shard.processed.append(faceId)
+
+    completed = True
+    checkpoint.track_shards(shards)
+    with metrics.timer('SearchFaces'):
+        for wave in scheduler.waves(list(faceIds)):
+            stage = executor.get_executor('rekognition', CONCURRENT_THREADS).stage(search_face, checkpoint.deadline())
+            completed = checkpoint.wait(stage, 'SearchFaces', wave)
+            if not completed:
+                break
+
+    faces.merge(shards)
+    for shard in shards:
+        searchedFaces.update(shard.processed)
+    searchedFaces.update(scheduler.skipped)
+    checkpoint.track_shards([])
+
+    for faceId in scheduler.skipped:
+        if faceId in faces:
+            faces.set_matches(faceId, scheduler.inferred_matches(faceId))
+    metrics.count('SearchFacesSkipped', len(scheduler.skipped))
+    if scheduler.skipped:
+        print('SearchFaces skipped for {} faces already placed in a cluster'.format(len(scheduler.skipped)))
+
+    return completed
+
+
+# Run one stage on the items of a shard dispatched by a coordinator
+# invocation and return the partial results. The worker stops at its own
+# deadline or at the 'Deadline' of the coordinator, whichever comes first.
+# The items that were not processed before it are left out of 'Processed' so
+# the coordinator dispatches them again.
+def process_shard(shard, context):
+    print('Processing {} shard of {} items'.format(shard['Stage'], len(shard['Items'])))
+    rate_limiter.get_limiter('index_faces', shard['RateShare'])
+    rate_limiter.get_limiter('search_faces', shard['RateShare'])
+    rate_limiter.get_limiter('recognize_celebrities', shard['RateShare'])
+
+    checkpoint = Checkpoint(None, shard['CollectionId'], context)
+    checkpoint.stopTime = shard.get('Deadline')
+    failures = FailureLog()
+    processed = set()
+    celebrityResults = [] if combined_pipeline() else None
+
+    faces = FaceTable()
+    if shard['Stage'] == 'IndexFaces':
+        index_faces(shard['CollectionId'], shard['Items'], faces, processed, failures, checkpoint, celebrityResults)
+    else:
+        for faceId in shard['Items']:
+            faces.add(faceId, 0, None)
+        search_faces(shard['CollectionId'], shard['Items'], faces, processed, failures, checkpoint)
+
+    result = {
+        'Faces': faces.to_json(),
+        'Processed': list(processed),
+        'Failures': failures.to_json()
+    }
+    if celebrityResults is not None:
+        result['Celebrities'] = celebrities.merge_celebrities(celebrityResults)
+    return result
+
+
+# In the combined pipeline mode (environment variable 'CombinedPipeline'),
+# the celebrities are recognized in the same pass as the faces are indexed,
+# and the people are labeled with the celebrities
+def combined_pipeline():
+    return os.environ.get('CombinedPipeline', 'false').lower() == 'true'
+
+
+# The metrics of the invocation are written when it returns
+def lambda_handler(event, context, invoker=None):
+    metrics.begin(getattr(context, 'function_name', 'second_function'))
+    try:
+        return process_video(event, context, invoker)
+    finally:
+        metrics.flush()
 
-    # Search for faces that are similar to each face detected by the IndexFaces
-    # operation with a confidence in matches that is higher than 97%.
-    searchFacesQueue = Queue()
 
-    def search_faces_worker():
-        rekognition = boto3.client('rekognition', region_name=os.environ['AWS_REGION'])
+def process_video(event, context, invoker=None):
 
-        while True:
-            faceId = searchFacesQueue.get()
-            try:
-                startTime = datetime.now()
+    print("Received event:")
+    print(json.dumps(event))
 
-                response = rekognition.search_faces(
-                    CollectionId=collectionId,
-                    FaceId=faceId,
-                    FaceMatchThreshold=97,
-                    MaxFaces=256
-                )
-                matchingFaces = [i['Face']['FaceId'] for i in response['FaceMatches']]
+    # Worker invocations dispatched by a coordinator only run one stage on a
+    # shard of the items
+    if 'Shard' in event:
+        return process_shard(event['Shard'], context)
 
-                # Delete the face from the local variable 'faces' if it has no
-                # matching faces
-                if len(matchingFaces) > 0:
-                    faces[faceId]['MatchingFaces'] = matchingFaces
-                else:
-                    del faces[faceId]
+    sns_msg = json.loads(event['Records'][0]['Sns']['Message'])
 
-                endTime = datetime.now()
-                delta = int((endTime - startTime).total_seconds() * 1000)
-                if delta < 1000:
-                    timeToWait = float(1000 - delta)/1000
-                    time.sleep(timeToWait)
+    rekognition = backend.client('rekognition', max_pool_connections=CONCURRENT_THREADS)
+    s3 = backend.client('s3', max_pool_connections=CONCURRENT_THREADS)
 
-            except:
-                searchFacesQueue.put(faceId)
+    failures = FailureLog()
+    rate_limiter.get_limiter('index_faces', 1.0)
+    rate_limiter.get_limiter('search_faces', 1.0)
+    rate_limiter.get_limiter('recognize_celebrities', 1.0)
 
-            searchFacesQueue.task_done()
+    # Load the progress saved by the previous invocation when the function
+    # re-invoked itself before its timeout. The faces, the keys already
+    # processed, the failures and the celebrities found in the combined
+    # pipeline mode are restored from the checkpoint.
+    checkpoint = Checkpoint(get_backend(s3), sns_msg['jobId'], context)
+    resumed = 'ContinuationToken' in event and checkpoint.load()
 
-    for i in range(CONCURRENT_THREADS):
-        t = Thread(target=search_faces_worker)
-        t.daemon = True
-        t.start()
+    faces = FaceTable.from_json(checkpoint.state['Faces'])
+    processedKeys = set(checkpoint.state['ProcessedKeys'])
+    failures.load(checkpoint.state['Failures'])
+    combined = combined_pipeline()
+    celebrityResults = [checkpoint.state.get('Celebrities', {})] if combined else None
+    checkpoint.track(faces, processedKeys, failures, celebrityResults)
 
-    for faceId in list(faces):
-        searchFacesQueue.put(faceId)
 
-    searchFacesQueue.join()
-    print('SearchFaces operation completed')
+    # Create a new collection in Amazon Rekognition. I use the ID of the Elastic
+    # Transcoder job for the name of the collection. A resumed invocation keeps
+    # using the collection created by the first one.
+    try:
+        collectionId = sns_msg['jobId']
+        if not resumed:
+            try:
+                rekognition.delete_collection(CollectionId=collectionId)
+            except:
+                pass
+            rekognition.create_collection(CollectionId=collectionId)
+            print('Collection {} created in Amazon Rekognition'.format(collectionId))
 
+    except Exception as e:
+        print('Failed to create the collection in Amazon Rekognition')
+        print(e)
+        raise(e)
 
-    # Sort the list of face IDs in the order of which they appear in the video.
-    def getKey(item):
-        return item[1]
-    facesFrameNumber = {k: v['FrameNumber'] for k, v in faces.items()}
-    faceIdsSorted = [i[0] for i in sorted(facesFrameNumber.items(), key=getKey)]
 
+    # Retrieve the list of thumbnail objects in the S3 bucket that were created
+    # by Amazon Elastic Transcoder. The list of keys is stored in the local
+    # variable 'thumbnailKeys'. Unless a pre-filter or the sharding needs the
+    # full list first, the keys are streamed to the IndexFaces workers while
+    # the listing is still paginating. An invocation resumed after IndexFaces
+    # does not list the bucket again: the number of thumbnails, the groups of
+    # duplicates and the sharding decision are kept in the checkpoint.
+    shardSize = int(os.environ.get('ShardSize', 0))
+    streaming = not (os.environ.get('DedupThreshold') or int(os.environ.get('SamplingStep', 1)) > 1 or shardSize)
+    indexing = checkpoint.state['Stage'] in (None, 'IndexFaces')
+
+    thumbnailKeys = []
+    if indexing:
+        prefix = sns_msg['outputKeyPrefix']
+        prefix += sns_msg['outputs'][0]['thumbnailPattern'].replace('{count}', '')
+        thumbnailKeys = ThumbnailListing(s3, os.environ['Bucket'], prefix)
+        if not streaming:
+            thumbnailKeys = list(thumbnailKeys)
+
+
+    # Group the near-duplicate consecutive thumbnails when 'DedupThreshold'
+    # is set. Only the first frame of each group is sent to IndexFaces and
+    # its faces are copied to the other frames after clustering. The groups
+    # are kept in the checkpoint so a resumed invocation does not hash the
+    # thumbnails again.
+    if not 'Duplicates' in checkpoint.state:
+        checkpoint.state['Duplicates'] = frame_dedup.plan(s3, os.environ['Bucket'], thumbnailKeys)
+    duplicates = checkpoint.state['Duplicates']
+    indexKeys = sorted(duplicates) if duplicates is not None else thumbnailKeys
+
+
+    # When the video has more thumbnails than 'ShardSize', this invocation
+    # becomes a coordinator: the keys are split into shards that are indexed
+    # and searched by worker invocations, and their partial 'faces' tables
+    # are merged here before clustering. Without a context, as in the
+    # benchmarks and the local runs, the workers are invocations of the
+    # function named by 'AWS_LAMBDA_FUNCTION_NAME', or of second_function.
+    if not 'Sharded' in checkpoint.state:
+        checkpoint.state['Sharded'] = bool(shardSize and len(indexKeys) > shardSize)
+    sharded = checkpoint.state['Sharded']
+    if sharded and invoker is None:
+        functionName = getattr(context, 'function_name', None) or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'second_function')
+        invoker = sharding.LambdaInvoker(functionName)
+
+    def index_pending_faces(keys):
+        pendingKeys = (key for key in keys if not key in processedKeys)
+
+        if sharded:
+            pendingKeys = list(pendingKeys)
+            for result in sharding.run_shards(invoker, 'IndexFaces', collectionId, pendingKeys, shardSize, checkpoint=checkpoint):
+                faces.update_json(result['Faces'])
+                processedKeys.update(result['Processed'])
+                failures.load(result['Failures'])
+                if combined:
+                    celebrityResults.append(result['Celebrities'])
+            pendingKeys = [key for key in pendingKeys if not key in processedKeys]
+
+        return index_faces(collectionId, pendingKeys, faces, processedKeys, failures, checkpoint, celebrityResults)
+
+
+    # When 'SamplingStep' is set, the thumbnails are indexed coarse-to-fine:
+    # first one frame every 'SamplingStep' frames, then the frames in between
+    # where faces were found or the scene changed.
+    completed = True
+    if indexing:
+        samplingPlan = sampling.plan(s3, os.environ['Bucket'], indexKeys, checkpoint.state.get('SceneChanges'))
+
+        if samplingPlan:
+            checkpoint.state['SceneChanges'] = samplingPlan.sceneChanges
+            completed = index_pending_faces(samplingPlan.coarseKeys)
+            if completed:
+                framesWithFaces = faces.frame_numbers()
+                completed = index_pending_faces(samplingPlan.refine_keys(framesWithFaces))
+        else:
+            completed = index_pending_faces(indexKeys)
+
+    if not completed:
+        checkpoint.save('IndexFaces')
+        checkpoint.reinvoke(event)
+        return
+
+    if indexing:
+        checkpoint.state['NumberThumbnails'] = len(thumbnailKeys)
+
+    # Link the faces of consecutive frames into tracks, unless 'FaceTracking'
+    # is false. Only the representatives of each track are searched, and the
+    # other faces of the track get the matches of the representatives whose
+    # search returned them. The faces that no representative returned, such
+    # as the faces of another person after a cut, are searched in a second
+    # round. The tracks are kept in the checkpoint since the faces without
+    # matches are removed by the search.
+    if not 'Tracks' in checkpoint.state:
+        tracks = None
+        if os.environ.get('FaceTracking', 'true').lower() != 'false':
+            with metrics.timer('Track'):
+                tracks = tracking.track_faces(faces)
+            metrics.count('Tracks', len(tracks))
+        checkpoint.state['Tracks'] = tracks
+    tracks = checkpoint.state['Tracks']
+    searchFaceIds = None
+    if tracks is not None:
+        searchFaceIds = set(faceId for track in tracks for faceId in tracking.representatives(track))
+
+    checkpoint.save('SearchFaces')
+    print('IndexFaces operation completed')
 
-    # Identify unique people and detect the frames in which they appear.
-    sys.setrecursionlimit(10000)
 
-    def propagate_person_id(faceId):
-        for matchingId in faces[faceId]['MatchingFaces']:
-            if not 'PersonId' in faces[matchingId]:
+    # Faces already searched by a previous invocation have 'MatchingFaces'
+    def pending_face_ids():
+        return [
+            faceId for faceId in faces.sorted_face_ids()
+            if not faces.searched(faceId) and (searchFaceIds is None or faceId in searchFaceIds)
+        ]
+
+    def search_pending_faces():
+        pendingFaceIds = pending_face_ids()
+
+        if sharded:
+            for result in sharding.run_shards(invoker, 'SearchFaces', collectionId, pendingFaceIds, shardSize, checkpoint=checkpoint):
+                for faceId in result['Processed']:
+                    if faceId in result['Faces']:
+                        faces.set_matches(faceId, result['Faces'][faceId]['MatchingFaces'])
+                    else:
+                        faces.remove(faceId)
+                failures.load(result['Failures'])
+            pendingFaceIds = pending_face_ids()
+
+        return search_faces(collectionId, pendingFaceIds, faces, set(), failures, checkpoint)
+
+    completed = search_pending_faces()
+    if completed and tracks is not None:
+        unconfirmedFaceIds = tracking.unconfirmed_faces(faces, tracks)
+        metrics.count('UnconfirmedTrackFaces', len(unconfirmedFaceIds))
+        if unconfirmedFaceIds:
+            searchFaceIds.update(unconfirmedFaceIds)
+            completed = search_pending_faces()
+
+    if not completed:
+        checkpoint.save('SearchFaces')
+        checkpoint.reinvoke(event)
+        return
+
+    if tracks is not None:
+        tracking.propagate_matches(faces, tracks)
 
-                numberMatchingLoops = 0
-                for matchingId2 in faces[matchingId]['MatchingFaces']:
-                    if faceId in faces[matchingId2]['MatchingFaces']:
-                        numberMatchingLoops = numberMatchingLoops + 1
+    print('SearchFaces operation completed')
 
-                # To avoid false positives, the propagation from faceA to faceB
-                # happens only if there are at least two faces matching faceB
-                # that also match faceA
-                if numberMatchingLoops >= 2:
-                    personId = faces[faceId]['PersonId']
-                    faces[matchingId]['PersonId'] = personId
-                    propagate_person_id(matchingId)
+    # Identify unique people and detect the frames in which they appear. The
+    # person IDs are stored in the face table.
+    clusterTimer = metrics.timer('Cluster')
+    clustering.cluster_table(faces)
 
-    personId = 0
-    for faceId in faceIdsSorted:
-        if not 'PersonId' in faces[faceId]:
-            personId = personId + 1
-            faces[faceId]['PersonId'] = personId
-            propagate_person_id(faceId)
+    if duplicates:
+        frame_dedup.expand_faces(faces, duplicates)
 
     print('Unique people identified')
 
 
-    # Retain only the people that appear in at least 5 consecutive frames
-    # and create the JSON output.
-    people = []
-    maxPersonId = personId
-
-    for personId in range(1, maxPersonId + 1):
-        frames = []
-        previousFrameNumber = None
-        currentNumberConsecutiveFrames = 0
-        maxNumberConsecutiveFrames = 0
-
-        for faceId in faceIdsSorted:
-            if faces[faceId]['PersonId'] == personId:
-
-                frameNumber = faces[faceId]['FrameNumber']
-                frameTimePosition = '{}:{:02d}:{:02d}'.format(
-                    frameNumber / 3600,
-                    (frameNumber - frameNumber / 3600 * 3600) / 60,
-                    frameNumber % 60
-                )
-
-                frames.append({
-                    'FrameNumber': faces[faceId]['FrameNumber'],
-                    'FrameTimePosition': frameTimePosition,
-                    'BoundingBox': faces[faceId]['BoundingBox']
-                })
-
-                if previousFrameNumber == frameNumber - 1:
-                    currentNumberConsecutiveFrames += 1
-                    maxNumberConsecutiveFrames = max(maxNumberConsecutiveFrames, currentNumberConsecutiveFrames)
-                else:
-                    currentNumberConsecutiveFrames = 1
+    # In the combined pipeline mode, each person is labeled with the
+    # celebrity whose faces overlap theirs in the most frames.
+    labels = None
+    if combined:
+        celebs = celebrities.merge_celebrities(celebrityResults)
+        if duplicates:
+            celebrities.expand_celebrities(celebs, duplicates)
+        labels = celebrities.label_people(faces, celebs)
+        timeline.add_appearances(celebs)
+        metrics.count('Celebrities', len(celebs))
 
-                previousFrameNumber = frameNumber
 
-        if maxNumberConsecutiveFrames >= 2:
-            people.append({'Frames': frames})
-
-    output_json = {'People': people}
+    # Retain only the people that appear in at least 2 consecutive frames
+    # and create the JSON output.
+    people = clustering.group_people(faces, labels=labels)
+    output_json = {'People': people, 'Failures': failures.to_json()}
+    if combined:
+        output_json['Celebrities'] = celebs
+    if duplicates is not None:
+        output_json['Deduplication'] = frame_dedup.statistics(duplicates)
+    clusterTimer.stop()
+    metrics.count('People', len(people))
 
 
     # Upload the JSON result into the S3 bucket
     try:
-        s3.put_object(
-            Body=json.dumps(output_json, indent=4).encode(),
-            Bucket=os.environ['Bucket'],
-            Key=sns_msg['outputKeyPrefix'].replace('elastictranscoder/', 'output/')[:-1] + '.json'
-        )
+        with metrics.timer('Upload'):
+            s3.put_object(
+                Body=json.dumps(output_json, indent=4).encode(),
+                Bucket=os.environ['Bucket'],
+                Key=sns_msg['outputKeyPrefix'].replace('elastictranscoder/', 'output/')[:-1] + '.json'
+            )
         print('JSON result uploaded into the S3 bucket')
 
     except Exception as e:
@@ -267,9 +510,12 @@ def lambda_handler(event, context):
         raise(e)
 
 
-    # Create a visual representation
+    # Create a visual representation. PIL is imported here so the shard
+    # workers and the invocations that stop before this point do not load it.
+    renderTimer = metrics.timer('Render')
+    from PIL import Image, ImageDraw
     numberPeople = len(people)
-    duration = len(thumbnailKeys)
+    duration = checkpoint.state['NumberThumbnails']
     thumbnailSize = 50
     borderSize = 20
     desiredTimeWidth = 580.0
@@ -282,22 +528,35 @@ def lambda_handler(event, context):
 
     draw.rectangle((0, 0, img.size[0], img.size[1]), fill="black")
 
+    # Download the video thumbnails from Amazon S3. Each distinct frame is
+    # downloaded once, even when several people appear in it, and the
+    # downloads of all the selected frames start before the drawing.
+    # Transient errors are retried like the Rekognition calls.
+    retryPolicy = RetryPolicy()
+
+    def load_thumbnail(frameNumber):
+        key = sns_msg['outputKeyPrefix']
+        key += sns_msg['outputs'][0]['thumbnailPattern'] + '.png'
+        key = key.replace('{count}', '{:05d}'.format(frameNumber))
+        response = retryPolicy.call(s3.get_object, Bucket=os.environ['Bucket'], Key=key)
+        return Image.open(StringIO(response['Body'].read()))
+
+    # Select up to 4 frames to face thumbnails for each person, the best
+    # faces among the frames shared with the other people. The fetcher can
+    # keep all the frames shared by several people until their last use on
+    # top of the frames it downloads ahead, so each selected frame is
+    # downloaded once.
+    samples = face_selection.select_faces(people, 4)
+    frameNumbers = [thumb['FrameNumber'] for thumbs in samples for thumb in thumbs]
+    fetcher = FrameFetcher(load_thumbnail, int(os.environ.get('FrameCacheSize', 32)) + kept_frames(frameNumbers))
+    fetcher.prefetch(frameNumbers)
+
     # For each person
     for indexPerson, person in enumerate(people):
 
-        # Select 4 random frames to face thumbnails
-        sampleFrameNumbers = random.sample(set(range(len(person['Frames']))), 4)
-
         # For each face thumbnail
-        for indexSample, sampleFrameNumber in enumerate(sampleFrameNumbers):
-            thumb = person['Frames'][sampleFrameNumber]
-
-            # Download the video thumbnail from Amazon S3
-            key = sns_msg['outputKeyPrefix']
-            key += sns_msg['outputs'][0]['thumbnailPattern'] + '.png'
-            key = key.replace('{count}', '{:05d}'.format(thumb['FrameNumber']))
-            response = s3.get_object(Bucket=os.environ['Bucket'], Key=key)
-            imgThumb = Image.open(StringIO(response['Body'].read()))
+        for indexSample, thumb in enumerate(samples[indexPerson]):
+            imgThumb = fetcher.get(thumb['FrameNumber'])
 
             # Calculate the face position to crop the image
             boxLeft = int(math.floor(imgThumb.size[0] * thumb['BoundingBox']['Left']))
@@ -335,13 +594,19 @@ def lambda_handler(event, context):
             draw.rectangle((lineLeft, rectTop, lineLeft, rectBottom), fill="red")
 
     img.save("/tmp/img.png", "PNG")
+    renderTimer.stop()
+
+    # The thumbnails actually downloaded, apart from the 'Thumbnails' listed
+    # by listing.py
+    metrics.count('RenderDownloads', fetcher.downloads)
 
     try:
-        s3.upload_file(
-            "/tmp/img.png",
-            Bucket=os.environ['Bucket'],
-            Key=sns_msg['outputKeyPrefix'].replace('elastictranscoder/', 'output/')[:-1] + '.png'
-        )
+        with metrics.timer('Upload'):
+            s3.upload_file(
+                "/tmp/img.png",
+                Bucket=os.environ['Bucket'],
+                Key=sns_msg['outputKeyPrefix'].replace('elastictranscoder/', 'output/')[:-1] + '.png'
+            )
         print('Visual representation uploaded into the S3 bucket')
 
     except Exception as e:
@@ -350,8 +615,9 @@ def lambda_handler(event, context):
         raise(e)
 
 
-    # Delete the collection in Amazon Rekognition.
+    # Delete the checkpoint and the collection in Amazon Rekognition.
     try:
+        checkpoint.delete()
         rekognition.delete_collection(CollectionId=collectionId)
         print('Collection deleted from Amazon Rekognition'.format(collectionId))
 
@@ -0,0 +1,160 @@
+import json
+import os
+import subprocess
+import sys
+
+import backend
+import executor
+
+
+# Split the items in consecutive shards of at most 'shardSize' items, so a
+# shard of thumbnail keys covers a contiguous segment of the video
+def split_shards(items, shardSize):
+    return [items[i:i + shardSize] for i in range(0, len(items), shardSize)]
+
+
+# Dispatches the shard events to worker invocations of a Lambda function.
+# The invocations are synchronous and at most 'parallelism' of them run at
+# the same time. The result of a failed invocation is None.
+class LambdaInvoker(object):
+
+    def __init__(self, functionName, parallelism=None):
+        self.functionName = functionName
+        self.parallelism = int(parallelism or os.environ.get('MaxShardInvocations', 10))
+        self.client = backend.client('lambda', read_timeout=900, retries={'max_attempts': 0}, max_pool_connections=self.parallelism)
+
+    def invoke(self, event):
+        try:
+            response = self.client.invoke(
+                FunctionName=self.functionName,
+                InvocationType='RequestResponse',
+                Payload=json.dumps(event).encode()
+            )
+            payload = json.loads(response['Payload'].read())
+            if 'FunctionError' in response:
+                print('Shard invocation failed: {}'.format(payload))
+                return None
+            return payload
+
+        except Exception as e:
+            print('Failed to invoke the shard worker')
+            print(e)
+            return None
+
+    def invoke_all(self, events):
+        pool = executor.get_executor('shards', self.parallelism)
+        futures = [pool.submit(self.invoke, event) for event in events]
+        return [future.result() for future in futures]
+
+
+# Stand-in for LambdaInvoker that runs the handler of 'moduleName' in local
+# processes, used to exercise the coordinator outside of AWS. Each shard is
+# run by a new Python interpreter running this module, so the workers
+# inherit neither the threads and locks of the coordinator nor its clients.
+# With the fake backend, the workers make their calls through a
+# FakeBackendServer of the fake of the coordinator, so they share its
+# collections and objects. The logs of the workers are printed by the
+# coordinator.
+class LocalInvoker(object):
+
+    def __init__(self, moduleName, parallelism=4):
+        import fake_backend
+        self.moduleName = moduleName
+        self.parallelism = parallelism
+        self.server = None
+        if isinstance(backend.get_backend(), fake_backend.FakeBackend):
+            self.server = fake_backend.FakeBackendServer(backend.get_backend())
+
+    def invoke(self, event):
+        environment = dict(os.environ)
+        if self.server is not None:
+            environment.update(self.server.environment())
+        try:
+            process = subprocess.Popen(
+                [sys.executable, os.path.splitext(os.path.abspath(__file__))[0] + '.py', self.moduleName],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=environment
+            )
+            output, log = process.communicate(json.dumps(event))
+            sys.stdout.write(log)
+            if process.returncode != 0:
+                print('Shard worker exited with code {}'.format(process.returncode))
+                return None
+            return json.loads(output)
+
+        except Exception as e:
+            print('Failed to run the shard worker')
+            print(e)
+            return None
+
+    def invoke_all(self, events):
+        pool = executor.get_executor('shards', self.parallelism)
+        futures = [pool.submit(self.invoke, event) for event in events]
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+
+# Run the handler of a module on the event read from the standard input and
+# write its result there, for LocalInvoker. The logs go to the standard
+# error.
+def run_local(moduleName):
+    event = json.load(sys.stdin)
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        result = __import__(moduleName).lambda_handler(event, None)
+    finally:
+        sys.stdout = stdout
+    json.dump(result, stdout)
+
+
+# Dispatch 'stage' on the items split in shards and yield the result of each
+# shard. The items a worker did not process (failed invocation or deadline)
+# are dispatched again, up to 'maxRounds' times. The rate limits are divided
+# between the invocations that run at the same time.
+#
+# With the 'checkpoint' of the coordinator, the workers get its deadline so
+# they return before it times out, the checkpoint is saved once the results
+# of each round have been merged by the caller, and no round starts after the
+# deadline.
+def run_shards(invoker, stage, collectionId, items, shardSize, maxRounds=3, checkpoint=None):
+    for roundNumber in range(maxRounds):
+        if not items:
+            return
+        if checkpoint is not None and checkpoint.deadline_reached():
+            print('Deadline reached, {} {} items left to the next invocation'.format(len(items), stage))
+            return
+
+        shards = split_shards(items, shardSize)
+        rateShare = 1.0 / min(invoker.parallelism, len(shards))
+        print('Dispatching {} {} shards (round {})'.format(len(shards), stage, roundNumber + 1))
+
+        events = [{'Shard': {
+            'Stage': stage,
+            'CollectionId': collectionId,
+            'Items': shard,
+            'RateShare': rateShare
+        }} for shard in shards]
+        deadline = checkpoint.deadline() if checkpoint is not None else None
+        if deadline is not None:
+            for event in events:
+                event['Shard']['Deadline'] = deadline
+
+        processed = set()
+        for result in invoker.invoke_all(events):
+            if result is not None:
+                processed.update(result['Processed'])
+                yield result
+
+        if checkpoint is not None:
+            checkpoint.save(stage)
+        items = [item for item in items if not item in processed]
+
+
+if __name__ == '__main__':
+    run_local(sys.argv[1])
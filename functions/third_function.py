@@ -1,30 +1,49 @@
-import boto3
 import json
 import os
 import sys
-import time
 import random
 import math
-from datetime import datetime
-from Queue import Queue
-from threading import Thread
-from PIL import Image, ImageDraw
-from StringIO import StringIO
+import threading
+import backend
+import celebrities
+import executor
+import metrics
+import rate_limiter
+import frame_dedup
+import sampling
+import timeline
+import response_cache
+from listing import ThumbnailListing
+from retry import RetryPolicy, FailureLog
 
 
-CONCURRENT_THREADS = 1
+CONCURRENT_THREADS = 50
 
 
+# The metrics of the invocation are written when it returns
 def lambda_handler(event, context):
+    metrics.begin(getattr(context, 'function_name', 'third_function'))
+    try:
+        return find_celebrities(event, context)
+    finally:
+        metrics.flush()
+
+
+def find_celebrities(event, context):
 
     print("Received event:")
     print(json.dumps(event))
     sns_msg = json.loads(event['Records'][0]['Sns']['Message'])
 
-    rekognition = boto3.client('rekognition', region_name=os.environ['AWS_REGION'])
-    s3 = boto3.client('s3', region_name=os.environ['AWS_REGION'])
+    # Number of find_celebs_workers, 50 by default like the face indexing
+    # workers of second_function
+    numberThreads = int(os.environ.get('RecognizeCelebritiesThreads', CONCURRENT_THREADS))
+
+    rekognition = backend.client('rekognition', max_pool_connections=numberThreads)
+    s3 = backend.client('s3', max_pool_connections=numberThreads)
 
-    celebs = {}
+    retryPolicy = RetryPolicy()
+    failures = FailureLog()
 
     # Create a new collection in Amazon Rekognition. I use the ID of the Elastic
     # Transcoder job for the name of the collection.
@@ -45,40 +64,61 @@ def lambda_handler(event, context):
 
     # Retrieve the list of thumbnail objects in the S3 bucket that were created
     # by Amazon Elastic Transcoder. The list of keys is stored in the local
-    # variable 'thumbnailKeys'.
-    try:
-        thumbnailKeys = []
-        prefix = sns_msg['outputKeyPrefix']
-        prefix += sns_msg['outputs'][0]['thumbnailPattern'].replace('{count}', '')
-
-        paginator = s3.get_paginator('list_objects')
-        response_iterator = paginator.paginate(
-            Bucket=os.environ['Bucket'],
-            Prefix=prefix
-        )
-        for page in response_iterator:
-            thumbnailKeys += [i['Key'] for i in page['Contents']]
-
-        print('Number of thumbnail objects found in the S3 bucket: {}'.format(len(thumbnailKeys)))
-
-    except Exception as e:
-        print('Failed to list the thumbnail objects')
-        print(e)
-        raise(e)
-
-    #Create the findCelebsQueue and find_celebs_workers
-    findCelebsQueue = Queue()
+    # variable 'thumbnailKeys'. Unless a pre-filter needs the full list first,
+    # the keys are streamed to the find_celebs_workers while the listing is
+    # still paginating.
+    streaming = not (os.environ.get('DedupThreshold') or int(os.environ.get('SamplingStep', 1)) > 1)
+
+    prefix = sns_msg['outputKeyPrefix']
+    prefix += sns_msg['outputs'][0]['thumbnailPattern'].replace('{count}', '')
+    thumbnailKeys = ThumbnailListing(s3, os.environ['Bucket'], prefix)
+    if not streaming:
+        thumbnailKeys = list(thumbnailKeys)
+
+    # Group the near-duplicate consecutive thumbnails when 'DedupThreshold'
+    # is set. Only the first frame of each group is sent to
+    # RecognizeCelebrities and the celebrities found are copied to the other
+    # frames of the group.
+    duplicates = frame_dedup.plan(s3, os.environ['Bucket'], thumbnailKeys)
+    celebsKeys = sorted(duplicates) if duplicates is not None else thumbnailKeys
+
+    # When 'SamplingStep' is set, the thumbnails are processed coarse-to-fine:
+    # first one frame every 'SamplingStep' frames, then the frames in between
+    # where faces were found or the scene changed.
+    samplingPlan = sampling.plan(s3, os.environ['Bucket'], celebsKeys)
+
+    #Run find_celebs on the threads of the 'rekognition' stage executor. The
+    #threads share the rate limiter, the retry policy and the client, and
+    #each one aggregates its results in its own 'workerResults' entry, so
+    #they never write to the same dict. The entries are merged into 'celebs'
+    #when the stage completes.
+    findCelebsLimiter = rate_limiter.get_limiter('recognize_celebrities')
+    responseCache = response_cache.get_cache(s3)
+    workerResults = []
+    workerState = threading.local()
+
+    def find_celebs(key):
+        if not hasattr(workerState, 'result'):
+            workerState.result = {'Celebs': {}, 'FramesWithFaces': set()}
+            workerResults.append(workerState.result)
+        result = workerState.result
+        workerCelebs = result['Celebs']
 
-    def find_celebs_worker():
-        rekognition = boto3.client('rekognition', region_name=os.environ['AWS_REGION'])
-
-        while True:
-            key = findCelebsQueue.get()
-            try:
-                startTime = datetime.now()
-                frameNumber = int(key[:-4][-5:])
-
-                response = rekognition.recognize_celebrities(
+        try:
+            frameNumber = int(key[:-4][-5:])
+            groupFrameNumbers = [frameNumber]
+            if duplicates:
+                groupFrameNumbers += [frame_dedup.frame_number(i) for i in duplicates[key]]
+
+            #The response is reused when the same thumbnail was already
+            #sent to RecognizeCelebrities
+            response = responseCache.call(
+                'recognize_celebrities',
+                os.environ['Bucket'],
+                key,
+                lambda: retryPolicy.call(
+                    findCelebsLimiter.call,
+                    rekognition.recognize_celebrities,
                     #CollectionId=collectionId,
                     Image={'S3Object': {
                         'Bucket': os.environ['Bucket'],
@@ -86,76 +126,61 @@ def lambda_handler(event, context):
                     }},
                     #ExternalImageId=str(frameNumber)
                 )
-
-                Celebrities = response['CelebrityFaces']
-                if Celebrities:
-                    for celeb in Celebrities:
-                        celebId = celeb['Id']
-                        print("celeb: " + celebId + " in frame: " + str(frameNumber) + " MatchConfidence: " + str(celeb['MatchConfidence']))
-                        if celeb['MatchConfidence'] >= 0.65:
-                            print("Celeb: " + json.dumps(celeb))
-                            #Create the Celeb top level entry
-                            if not(celebId in celebs):
-                                print("New Celeb detected in frame " + str(frameNumber) + " with Confidence of " + str(celeb['MatchConfidence']))
-                                celebs[celebId] = {
-                                    'Name': celeb['Name'],
-                                    'Urls': celeb['Urls'],
-                                    'Faces': {}
-                                }
-                            #Transform the detected face object
-                            celebFace = {
-                                    'FrameNumber': frameNumber,
-                                    'MatchConfidence': celeb['MatchConfidence'],
-                                    'BoundingBox': celeb['Face']['BoundingBox'],
-                                    'Confidence': celeb['Face']['Confidence']
-                            }
-#                            print(celebFace)
-                            #Add the detected face to the 'celebs' array.
-                            try:
-                                celebs[celebId]['Faces'][frameNumber] = celebFace
-                            except Exception as e:
-                                print("Failed to append face: " + json.dumps(celebFace))
-                                print(e)
-
-                endTime = datetime.now()
-                delta = int((endTime - startTime).total_seconds() * 1000)
-                if delta < 1000:
-                    timeToWait = float(1000 - delta)/1000
-                    time.sleep(timeToWait)
-
-                print("find_celebs_worker " + key + " completed successfully")
-
-            # I put the key back in the queue if the IndexFaces operation
-            # failed
-            except Exception as e:
-                print('Exception: ' + key)
-                print(e)
-#                findCelebsQueue.put(key)
-
-            findCelebsQueue.task_done()
-
-    for i in range(CONCURRENT_THREADS):
-        t = Thread(target=find_celebs_worker)
-        t.daemon = True
-        t.start()
-
-    for key in thumbnailKeys:
-        findCelebsQueue.put(key)
-
-    findCelebsQueue.join()
-    time.sleep(2)
+            )
+
+            if response['CelebrityFaces'] or response.get('UnrecognizedFaces'):
+                result['FramesWithFaces'].update(groupFrameNumbers)
+
+            celebrities.record_celebrities(workerCelebs, response, groupFrameNumbers)
+
+            print("find_celebs_worker " + key + " completed successfully")
+
+        # Transient errors are retried by the retry policy, the keys that
+        # still fail are reported in the output
+        except Exception as e:
+            failures.add('RecognizeCelebrities', key, e)
+
+    # Each pass ends as soon as its last call returns
+    def find_celebs_all(keys):
+        stage = executor.get_executor('rekognition', numberThreads).stage(find_celebs)
+        for key in keys:
+            stage.submit(key)
+        stage.close()
+        stage.join()
+        if stage.errors:
+            raise stage.errors[0]
+
+    recognizeTimer = metrics.timer('RecognizeCelebrities')
+    find_celebs_all(samplingPlan.coarseKeys if samplingPlan else celebsKeys)
+
+    if samplingPlan:
+        framesWithFaces = set()
+        for result in workerResults:
+            framesWithFaces.update(result['FramesWithFaces'])
+        find_celebs_all(samplingPlan.refine_keys(framesWithFaces))
+
+    # Merge the results of the workers
+    celebs = celebrities.merge_celebrities([result['Celebs'] for result in workerResults])
+
+    # Merge the frames of each celebrity into appearance intervals
+    timeline.add_appearances(celebs)
+    recognizeTimer.stop()
+    metrics.count('Celebrities', len(celebs))
     print('FindCelebs operation completed')
     print(json.dumps(celebs))
     celeb_json = {}
-    celeb_json = {'Celebrities': celebs}
+    celeb_json = {'Celebrities': celebs, 'Failures': failures.to_json()}
+    if duplicates is not None:
+        celeb_json['Deduplication'] = frame_dedup.statistics(duplicates)
 
     # Upload the JSON result into the S3 bucket
     try:
-        s3.put_object(
-            Body=json.dumps(celeb_json, indent=4).encode(),
-            Bucket=os.environ['Bucket'],
-            Key=sns_msg['outputKeyPrefix'].replace('elastictranscoder/', 'output/celeb_')[:-1] + '.json'
-        )
+        with metrics.timer('Upload'):
+            s3.put_object(
+                Body=json.dumps(celeb_json, indent=4).encode(),
+                Bucket=os.environ['Bucket'],
+                Key=sns_msg['outputKeyPrefix'].replace('elastictranscoder/', 'output/celeb_')[:-1] + '.json'
+            )
         print('JSON result uploaded into the S3 bucket')
 
     except Exception as e:
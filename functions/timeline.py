@@ -0,0 +1,75 @@
+import os
+
+from clustering import time_position
+
+
+# Merge the faces of a celebrity into appearance intervals in a single pass
+# over the faces sorted by frame number. A face starts a new interval when more than
+# 'maxGap' frames separate it from the previous one (1: the frames must be
+# consecutive). Each interval has its first and last frame, its duration in
+# frames, the mean and maximum MatchConfidence, and the bounding box of its
+# best match as a representative bounding box.
+def merge_intervals(faces, maxGap=1):
+    intervals = []
+    interval = None
+
+    for face in sorted(faces, key=lambda face: face['FrameNumber']):
+        frameNumber = face['FrameNumber']
+        if interval is None or frameNumber - interval['EndFrame'] > maxGap:
+            if interval is not None:
+                intervals.append(_close(interval))
+            interval = {
+                'StartFrame': frameNumber,
+                'NumberFrames': 0,
+                'TotalMatchConfidence': 0.0,
+                'MaxMatchConfidence': face['MatchConfidence'],
+                'BestScore': None
+            }
+
+        interval['EndFrame'] = frameNumber
+        interval['NumberFrames'] += 1
+        interval['TotalMatchConfidence'] += face['MatchConfidence']
+        interval['MaxMatchConfidence'] = max(interval['MaxMatchConfidence'], face['MatchConfidence'])
+
+        # The earliest face wins a tie, so the result does not depend on the
+        # order of the faces of the same frame
+        score = (face['MatchConfidence'], face.get('Confidence', 0))
+        if interval['BestScore'] is None or score > interval['BestScore']:
+            interval['BestScore'] = score
+            interval['BoundingBox'] = face['BoundingBox']
+            interval['BoundingBoxFrame'] = frameNumber
+
+    if interval is not None:
+        intervals.append(_close(interval))
+    return intervals
+
+
+def _close(interval):
+    return {
+        'StartFrame': interval['StartFrame'],
+        'EndFrame': interval['EndFrame'],
+        'StartTimePosition': time_position(interval['StartFrame']),
+        'EndTimePosition': time_position(interval['EndFrame']),
+        'Duration': interval['EndFrame'] - interval['StartFrame'] + 1,
+        'NumberFrames': interval['NumberFrames'],
+        'MeanMatchConfidence': interval['TotalMatchConfidence'] / interval['NumberFrames'],
+        'MaxMatchConfidence': interval['MaxMatchConfidence'],
+        'BoundingBox': interval['BoundingBox'],
+        'BoundingBoxFrame': interval['BoundingBoxFrame']
+    }
+
+
+# Add the 'Appearances' intervals to each celebrity of 'celebs'. The
+# per-frame 'Faces' are removed unless 'keepFrames' is set. The defaults
+# come from the 'TimelineMaxGap' (1) and 'CelebrityFrameDetail' ('true')
+# environment variables.
+def add_appearances(celebs, keepFrames=None, maxGap=None):
+    if keepFrames is None:
+        keepFrames = os.environ.get('CelebrityFrameDetail', 'true').lower() != 'false'
+    if maxGap is None:
+        maxGap = int(os.environ.get('TimelineMaxGap', 1))
+
+    for celeb in celebs.values():
+        celeb['Appearances'] = merge_intervals(celeb['Faces'].values(), maxGap)
+        if not keepFrames:
+            del celeb['Faces']
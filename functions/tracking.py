@@ -0,0 +1,123 @@
+import os
+
+from geometry import iou, GridIndex
+
+
+# Number of open tracks from which a frame uses a spatial index to find the
+# tracks its faces may continue
+GRID_MIN_TRACKS = 8
+
+
+# Link the faces of consecutive frames into tracks. The faces of the same
+# person in consecutive thumbnails overlap heavily, so a face continues the
+# track whose last face, at most 'maxGap' frames earlier, overlaps it with
+# the highest intersection over union, if it is at least 'threshold'. The
+# pairs are assigned greedily from the highest overlap, each track taking at
+# most one face per frame. The defaults come from the 'TrackIoUThreshold'
+# (0.5) and 'TrackMaxGap' (1: adjacent frames only) environment variables.
+# Returns the list of tracks, each one the list of its face IDs in the order
+# of which they appear in the video.
+def track_faces(faces, threshold=None, maxGap=None):
+    if threshold is None:
+        threshold = float(os.environ.get('TrackIoUThreshold', 0.5))
+    if maxGap is None:
+        maxGap = int(os.environ.get('TrackMaxGap', 1))
+
+    frames = {}
+    for faceId in faces.face_ids():
+        frames.setdefault(faces.frame_number(faceId), []).append(faceId)
+
+    tracks = []
+    openTracks = []
+    for frameNumber in sorted(frames):
+        # The tracks whose last face is too far behind are closed
+        openTracks = [i for i in openTracks if frameNumber - faces.frame_number(tracks[i][-1]) <= maxGap]
+        lastBoxes = dict((i, faces.bounding_box(tracks[i][-1])) for i in openTracks)
+
+        grid = None
+        if len(openTracks) >= GRID_MIN_TRACKS:
+            grid = GridIndex()
+            for i in openTracks:
+                grid.insert(i, lastBoxes[i])
+
+        pairs = []
+        for faceId in frames[frameNumber]:
+            boundingBox = faces.bounding_box(faceId)
+            for i in (grid.query(boundingBox) if grid else openTracks):
+                overlap = iou(boundingBox, lastBoxes[i])
+                if overlap >= threshold:
+                    pairs.append((-overlap, faceId, i))
+
+        assigned = set()
+        extended = set()
+        for negativeOverlap, faceId, i in sorted(pairs):
+            if not faceId in assigned and not i in extended:
+                tracks[i].append(faceId)
+                assigned.add(faceId)
+                extended.add(i)
+
+        for faceId in sorted(frames[frameNumber]):
+            if not faceId in assigned:
+                openTracks.append(len(tracks))
+                tracks.append([faceId])
+
+    return tracks
+
+
+# The faces of a track sent to SearchFaces: the track is split in 'count'
+# equal segments ('TrackRepresentatives' environment variable, default 2)
+# and the middle face of each segment is taken. The tracks of less than 3
+# faces only send their middle face.
+def representatives(track, count=None):
+    if count is None:
+        count = int(os.environ.get('TrackRepresentatives', 2))
+    if count <= 1 or len(track) < 3:
+        return [track[len(track) // 2]]
+    count = min(count, len(track))
+    return [track[(2 * i + 1) * len(track) // (2 * count)] for i in range(count)]
+
+
+# The faces of the tracks that the search of no representative of their
+# track returned. A track can join the faces of several people, for instance
+# at a cut where another person appears in the same place, and the cut can
+# fall on either side of the representatives: the faces of the other person
+# do not match them, so they are searched one by one instead of getting the
+# matches of the track. This needs no other call than the searches of the
+# representatives. The tracks whose representatives have not all been
+# searched yet are left out.
+def unconfirmed_faces(faces, tracks, count=None):
+    unconfirmed = []
+    for track in tracks:
+        searched = representatives(track, count)
+        if any(faceId in faces and not faces.searched(faceId) for faceId in searched):
+            continue
+        confirmed = set(searched)
+        for faceId in searched:
+            if faceId in faces:
+                confirmed.update(faces.matching_faces(faceId))
+        unconfirmed.extend(faceId for faceId in track if not faceId in confirmed)
+    return unconfirmed
+
+
+# Give each face of a track that was not searched the matches of the
+# representatives of its track whose search returned it, plus these
+# representatives. A face that no representative returned, and that was not
+# searched on its own, is removed like the faces without matches.
+def propagate_matches(faces, tracks, count=None):
+    for track in tracks:
+        searched = [faceId for faceId in representatives(track, count) if faceId in faces]
+        matchingFaces = dict((faceId, set(faces.matching_faces(faceId))) for faceId in searched)
+
+        for faceId in track:
+            if not faceId in faces or faces.searched(faceId):
+                continue
+            inferred = set()
+            for representativeId in searched:
+                if faceId in matchingFaces[representativeId]:
+                    inferred.add(representativeId)
+                    inferred.update(matchingFaces[representativeId])
+            inferred.discard(faceId)
+            if inferred:
+                faces.set_matches(faceId, sorted(inferred))
+            else:
+                faces.remove(faceId)
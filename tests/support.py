@@ -0,0 +1,86 @@
+# Helpers shared by the tests. The tests run with Python 2.7 from the
+# repository root:
+#
+#     python -m unittest discover -s tests
+import json
+import os
+import sys
+from StringIO import StringIO
+
+FUNCTIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+if not FUNCTIONS_DIRECTORY in sys.path:
+    sys.path.insert(0, FUNCTIONS_DIRECTORY)
+
+BUCKET = 'test'
+
+
+# Lambda context whose remaining time runs out after 'seconds'
+class FakeContext(object):
+
+    def __init__(self, seconds, functionName='second_function'):
+        import time
+        self.function_name = functionName
+        self.end = time.time() + seconds
+
+    def get_remaining_time_in_millis(self):
+        import time
+        return int((self.end - time.time()) * 1000)
+
+
+# Set environment variables for the duration of a test and restore the
+# previous values afterwards
+class Environment(object):
+
+    def __init__(self, **variables):
+        self.variables = variables
+        self.saved = {}
+
+    def __enter__(self):
+        for name, value in self.variables.items():
+            self.saved[name] = os.environ.get(name)
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        return self
+
+    def __exit__(self, *args):
+        for name, value in self.saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+# Install a fake backend serving the TestVideo thumbnails replicated to
+# 'numberFrames' frames, and return it with the notification event. The
+# rate limiters of the handlers allow 1000 calls per second.
+def fake_video(numberFrames, **options):
+    import backend
+    import fake_backend
+    os.environ.update({'Bucket': BUCKET, 'AWS_REGION': 'us-east-1', 'MetricsSink': 'none'})
+    for name in ('IndexFacesTPS', 'SearchFacesTPS', 'RecognizeCelebritiesTPS'):
+        os.environ.setdefault(name, '1000')
+    fake = fake_backend.FakeBackend(**dict({'seed': 1, 'throttleRate': 0, 'errorRate': 0}, **options))
+    backend.set_backend(fake)
+    event = fake_backend.load_test_event()
+    fake.add_video(event, BUCKET, numberFrames)
+    return fake, event
+
+
+# Run a handler with its output discarded
+def quietly(function, *args, **kwargs):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sys.stdout = stdout
+
+
+# The JSON result uploaded by a handler, whose key starts with 'prefix'
+def output_json(fake, prefix='output/'):
+    for (bucket, key), value in sorted(fake.s3.objects.items()):
+        if key.startswith(prefix) and key.endswith('.json') and not key.startswith(prefix + 'celeb_'):
+            return json.loads(value['Body'])
+    return None
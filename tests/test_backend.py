@@ -0,0 +1,20 @@
+import os
+import unittest
+
+import support
+
+import backend
+
+
+class BackendTest(unittest.TestCase):
+
+    def test_a_forked_process_creates_its_own_clients(self):
+        support.fake_video(1)
+        client = backend.client('s3')
+        self.assertTrue(backend.client('s3') is client)
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if backend.client('s3') is not client else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertTrue(backend.client('s3') is client)
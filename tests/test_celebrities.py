@@ -0,0 +1,83 @@
+import unittest
+
+import support
+
+import celebrities
+import third_function
+from face_table import FaceTable
+
+
+def box(left, width=0.2):
+    return {'Left': left, 'Top': 0.3, 'Width': width, 'Height': 0.3}
+
+
+def celeb(name, faces):
+    return {
+        'Name': name,
+        'Urls': [],
+        'Faces': dict((frameNumber, {'FrameNumber': frameNumber, 'BoundingBox': boundingBox}) for frameNumber, boundingBox in faces)
+    }
+
+
+class LabelPeopleTest(unittest.TestCase):
+
+    def test_faces_get_the_celebrity_overlapping_them_the_most(self):
+        faces = FaceTable()
+        faces.add('a1', 1, box(0.1), 1)
+        faces.add('a2', 2, box(0.1), 1)
+        faces.add('b1', 1, box(0.6), 2)
+        # The box of 'c' overlaps the face of person 1 in frame 1, but less
+        # than the box of 'a'
+        celebs = {
+            'a': celeb('A', [(1, box(0.1)), (2, box(0.12))]),
+            'b': celeb('B', [(1, box(0.65))]),
+            'c': celeb('C', [(1, box(0.15))])
+        }
+        labels = celebrities.label_people(faces, celebs, 0.5)
+        self.assertEqual(sorted(labels), [1, 2])
+        self.assertEqual((labels[1]['Id'], labels[1]['Name'], labels[1]['MatchedFrames']), ('a', 'A', 2))
+        self.assertEqual(labels[2]['Id'], 'b')
+
+    def test_faces_overlapping_less_than_the_threshold_are_not_labelled(self):
+        faces = FaceTable()
+        faces.add('a1', 1, box(0.1), 1)
+        faces.add('x1', 1, box(0.5), 0)
+        # Intersection over union of 0.6
+        celebs = {'a': celeb('A', [(1, box(0.15))]), 'x': celeb('X', [(1, box(0.5))])}
+        self.assertEqual(sorted(celebrities.label_people(faces, celebs, 0.6)), [1])
+        self.assertEqual(celebrities.label_people(faces, celebs, 0.7), {})
+
+    def test_the_most_matched_celebrity_wins_and_the_lowest_id_breaks_ties(self):
+        faces = FaceTable()
+        for frameNumber in (1, 2, 3):
+            faces.add('a{}'.format(frameNumber), frameNumber, box(0.1), 1)
+        celebs = {'b': celeb('B', [(1, box(0.1)), (2, box(0.1))]), 'a': celeb('A', [(3, box(0.1))])}
+        self.assertEqual(celebrities.label_people(faces, celebs, 0.5)[1]['Id'], 'b')
+
+        celebs = {'b': celeb('B', [(1, box(0.1))]), 'a': celeb('A', [(3, box(0.1))])}
+        self.assertEqual(celebrities.label_people(faces, celebs, 0.5)[1]['Id'], 'a')
+
+    def test_merged_faces_are_keyed_by_frame_number(self):
+        restored = {'a': {'Name': 'A', 'Urls': [], 'Faces': {'2': {'FrameNumber': 2}}}}
+        worker = {'a': celeb('A', [(1, box(0.1))])}
+        merged = celebrities.merge_celebrities([restored, worker])
+        self.assertEqual(sorted(merged['a']['Faces']), [1, 2])
+
+
+class RecognizeCelebritiesTest(unittest.TestCase):
+
+    def run_video(self, numberThreads):
+        with support.Environment(RecognizeCelebritiesThreads=str(numberThreads)):
+            fake, event = support.fake_video(60)
+            support.quietly(third_function.lambda_handler, event, None)
+            return fake, support.output_json(fake, 'output/celeb_')
+
+    # Each worker thread records in its own dict
+    def test_the_workers_give_the_result_of_a_single_thread(self):
+        fake, single = self.run_video(1)
+        self.assertTrue(single['Celebrities'])
+        self.assertEqual(single['Failures'], [])
+
+        fake, pooled = self.run_video(8)
+        self.assertEqual(fake.calls['recognize_celebrities'], 60)
+        self.assertEqual(pooled, single)
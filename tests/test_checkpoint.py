@@ -0,0 +1,99 @@
+import json
+import shutil
+import tempfile
+import time
+import unittest
+
+import support
+
+import second_function
+from checkpoint import Checkpoint, LocalCheckpointBackend
+from face_table import FaceTable
+from retry import FailureLog
+
+
+def people_of(output):
+    return [[frame['FrameNumber'] for frame in person['Frames']] for person in output['People']]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_restores_the_saved_state(self):
+        faces = FaceTable()
+        faces.add('a', 1, {'Left': 0.1, 'Top': 0.2, 'Width': 0.3, 'Height': 0.4})
+        faces.set_matches('a', ['b'])
+        checkpoint = Checkpoint(LocalCheckpointBackend(self.directory), 'job', None)
+        checkpoint.track(faces, set(['thumbnails/job-00001.png']), FailureLog())
+        checkpoint.save('SearchFaces')
+
+        resumed = Checkpoint(LocalCheckpointBackend(self.directory), 'job', None)
+        self.assertTrue(support.quietly(resumed.load))
+        self.assertEqual(resumed.state['Stage'], 'SearchFaces')
+        self.assertEqual(resumed.state['Invocation'], 2)
+        self.assertEqual(resumed.state['ProcessedKeys'], ['thumbnails/job-00001.png'])
+        self.assertEqual(FaceTable.from_json(resumed.state['Faces']).matching_faces('a'), ['b'])
+
+        resumed.delete()
+        self.assertFalse(Checkpoint(LocalCheckpointBackend(self.directory), 'job', None).load())
+
+    def test_deadline_is_the_earliest_of_the_context_and_the_stop_time(self):
+        checkpoint = Checkpoint(None, 'job', support.FakeContext(100), marginMillis=1000)
+        self.assertFalse(checkpoint.deadline_reached())
+        self.assertAlmostEqual(checkpoint.deadline(), time.time() + 99, delta=1)
+
+        checkpoint.stopTime = checkpoint.deadline() - 50
+        self.assertEqual(checkpoint.deadline(), checkpoint.stopTime)
+        checkpoint.stopTime -= 100
+        self.assertTrue(checkpoint.deadline_reached())
+
+    def test_resumed_invocations_give_the_result_of_a_single_one(self):
+        environment = {'CheckpointDirectory': self.directory, 'SearchSkipMinMatches': '0', 'ShardSize': None}
+        with support.Environment(**environment):
+            fake, event = support.fake_video(40)
+            support.quietly(second_function.lambda_handler, event, support.FakeContext(900))
+            single = support.output_json(fake)
+
+        # Every invocation stops 0.3 seconds after it started, and calls
+        # take 0.1 second, so the video needs several invocations
+        with support.Environment(CheckpointMargin='1000', **environment):
+            fake, event = support.fake_video(40, latency={'*': 0.1})
+            invocations = 0
+            while event is not None and invocations < 20:
+                invocations += 1
+                support.quietly(second_function.lambda_handler, event, support.FakeContext(1.3))
+                reinvocations = [i for i in fake.client('lambda').invocations if i['InvocationType'] == 'Event']
+                event = json.loads(reinvocations[-1]['Payload']) if len(reinvocations) == invocations else None
+            resumed = support.output_json(fake)
+
+        self.assertTrue(invocations > 1)
+        self.assertEqual(people_of(resumed), people_of(single))
+
+    # The thumbnails are listed before deduplication, so the listing ends
+    # before IndexFaces starts
+    def test_invocations_resumed_after_index_faces_do_not_list_the_thumbnails(self):
+        environment = {'CheckpointDirectory': self.directory, 'SearchSkipMinMatches': '0', 'ShardSize': None,
+                       'DedupThreshold': '0', 'CheckpointMargin': '1000'}
+        with support.Environment(**environment):
+            fake, event = support.fake_video(40, latency={'*': 0.1})
+            jobId = json.loads(event['Records'][0]['Sns']['Message'])['jobId']
+            searching = 0
+            invocations = 0
+            while event is not None and invocations < 20:
+                invocations += 1
+                state = LocalCheckpointBackend(self.directory).load(jobId)
+                listings = fake.calls.get('list_objects', 0)
+                support.quietly(second_function.lambda_handler, event, support.FakeContext(1.3))
+                if state is not None and state['Stage'] not in (None, 'IndexFaces'):
+                    searching += 1
+                    self.assertEqual(fake.calls.get('list_objects', 0), listings)
+                reinvocations = [i for i in fake.client('lambda').invocations if i['InvocationType'] == 'Event']
+                event = json.loads(reinvocations[-1]['Payload']) if len(reinvocations) == invocations else None
+
+        self.assertTrue(searching > 0)
+        self.assertEqual(support.output_json(fake)['Deduplication']['Frames'], 40)
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+
+import support
+
+import executor
+
+
+class StageExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = executor.StageExecutor(2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_submit_returns_the_result(self):
+        self.assertEqual(self.executor.submit(lambda a, b: a + b, 1, 2).result(5), 3)
+
+    def test_exceptions_are_raised_by_result_and_kept_by_the_stage(self):
+        def fail(item):
+            raise ValueError(item)
+
+        self.assertRaises(ValueError, self.executor.submit(fail, 1).result, 5)
+
+        stage = self.executor.stage(fail)
+        for item in range(3):
+            stage.submit(item)
+        stage.close()
+        self.assertTrue(stage.join(5))
+        self.assertEqual(sorted(e.args[0] for e in stage.errors), [0, 1, 2])
+
+    def test_calls_are_cancelled_after_the_deadline(self):
+        future = self.executor.submit(time.sleep, 0, deadline=time.time() - 1)
+        self.assertRaises(executor.CancelledError, future.result, 5)
+
+        stage = self.executor.stage(lambda item: item, time.time() - 1)
+        stage.submit(1)
+        stage.close()
+        self.assertTrue(stage.join(5))
+        self.assertEqual(stage.cancelled, 1)
+
+    def test_cancel_stops_the_calls_that_have_not_started(self):
+        release = threading.Event()
+        done = []
+
+        def work(item):
+            release.wait(5)
+            done.append(item)
+
+        stage = self.executor.stage(work)
+        for item in range(6):
+            stage.submit(item)
+        time.sleep(0.1)
+        stage.cancel()
+        stage.submit(6)
+        stage.close()
+        release.set()
+
+        self.assertTrue(stage.join(5))
+        # The two calls running when the stage was cancelled complete
+        self.assertEqual(len(done), 2)
+        self.assertEqual(stage.cancelled, 5)
+        self.assertEqual(stage.errors, [])
+
+    def test_join_waits_for_close(self):
+        stage = self.executor.stage(lambda item: item)
+        stage.submit(1)
+        self.assertFalse(stage.join(0.2))
+        stage.close()
+        self.assertTrue(stage.join(5))
+        self.assertEqual(stage.pending(), 0)
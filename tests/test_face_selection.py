@@ -0,0 +1,54 @@
+import unittest
+
+import support
+
+import face_selection
+
+
+def frame(frameNumber, width, quality=1.0):
+    return {'FrameNumber': frameNumber, 'BoundingBox': {'Width': width, 'Height': width}, 'Quality': quality}
+
+
+def frame_numbers(samples):
+    return [[frame['FrameNumber'] for frame in sample] for sample in samples]
+
+
+class SelectFacesTest(unittest.TestCase):
+
+    def test_face_quality_is_the_confidence_times_the_sharpness(self):
+        faceRecord = {'Face': {'Confidence': 90.0}, 'FaceDetail': {'Quality': {'Sharpness': 50.0}}}
+        self.assertAlmostEqual(face_selection.face_quality(faceRecord), 0.45)
+        self.assertEqual(face_selection.face_quality({'Face': {}}), 1.0)
+
+    def test_the_best_frames_are_chosen_in_the_order_of_the_video(self):
+        person = {'Frames': [frame(1, 0.1), frame(2, 0.3), frame(3, 0.2), frame(4, 0.3, 0.3)]}
+        self.assertEqual(frame_numbers(face_selection.select_faces([person], 2)), [[2, 3]])
+        self.assertEqual(frame_numbers(face_selection.select_faces([person], 8)), [[1, 2, 3, 4]])
+
+    def test_the_frames_shared_with_other_people_are_preferred(self):
+        # Frame 10 has the smaller faces but is a candidate for both people
+        people = [
+            {'Frames': [frame(10, 0.1), frame(11, 0.3)]},
+            {'Frames': [frame(12, 0.3), frame(10, 0.1)]}
+        ]
+        self.assertEqual(frame_numbers(face_selection.select_faces(people, 1)), [[10], [10]])
+
+        # Frame 13 is chosen for the first person only, but the second
+        # person prefers it to its better frame 14
+        people = [
+            {'Frames': [frame(13, 0.3)]},
+            {'Frames': [frame(14, 0.3), frame(13, 0.1), frame(15, 0.2)]}
+        ]
+        self.assertEqual(frame_numbers(face_selection.select_faces(people, 1, candidates=3)), [[13], [13]])
+
+    def test_only_the_best_frames_are_candidates(self):
+        people = [
+            {'Frames': [frame(1, 0.3), frame(2, 0.2), frame(3, 0.1)]},
+            {'Frames': [frame(3, 0.1), frame(4, 0.3), frame(5, 0.2)]}
+        ]
+        # Frame 3 is not among the 2 best frames of either person
+        self.assertEqual(frame_numbers(face_selection.select_faces(people, 1, candidates=2)), [[1], [4]])
+
+    def test_the_selection_is_deterministic(self):
+        people = [{'Frames': [frame(frameNumber, 0.2) for frameNumber in order]} for order in ([3, 1, 2], [2, 3, 1])]
+        self.assertEqual(frame_numbers(face_selection.select_faces(people, 2)), [[1, 2], [1, 2]])
@@ -0,0 +1,44 @@
+import unittest
+
+import support
+
+import clustering
+from face_table import FaceTable
+
+
+class FaceTableTest(unittest.TestCase):
+
+    def test_from_matches_packs_sorted_rows(self):
+        faces = FaceTable.from_matches(['a', 'b', 'c'], {'a': ['c', 'b'], 'b': ['a', 'x'], 'c': []})
+
+        self.assertEqual(len(faces), 3)
+        self.assertFalse('x' in faces)
+        offsets, targets = faces.compact_matches()
+        self.assertEqual(list(offsets), [0, 2, 4, 4, 4])
+        self.assertEqual(list(targets), [1, 2, 0, 3])
+        self.assertEqual(faces.matching_faces('b'), ['a', 'x'])
+        self.assertEqual(faces.matching_faces('x'), None)
+
+    def test_compact_matches_keeps_the_packed_rows(self):
+        faces = FaceTable.from_matches(['a', 'b'], {'a': ['b'], 'b': ['a']})
+        offsets, targets = faces.compact_matches()
+        self.assertTrue(faces.compact_matches()[1] is targets)
+
+        faces.add('c', 3, None)
+        faces.set_matches('c', ['b', 'a'])
+        offsets, targets = faces.compact_matches()
+        self.assertEqual(list(offsets), [0, 1, 2, 4])
+        self.assertEqual(list(targets), [1, 0, 0, 1])
+
+    def test_cluster_faces(self):
+        # Each face of a person must be matched by two faces that also
+        # match the face it is propagated from
+        matchingFaces = {
+            'a': ['b', 'c', 'd'],
+            'b': ['a', 'c', 'd'],
+            'c': ['a', 'b', 'd'],
+            'd': ['a', 'b', 'c'],
+            'e': ['a']
+        }
+        personIds = clustering.cluster_faces(['a', 'b', 'c', 'd', 'e'], matchingFaces)
+        self.assertEqual(personIds, {'a': 1, 'b': 1, 'c': 1, 'd': 1, 'e': 2})
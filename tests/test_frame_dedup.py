@@ -0,0 +1,57 @@
+import unittest
+
+import support
+
+import frame_dedup
+from face_table import FaceTable
+
+
+BOX = {'Left': 0.4, 'Top': 0.3, 'Width': 0.2, 'Height': 0.3}
+
+
+def key(frameNumber):
+    return 'thumbnails/job-{:05d}.png'.format(frameNumber)
+
+
+class GroupFramesTest(unittest.TestCase):
+
+    # Each frame is one bit away from the previous one, like a slow pan
+    def test_frames_are_compared_with_the_first_frame_of_the_group(self):
+        hashes = {key(1): 0b0, key(2): 0b1, key(3): 0b11, key(4): 0b111}
+        groups = frame_dedup.group_frames(list(hashes), hashes, 1)
+        self.assertEqual(groups, {key(1): [key(2)], key(3): [key(4)]})
+
+    def test_threshold(self):
+        hashes = {key(1): 0b0, key(2): 0b11}
+        self.assertEqual(frame_dedup.group_frames(list(hashes), hashes, 1), {key(1): [], key(2): []})
+        self.assertEqual(frame_dedup.group_frames(list(hashes), hashes, 2), {key(1): [key(2)]})
+
+    def test_only_consecutive_frames_with_a_hash_are_grouped(self):
+        hashes = {key(1): 0, key(2): 0, key(4): 0, key(6): 0}
+        keys = [key(6), key(5), key(4), key(2), key(1)]
+        groups = frame_dedup.group_frames(keys, hashes, 0)
+        self.assertEqual(groups, {key(1): [key(2)], key(4): [], key(5): [], key(6): []})
+
+    def test_statistics(self):
+        groups = {key(1): [key(2), key(3)], key(4): []}
+        self.assertEqual(frame_dedup.statistics(groups), {'Frames': 4, 'Groups': 2, 'SavedCalls': 2})
+
+    def test_plan_is_disabled_without_a_threshold(self):
+        with support.Environment(DedupThreshold=None):
+            self.assertEqual(frame_dedup.plan(None, 'bucket', [key(1)]), None)
+
+
+class ExpandFacesTest(unittest.TestCase):
+
+    def test_faces_are_copied_to_the_duplicate_frames(self):
+        faces = FaceTable()
+        faces.add('a', 1, BOX, 3, 0.5)
+        faces.add('b', 4, BOX, 4)
+        frame_dedup.expand_faces(faces, {key(1): [key(2), key(3)], key(4): []})
+
+        self.assertEqual(sorted(faces.face_ids()), ['a', 'a-00002', 'a-00003', 'b'])
+        for faceId, frameNumber in (('a-00002', 2), ('a-00003', 3)):
+            self.assertEqual(faces.frame_number(faceId), frameNumber)
+            self.assertEqual(faces.bounding_box(faceId), faces.bounding_box('a'))
+            self.assertEqual(faces.person_id(faceId), 3)
+            self.assertEqual(faces.quality(faceId), 0.5)
@@ -0,0 +1,67 @@
+import threading
+import unittest
+
+import support
+
+from frame_fetcher import FrameFetcher, kept_frames
+
+
+class Image(object):
+
+    def __init__(self, frameNumber):
+        self.frameNumber = frameNumber
+
+    def load(self):
+        pass
+
+
+class FrameFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.loads = []
+
+    def load(self, frameNumber):
+        with self.lock:
+            self.loads.append(frameNumber)
+        if frameNumber < 0:
+            raise IOError(frameNumber)
+        return Image(frameNumber)
+
+    def fetch_all(self, frameNumbers, capacity):
+        fetcher = FrameFetcher(self.load, capacity, threads=2)
+        fetcher.prefetch(frameNumbers)
+        for frameNumber in frameNumbers:
+            self.assertEqual(fetcher.get(frameNumber).frameNumber, frameNumber)
+        return fetcher
+
+    def test_each_frame_is_downloaded_once(self):
+        # Frame 1 is shared by people far apart in the prefetch order
+        frameNumbers = [1, 2, 3, 4, 1, 5, 6, 7, 8, 1, 9, 2]
+        for capacity in (1, 2, 4, 32):
+            del self.loads[:]
+            fetcher = self.fetch_all(frameNumbers, capacity)
+            self.assertEqual(sorted(self.loads), sorted(set(frameNumbers)))
+            self.assertEqual(fetcher.downloads, len(set(frameNumbers)))
+
+    def test_frames_are_released_after_their_last_use(self):
+        fetcher = self.fetch_all([1, 2, 1, 3, 2], 4)
+        self.assertEqual(fetcher.cache, {})
+        self.assertEqual(fetcher.uses, {})
+        self.assertEqual(fetcher.pending, {})
+
+    def test_frames_not_prefetched_are_loaded_by_get(self):
+        fetcher = FrameFetcher(self.load, 4, threads=2)
+        self.assertEqual(fetcher.get(7).frameNumber, 7)
+        self.assertEqual(fetcher.cache, {})
+
+    def test_download_errors_are_raised_by_get(self):
+        fetcher = FrameFetcher(self.load, 4, threads=2)
+        fetcher.prefetch([-1, 2])
+        self.assertRaises(IOError, fetcher.get, -1)
+        self.assertEqual(fetcher.get(2).frameNumber, 2)
+
+    def test_kept_frames_is_the_largest_number_of_frames_used_again(self):
+        self.assertEqual(kept_frames([1, 2, 3]), 0)
+        self.assertEqual(kept_frames([1, 2, 1, 3, 2]), 2)
+        self.assertEqual(kept_frames([1, 2, 3, 4, 1, 5, 6, 7, 8, 1, 9, 2]), 2)
@@ -0,0 +1,121 @@
+import unittest
+
+import support
+
+import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = metrics.ListSink()
+        self.metrics = metrics.Metrics(self.sink)
+        self.metrics.begin('second_function')
+
+    def metric_names(self, document):
+        return [metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']]
+
+    def test_document_shape(self):
+        self.metrics.count('IndexFacesCalls', 3)
+        self.metrics.flush()
+
+        document, = self.sink.documents
+        directive, = document['_aws']['CloudWatchMetrics']
+        self.assertEqual(directive['Namespace'], metrics.DEFAULT_NAMESPACE)
+        self.assertEqual(directive['Dimensions'], [['FunctionName']])
+        self.assertEqual(document['FunctionName'], 'second_function')
+        self.assertTrue(isinstance(document['_aws']['Timestamp'], int))
+        for metric in directive['Metrics']:
+            self.assertTrue(metric['Name'] in document)
+            self.assertTrue(metric['Unit'] in ('Count', 'Milliseconds'))
+        self.assertEqual(document['IndexFacesCalls'], 3)
+
+    def test_single_sample_histograms_only_get_max_and_count(self):
+        self.metrics.observe('IndexFacesTime', 12.0)
+        for value in (1.0, 2.0, 3.0):
+            self.metrics.observe('IndexFacesLatency', value)
+        self.metrics.flush()
+
+        names = set(self.metric_names(self.sink.documents[0]))
+        self.assertTrue(set(['IndexFacesTimeMax', 'IndexFacesTimeCount']) <= names)
+        self.assertFalse('IndexFacesTimeP50' in names)
+        self.assertTrue(set(['IndexFacesLatencyP50', 'IndexFacesLatencyP95', 'IndexFacesLatencyP99', 'IndexFacesLatencyMax']) <= names)
+        self.assertEqual(self.sink.documents[0]['IndexFacesLatencyMax'], 3.0)
+
+    def test_documents_hold_at_most_100_metrics(self):
+        for i in range(150):
+            self.metrics.count('Counter{:03d}'.format(i))
+        for i in range(20):
+            self.metrics.observe('Latency{:02d}'.format(i), 1.0)
+            self.metrics.observe('Latency{:02d}'.format(i), 2.0)
+        self.metrics.flush()
+
+        names = []
+        for document in self.sink.documents:
+            documentNames = self.metric_names(document)
+            self.assertTrue(len(documentNames) <= metrics.MAX_METRICS)
+            self.assertEqual(document['FunctionName'], 'second_function')
+            names.extend(documentNames)
+        # 150 counters, 5 values for each of the 20 histograms and the
+        # invocation time
+        self.assertEqual(len(names), 251)
+        self.assertEqual(len(set(names)), 251)
+        self.assertEqual(len(self.sink.documents), 3)
+
+    def test_combined_pipeline_invocation(self):
+        with support.Environment(CombinedPipeline='true'):
+            fake, event = support.fake_video(60)
+            import second_function
+            metrics.set_sink(self.sink)
+            try:
+                support.quietly(second_function.lambda_handler, event, None)
+            finally:
+                metrics.set_sink(None)
+
+        # The gauges are written in documents of their own, the other
+        # metrics by flush()
+        flushed = [document for document in self.sink.documents if 'InvocationTime' in document]
+        self.assertTrue(flushed)
+        for document in self.sink.documents:
+            self.assertTrue(len(self.metric_names(document)) <= metrics.MAX_METRICS)
+
+    def test_begin_reads_the_sink_and_the_namespace(self):
+        with support.Environment(MetricsSink='none', MetricsNamespace=None):
+            invocationMetrics = metrics.begin('second_function')
+            metrics.flush()
+        self.assertTrue(isinstance(invocationMetrics.sink, metrics.NullSink))
+        self.assertEqual(invocationMetrics.namespace, metrics.DEFAULT_NAMESPACE)
+
+        with support.Environment(MetricsSink='stdout', MetricsNamespace='Test'):
+            invocationMetrics = metrics.begin('second_function')
+            support.quietly(metrics.flush)
+        self.assertTrue(isinstance(invocationMetrics.sink, metrics.StdoutSink))
+        self.assertEqual(invocationMetrics.namespace, 'Test')
+
+    # The shard workers invoked in-process by the coordinator run in the
+    # threads of the 'shards' executor
+    def test_in_process_invocations_keep_their_own_metrics(self):
+        with support.Environment(SearchSkipMinMatches='0', ShardSize='20'):
+            fake, event = support.fake_video(60)
+            import second_function
+            fake.client('lambda').register('second_function', second_function.lambda_handler)
+            metrics.set_sink(self.sink)
+            try:
+                support.quietly(second_function.lambda_handler, event, None)
+            finally:
+                metrics.set_sink(None)
+
+        flushed = [document for document in self.sink.documents if 'InvocationTime' in document]
+        coordinator, = [document for document in flushed if 'People' in document]
+        workers = [document for document in flushed if not 'People' in document]
+        invocations = fake.client('lambda').invocations
+        self.assertEqual(len(workers), len(invocations))
+        self.assertEqual(coordinator['InvokeCalls'], len(invocations))
+        for document in workers:
+            self.assertFalse('InvokeCalls' in document)
+            self.assertTrue(document.get('IndexFacesCalls', 0) <= 20)
+        self.assertEqual(sum(document.get('IndexFacesCalls', 0) for document in flushed), fake.calls['index_faces'])
+        self.assertTrue(metrics.current() is metrics._default)
+
+if __name__ == '__main__':
+    unittest.main()
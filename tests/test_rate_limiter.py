@@ -0,0 +1,52 @@
+import time
+import unittest
+
+import support
+
+import rate_limiter
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_a_new_bucket_does_not_burst_above_the_rate(self):
+        bucket = rate_limiter.TokenBucket(100)
+        self.assertEqual(bucket.capacity, 100 * rate_limiter.BURST_SECONDS)
+
+        startTime = time.time()
+        for i in range(21):
+            bucket.acquire()
+        # The first token is free, the next 20 come at 100 per second
+        self.assertTrue(time.time() - startTime >= 0.19)
+
+    def test_the_burst_after_an_idle_period_is_limited(self):
+        bucket = rate_limiter.TokenBucket(100)
+        time.sleep(0.3)
+        startTime = time.time()
+        for i in range(20):
+            bucket.acquire()
+        self.assertTrue(time.time() - startTime >= 0.09)
+
+
+class AdaptiveRateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = rate_limiter.AdaptiveRateLimiter('search_faces', 50, minRate=2, cooldown=0)
+
+    def test_throttling_errors_reduce_the_rate_down_to_the_minimum(self):
+        for i in range(10):
+            support.quietly(self.limiter.record_throttle)
+        self.assertEqual(self.limiter.rate, 2)
+
+    def test_set_share_scales_the_configured_rates(self):
+        self.limiter.set_share(0.01)
+        self.assertEqual(self.limiter.rate, 0.5)
+        self.assertEqual(self.limiter.minRate, 0.5)
+
+        self.limiter.set_share(1.0)
+        self.assertEqual(self.limiter.rate, 50)
+        self.assertEqual(self.limiter.maxRate, 50)
+        self.assertEqual(self.limiter.minRate, 2)
+
+        for i in range(10):
+            support.quietly(self.limiter.record_throttle)
+        self.assertEqual(self.limiter.rate, 2)
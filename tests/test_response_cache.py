@@ -0,0 +1,87 @@
+import hashlib
+import unittest
+from StringIO import StringIO
+
+import support
+
+import response_cache
+from response_cache import MemoryCacheStorage, ResponseCache
+
+
+class S3(object):
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        return {'Body': StringIO(self.objects[Key])}
+
+
+class BrokenStorage(object):
+
+    def get(self, key):
+        raise IOError(key)
+
+    def put(self, key, value):
+        raise IOError(key)
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s3 = S3({'a.png': 'image', 'b.png': 'image', 'c.png': 'other image'})
+        self.storage = MemoryCacheStorage()
+        self.cache = ResponseCache(self.storage, self.s3)
+        self.requests = []
+
+    def request(self, response):
+        def call():
+            self.requests.append(response)
+            return dict(response, ResponseMetadata={'RequestId': len(self.requests)})
+        return call
+
+    def call(self, key, response, **kwargs):
+        return self.cache.call('index_faces', 'bucket', key, self.request(response), **kwargs)
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.call('a.png', {'FaceRecords': []})['ResponseMetadata'], {'RequestId': 1})
+        self.assertEqual(self.call('a.png', {'FaceRecords': [1]}), {'FaceRecords': []})
+        self.assertEqual(len(self.requests), 1)
+
+        # Other parameters change the response
+        self.call('a.png', {'FaceRecords': [2]}, parameters={'MaxFaces': 1})
+        self.assertEqual(len(self.requests), 2)
+
+    def test_the_key_is_the_hash_of_the_content(self):
+        self.call('a.png', {'FaceRecords': []})
+        self.assertEqual(self.call('b.png', {'FaceRecords': [1]}), {'FaceRecords': []})
+        self.call('c.png', {'FaceRecords': [2]})
+        self.assertEqual(self.requests, [{'FaceRecords': []}, {'FaceRecords': [2]}])
+        apiName, contentHash, parametersHash = self.cache.cache_key('index_faces', 'image', {}).split('/')
+        self.assertEqual(apiName, 'index_faces')
+        self.assertEqual(contentHash, hashlib.sha256('image').hexdigest())
+
+    def test_failed_and_rejected_calls_are_not_cached(self):
+        def fail():
+            raise IOError('IndexFaces failed')
+
+        self.assertRaises(IOError, self.cache.call, 'index_faces', 'bucket', 'a.png', fail)
+        cacheable = lambda response: not response['FaceRecords']
+        self.call('a.png', {'FaceRecords': [1]}, cacheable=cacheable)
+        self.call('a.png', {'FaceRecords': []}, cacheable=cacheable)
+        self.call('a.png', {'FaceRecords': [2]}, cacheable=cacheable)
+        self.assertEqual(self.requests, [{'FaceRecords': [1]}, {'FaceRecords': []}])
+
+    def test_storage_errors_call_the_api(self):
+        cache = ResponseCache(BrokenStorage(), self.s3)
+        for i in range(2):
+            response = support.quietly(cache.call, 'index_faces', 'bucket', 'a.png', self.request({'FaceRecords': []}))
+            self.assertEqual(response['FaceRecords'], [])
+        self.assertEqual(len(self.requests), 2)
+
+    def test_disabled_cache(self):
+        with support.Environment(ResponseCache=None):
+            cache = response_cache.get_cache(self.s3)
+        cache.call('index_faces', 'bucket', 'missing.png', self.request({}))
+        cache.call('index_faces', 'bucket', 'missing.png', self.request({}))
+        self.assertEqual(len(self.requests), 2)
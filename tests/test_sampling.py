@@ -0,0 +1,44 @@
+import unittest
+
+import support
+
+import sampling
+
+
+def key(frameNumber):
+    return 'thumbnails/job-{:05d}.png'.format(frameNumber)
+
+
+def keys(frameNumbers):
+    return [key(frameNumber) for frameNumber in frameNumbers]
+
+
+class SamplingPlanTest(unittest.TestCase):
+
+    def test_coarse_keys_take_one_frame_every_step_and_the_last_frame(self):
+        plan = sampling.SamplingPlan(keys(range(12, 0, -1)), 5, [])
+        self.assertEqual(plan.coarseKeys, keys([1, 6, 11, 12]))
+
+        plan = sampling.SamplingPlan(keys(range(1, 12)), 5, [])
+        self.assertEqual(plan.coarseKeys, keys([1, 6, 11]))
+
+    def test_frames_are_refined_around_faces(self):
+        plan = sampling.SamplingPlan(keys(range(1, 17)), 5, [])
+        self.assertEqual(support.quietly(plan.refine_keys, set()), [])
+        # Faces in frame 6 refine the frames on both sides
+        self.assertEqual(support.quietly(plan.refine_keys, set([6])), keys([2, 3, 4, 5, 7, 8, 9, 10]))
+
+    def test_the_first_and_last_frames_are_refined(self):
+        plan = sampling.SamplingPlan(keys(range(1, 14)), 5, [])
+        self.assertEqual(support.quietly(plan.refine_keys, set([1])), keys([2, 3, 4, 5]))
+        self.assertEqual(support.quietly(plan.refine_keys, set([13])), keys([12]))
+
+    def test_frames_are_refined_after_a_scene_change(self):
+        plan = sampling.SamplingPlan(keys(range(1, 17)), 5, [key(11)])
+        self.assertEqual(support.quietly(plan.refine_keys, set()), keys([12, 13, 14, 15]))
+
+    def test_plan_is_disabled_without_a_step(self):
+        with support.Environment(SamplingStep=None):
+            self.assertEqual(sampling.plan(None, 'bucket', keys([1, 2])), None)
+        with support.Environment(SamplingStep='4'):
+            self.assertEqual(sampling.plan(None, 'bucket', keys([1, 2]), [key(1)]).sceneChanges, [key(1)])
@@ -0,0 +1,58 @@
+import unittest
+
+import support
+
+import second_function
+from search_scheduler import SearchScheduler
+
+
+class SearchSchedulerTest(unittest.TestCase):
+
+    def test_skips_a_face_matched_by_enough_faces_of_one_cluster(self):
+        scheduler = SearchScheduler(2)
+        scheduler.record('a', ['b', 'x'])
+        self.assertFalse(scheduler.skip('x'))
+
+        # 'a' and 'b' match each other, so they form one tentative cluster
+        scheduler.record('b', ['a', 'x'])
+        self.assertTrue(scheduler.skip('x'))
+        self.assertEqual(scheduler.skipped, set(['x']))
+        self.assertEqual(scheduler.inferred_matches('x'), ['a', 'b'])
+
+    def test_matches_from_different_clusters_are_not_added_up(self):
+        scheduler = SearchScheduler(2)
+        scheduler.record('a', ['x'])
+        scheduler.record('b', ['x'])
+        self.assertFalse(scheduler.skip('x'))
+
+    def test_zero_min_matches_searches_every_face(self):
+        scheduler = SearchScheduler(0)
+        scheduler.record('a', ['b', 'x'])
+        scheduler.record('b', ['a', 'x'])
+        self.assertFalse(scheduler.skip('x'))
+        self.assertEqual(list(scheduler.waves(['a', 'b', 'x'])), [['a', 'b', 'x']])
+
+    def test_waves_decide_the_skips_from_the_previous_waves_only(self):
+        scheduler = SearchScheduler(2, 2)
+        waves = scheduler.waves(['a', 'b', 'c', 'd', 'e'])
+
+        self.assertEqual(next(waves), ['a', 'b'])
+        scheduler.record('a', ['b', 'c', 'd'])
+        scheduler.record('b', ['a', 'c', 'd'])
+
+        # 'c' and 'd' are placed by the first wave, and 'e' is not matched
+        # by the faces of the first wave
+        self.assertEqual(next(waves), [])
+        self.assertEqual(next(waves), ['e'])
+        self.assertEqual(scheduler.skipped, set(['c', 'd']))
+
+    def search_video(self):
+        with support.Environment(FaceTracking='false', SearchWaveSize='20', ShardSize=None):
+            fake, event = support.fake_video(150)
+            support.quietly(second_function.lambda_handler, event, None)
+            return fake.calls.get('search_faces'), support.output_json(fake)['People']
+
+    def test_the_searches_do_not_depend_on_the_timing_of_the_threads(self):
+        searches, people = self.search_video()
+        for i in range(2):
+            self.assertEqual(self.search_video(), (searches, people))
@@ -0,0 +1,145 @@
+import unittest
+
+import support
+
+import second_function
+import sharding
+
+
+def people_of(output):
+    return [[frame['FrameNumber'] for frame in person['Frames']] for person in output['People']]
+
+
+class RecordingLocalInvoker(sharding.LocalInvoker):
+
+    def __init__(self, *args, **kwargs):
+        sharding.LocalInvoker.__init__(self, *args, **kwargs)
+        self.results = []
+
+    def invoke(self, event):
+        result = sharding.LocalInvoker.invoke(self, event)
+        self.results.append(result)
+        return result
+
+
+class ShardingTest(unittest.TestCase):
+
+    def run_video(self, numberFrames, **environment):
+        with support.Environment(SearchSkipMinMatches='0', **environment):
+            fake, event = support.fake_video(numberFrames)
+            fake.client('lambda').register('second_function', second_function.lambda_handler)
+            invoker = sharding.LambdaInvoker('second_function', parallelism=3)
+            support.quietly(second_function.lambda_handler, event, None, invoker)
+            return fake, support.output_json(fake)
+
+    def test_sharded_output_equals_unsharded_output(self):
+        fake, unsharded = self.run_video(60)
+        self.assertEqual(fake.client('lambda').invocations, [])
+
+        fake, sharded = self.run_video(60, ShardSize='20')
+        invocations = fake.client('lambda').invocations
+        self.assertTrue(len(invocations) >= 3)
+        self.assertEqual(sharded['Failures'], [])
+        self.assertTrue(unsharded['People'])
+        self.assertEqual(people_of(sharded), people_of(unsharded))
+
+    def test_run_shards_dispatches_the_unprocessed_items_again(self):
+        class Invoker(object):
+            parallelism = 2
+
+            def __init__(self):
+                self.calls = []
+
+            def invoke_all(self, events):
+                results = []
+                for event in events:
+                    items = event['Shard']['Items']
+                    self.calls.append(items)
+                    # The first shard of the first round fails, the other
+                    # workers leave their last item unprocessed
+                    if len(self.calls) == 1:
+                        results.append(None)
+                    else:
+                        results.append({'Processed': items[:-1] if len(self.calls) < 3 else items})
+                return results
+
+        invoker = Invoker()
+        results = support.quietly(list, sharding.run_shards(invoker, 'IndexFaces', 'collection', range(6), 3))
+        processed = set()
+        for result in results:
+            processed.update(result['Processed'])
+
+        self.assertEqual(processed, set(range(6)))
+        self.assertEqual(invoker.calls[:2], [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(sorted(invoker.calls[2]), [0, 1, 2])
+
+    def test_run_shards_stops_at_the_deadline(self):
+        class Checkpoint(object):
+
+            def __init__(self):
+                self.saved = []
+
+            def deadline_reached(self):
+                return len(self.saved) >= 1
+
+            def deadline(self):
+                return 1234.0
+
+            def save(self, stage):
+                self.saved.append(stage)
+
+        class Invoker(object):
+            parallelism = 2
+
+            def __init__(self):
+                self.events = []
+
+            def invoke_all(self, events):
+                self.events.extend(events)
+                return [None for event in events]
+
+        invoker = Invoker()
+        checkpoint = Checkpoint()
+        support.quietly(list, sharding.run_shards(invoker, 'SearchFaces', 'collection', range(4), 2, checkpoint=checkpoint))
+
+        self.assertEqual(len(invoker.events), 2)
+        self.assertEqual(set(event['Shard']['Deadline'] for event in invoker.events), set([1234.0]))
+        self.assertEqual(checkpoint.saved, ['SearchFaces'])
+
+    def test_coordinator_without_a_context_invokes_second_function(self):
+        with support.Environment(SearchSkipMinMatches='0', ShardSize='20', AWS_LAMBDA_FUNCTION_NAME=None):
+            fake, event = support.fake_video(60)
+            fake.client('lambda').register('second_function', second_function.lambda_handler)
+            support.quietly(second_function.lambda_handler, event, None)
+            invocations = fake.client('lambda').invocations
+            self.assertTrue(invocations)
+            self.assertEqual(set(i['FunctionName'] for i in invocations), set(['second_function']))
+            self.assertEqual(support.output_json(fake)['Failures'], [])
+
+    def test_sharded_output_through_local_processes(self):
+        fake, unsharded = self.run_video(60)
+
+        with support.Environment(SearchSkipMinMatches='0', ShardSize='20'):
+            fake, event = support.fake_video(60)
+            invoker = RecordingLocalInvoker('second_function', parallelism=3)
+            try:
+                support.quietly(second_function.lambda_handler, event, None, invoker)
+            finally:
+                invoker.close()
+            sharded = support.output_json(fake)
+
+        # The calls of the workers were made on the fake of this process
+        self.assertTrue(len(invoker.results) >= 3)
+        self.assertFalse(None in invoker.results)
+        self.assertEqual(fake.client('lambda').invocations, [])
+        self.assertTrue(fake.calls['index_faces'] >= 60)
+        self.assertEqual(sharded['Failures'], [])
+        self.assertEqual(people_of(sharded), people_of(unsharded))
+
+    def test_unregistered_function_fails(self):
+        fake, event = support.fake_video(1)
+        self.assertRaises(Exception, fake.client('lambda').invoke, FunctionName='missing', Payload='{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
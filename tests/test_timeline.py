@@ -0,0 +1,52 @@
+import unittest
+
+import support
+
+import timeline
+
+
+BOX = {'Left': 0.4, 'Top': 0.3, 'Width': 0.2, 'Height': 0.3}
+
+
+def face(frameNumber, matchConfidence=90.0, boundingBox=BOX):
+    return {'FrameNumber': frameNumber, 'MatchConfidence': matchConfidence, 'BoundingBox': boundingBox}
+
+
+def spans(intervals):
+    return [(interval['StartFrame'], interval['EndFrame']) for interval in intervals]
+
+
+class MergeIntervalsTest(unittest.TestCase):
+
+    def test_gaps_up_to_max_gap_are_merged(self):
+        faces = [face(frameNumber) for frameNumber in (1, 2, 3, 5, 8)]
+        self.assertEqual(spans(timeline.merge_intervals(faces)), [(1, 3), (5, 5), (8, 8)])
+        self.assertEqual(spans(timeline.merge_intervals(faces, 2)), [(1, 5), (8, 8)])
+        self.assertEqual(spans(timeline.merge_intervals(faces, 3)), [(1, 8)])
+
+    def test_single_frame(self):
+        interval, = timeline.merge_intervals([face(61, 80.0)])
+        self.assertEqual(interval['StartTimePosition'], '0:01:01')
+        self.assertEqual(interval['EndTimePosition'], '0:01:01')
+        self.assertEqual(interval['Duration'], 1)
+        self.assertEqual(interval['NumberFrames'], 1)
+        self.assertEqual(interval['MeanMatchConfidence'], 80.0)
+        self.assertEqual(interval['BoundingBoxFrame'], 61)
+        self.assertEqual(timeline.merge_intervals([]), [])
+
+    def test_unsorted_faces(self):
+        best = dict(BOX, Left=0.1)
+        faces = [face(4, 70.0), face(2, 95.0, best), face(1, 80.0), face(3, 90.0)]
+        interval, = timeline.merge_intervals(faces)
+        self.assertEqual(spans([interval]), [(1, 4)])
+        self.assertEqual(interval['Duration'], 4)
+        self.assertEqual(interval['MeanMatchConfidence'], 83.75)
+        self.assertEqual(interval['MaxMatchConfidence'], 95.0)
+        self.assertEqual(interval['BoundingBox'], best)
+        self.assertEqual(interval['BoundingBoxFrame'], 2)
+
+    def test_add_appearances(self):
+        celebs = {'c': {'Faces': dict((str(frameNumber), face(frameNumber)) for frameNumber in (7, 1, 2))}}
+        timeline.add_appearances(celebs, keepFrames=False, maxGap=1)
+        self.assertEqual(spans(celebs['c']['Appearances']), [(1, 2), (7, 7)])
+        self.assertFalse('Faces' in celebs['c'])
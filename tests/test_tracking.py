@@ -0,0 +1,70 @@
+import unittest
+
+import support
+
+import clustering
+import second_function
+import tracking
+from face_table import FaceTable
+
+
+BOX = {'Left': 0.4, 'Top': 0.3, 'Width': 0.2, 'Height': 0.3}
+
+
+def people_of(output):
+    return [[frame['FrameNumber'] for frame in person['Frames']] for person in output['People']]
+
+
+class TrackingTest(unittest.TestCase):
+
+    # Person 'a' in frames 1 to 8, then a cut to person 'b' at the same
+    # place in frames 9 and 10: both representatives fall before the cut
+    def cut_table(self):
+        faces = FaceTable()
+        for frameNumber in range(1, 11):
+            faces.add('{}{}'.format('a' if frameNumber <= 8 else 'b', frameNumber), frameNumber, BOX)
+        return faces
+
+    def test_faces_at_the_same_place_in_consecutive_frames_form_one_track(self):
+        faces = self.cut_table()
+        faces.add('c1', 1, {'Left': 0.0, 'Top': 0.0, 'Width': 0.1, 'Height': 0.1})
+        tracks = tracking.track_faces(faces)
+        self.assertEqual(sorted(len(track) for track in tracks), [1, 10])
+
+    def test_the_faces_after_a_cut_are_unconfirmed(self):
+        faces = self.cut_table()
+        track, = tracking.track_faces(faces)
+        self.assertEqual(tracking.representatives(track), ['a3', 'a8'])
+
+        personA = ['a{}'.format(i) for i in range(1, 9)]
+        for faceId in tracking.representatives(track):
+            faces.set_matches(faceId, [i for i in personA if i != faceId])
+        self.assertEqual(tracking.unconfirmed_faces(faces, [track]), ['b9', 'b10'])
+
+        faces.set_matches('b9', ['b10'])
+        faces.set_matches('b10', ['b9'])
+        tracking.propagate_matches(faces, [track])
+        self.assertEqual(faces.matching_faces('a1'), sorted(set(personA) - set(['a1'])))
+        self.assertEqual(faces.matching_faces('b9'), ['b10'])
+
+        personIds = clustering.cluster_table(faces)
+        self.assertNotEqual(personIds[faces.indexes['a1']], personIds[faces.indexes['b9']])
+
+    def test_unconfirmed_faces_wait_for_the_representatives(self):
+        faces = self.cut_table()
+        tracks = tracking.track_faces(faces)
+        self.assertEqual(tracking.unconfirmed_faces(faces, tracks), [])
+
+    def run_video(self, numberFrames, faceTracking):
+        with support.Environment(FaceTracking=faceTracking, ShardSize=None):
+            fake, event = support.fake_video(numberFrames)
+            support.quietly(second_function.lambda_handler, event, None)
+            return fake.calls.get('search_faces'), people_of(support.output_json(fake))
+
+    # The people of the fake video overlap, so some tracks join two people
+    def test_tracking_finds_the_people_found_without_tracking(self):
+        for numberFrames in (150, 300):
+            searches, people = self.run_video(numberFrames, 'true')
+            exactSearches, exactPeople = self.run_video(numberFrames, 'false')
+            self.assertEqual(people, exactPeople)
+            self.assertTrue(searches < exactSearches)